@@ -1,14 +1,24 @@
-from traceback import print_tb
+import os
+import sys
 
-import chardet
+import numpy as np
 import pandas as pd
 
+# 共通のマージ処理（kuzen-import-csv/csv_merge_engine.py）を使う
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'kuzen-import-csv'))
+from csv_fingerprint_store import FingerprintStore
+from csv_merge_engine import (apply_updates, build_key_index, lookup_keys, plan_usecols, print_column_plan,
+                              read_columns, read_two_row_header_csv, select_delta)
+from csv_snapshot_cache import SnapshotCache
+
 
 def update_customer_data(system_a_csv, system_b_csv, output_csv,
                          key_a='顧客番号', key_b='顧客番号',
-                         columns_to_update=None):
+                         columns_to_update=None, fingerprint_store=None, full_resync=False, snapshot_cache=None,
+                         delta=False, drop_unchanged_columns=False):
     """
     システムAのデータを使ってシステムBのデータを上書き更新する関数
+    システムBの各行を顧客番号でシステムAの行に対応付け、カラム単位でまとめて更新する
 
     Parameters:
     - system_a_csv: システムAのCSVファイルパス（更新元）
@@ -17,6 +27,14 @@ def update_customer_data(system_a_csv, system_b_csv, output_csv,
     - key_a: システムAでの顧客番号カラム名
     - key_b: システムBでの顧客番号カラム名
     - columns_to_update: 更新するカラムのマッピング辞書 {'システムBのカラム名': 'システムAのカラム名'}
+    - fingerprint_store: 指定した場合、このファイルに保存した前回のフィンガープリントと比べて、
+      新しく追加された、または更新に使うカラムの値が変わったシステムAの行だけを処理する（正常に終了したら、
+      システムBの行に対応付けたキーの分だけ保存し直す）
+    - full_resync: True の場合、fingerprint_store があってもすべての行を処理する
+    - snapshot_cache: 指定した場合、システムAとシステムBのファイルを読み込んだ結果をこのディレクトリにParquet形式で保存し、
+      2回目以降は同じ内容のファイルをCSVを解析せずに読み込む（pyarrow が必要。ない場合は毎回CSVを読み込む）
+    - delta: True の場合、1セル以上更新された行だけを出力CSVに書き込む（カラム名の行はそのまま）
+    - drop_unchanged_columns: delta の場合に、どの行でも更新されなかったカラムも除く（顧客番号のカラムは残す）
     """
     try:
         # システムAのCSVファイルを読み込む
@@ -32,24 +50,34 @@ def update_customer_data(system_a_csv, system_b_csv, output_csv,
         for col, cat in category_dict.items():
             print(f"{col}: {cat}")
 
+        # マッピング辞書から更新に使うシステムAのカラムを求め、そのカラムだけを読み込む
+        # （マッピング辞書を指定しない場合はシステムBと同名のカラムを更新するので、全カラムを読み込む）
+        if columns_to_update is None:
+            columns_a = read_columns(system_a_csv, header=1, encoding="CP932")
+        else:
+            columns_a = [key_a, *columns_to_update.values()]
+        plan = plan_usecols(system_a_csv, columns_a, optional=["氏名"], header=1, encoding="CP932")
+        if key_a in plan['missing']:
+            raise ValueError(f"システムAのCSVに '{key_a}' という列が見つかりません。")
+        print_column_plan(plan, "システムA")
+
+        # スナップショットキャッシュを使う場合は、同じ内容のファイルはCSVを解析せずに読み込む
+        snapshots = SnapshotCache(snapshot_cache) if snapshot_cache else None
+        read_csv = snapshots.read_csv if snapshots else pd.read_csv
+        read_two_row_header = snapshots.read_two_row_header_csv if snapshots else read_two_row_header_csv
+
         # データ部分を読み込む
-        df_a = pd.read_csv(system_a_csv, header=1, encoding="CP932", dtype={key_a: str})
+        df_a = read_csv(system_a_csv, header=1, encoding="CP932", dtype={key_a: str}, usecols=plan['usecols'])
         print(f"システムAのデータ: {len(df_a)}行, {len(df_a.columns)}列")
         print(df_a[[key_a]].head())  # 顧客番号のカラムを表示
 
         # システムBのCSVファイルを読み込む
         print(f"\nシステムBのCSVファイル '{system_b_csv}' を読み込んでいます...")
-        with open(system_b_csv, 'rb') as f:
-            result = chardet.detect(f.read())
-
-        print(f"検出されたエンコーディング: {result['encoding']} (信頼度: {result['confidence']})")
-
-        # 検出されたエンコーディングを使用
-        df_b = pd.read_csv(system_b_csv, header=1, encoding=result['encoding'], dtype={key_b: str})
+        # ファイルの先頭から推定したエンコーディングで、1回開くだけで読み込む
+        df_b, _, encoding_b = read_two_row_header(system_b_csv, dtype={key_b: str})
+        print(f"検出されたエンコーディング: {encoding_b}")
 
         # キー列の存在チェック
-        if key_a not in df_a.columns:
-            raise ValueError(f"システムAのCSVに '{key_a}' という列が見つかりません。")
         if key_b not in df_b.columns:
             raise ValueError(f"システムBのCSVに '{key_b}' という列が見つかりません。")
 
@@ -76,48 +104,62 @@ def update_customer_data(system_a_csv, system_b_csv, output_csv,
         df_a_clean = df_a.dropna(subset=[key_a])
         print(f"\n有効なデータ行数: {len(df_a_clean)}行（除外された行数: {len(df_a) - len(df_a_clean)}行）")
 
-        # 顧客番号をキーにして辞書を作成（高速なルックアップのため）
-        system_a_dict = df_a_clean.set_index(key_a).to_dict(orient='index')
-
-        # 更新前の状態をバックアップ
-        df_b_original = df_b.copy()
-
-        # 更新カウンタ
-        updated_rows = 0
-        updated_cells = 0
-
-        # システムBの各行を処理
-        for idx, row in df_b.iterrows():
-            customer_id = row[key_b]
-
-            # システムAにこの顧客番号が存在する場合、データを更新
-            if customer_id in system_a_dict:
-                row_updated = False
-
-                for b_col, a_col in columns_to_update.items():
-                    if a_col in system_a_dict[customer_id]:
-                        # 元の値と新しい値を取得
-                        original_value = df_b.at[idx, b_col]
-                        new_value = system_a_dict[customer_id][a_col]
-
-                        # 値が異なる場合のみ更新
-                        if original_value != new_value:
-                            df_b.at[idx, b_col] = new_value
-                            updated_cells += 1
-                            row_updated = True
-
-                if row_updated:
-                    updated_rows += 1
-            # システムAに顧客番号が存在しない場合、データを表示したい
-            if type(customer_id) == float:
-                print(f"システムBの顧客番号 '{customer_id}' はシステムAに存在しません。")
+        # 前回から変わっていないシステムAの行はマージ処理に渡さない
+        store = None
+        if fingerprint_store:
+            store = FingerprintStore(fingerprint_store)
+            df_a_clean = store.filter_changed(df_a_clean, key_a, columns_a,
+                                              signature=list(columns_to_update.items()), full_resync=full_resync)
+
+        # 顧客番号をキーにしてインデックスを作成し、システムBの全行の対応先をまとめて求める
+        if df_a_clean[key_a].duplicated().any():
+            raise ValueError(f"システムAのCSVに重複した '{key_a}' があります。")
+        system_a_index = build_key_index(df_a_clean[key_a])
+        a_rows = lookup_keys(system_a_index, df_b[key_b])
+        matched = a_rows >= 0
+
+        # システムAは更新に使うカラムだけを、対応するシステムBの行の順に並べて取り出す
+        column_pairs = [(a_col, b_col) for b_col, a_col in columns_to_update.items()
+                        if a_col != key_a and a_col in df_a_clean.columns]
+        a_columns = list(dict.fromkeys(a_col for a_col, _ in column_pairs))
+        df_a_matched = df_a_clean[a_columns].iloc[a_rows[matched]]
+
+        # 値が異なるセルをカラム単位でまとめて更新する（システムAの値がNaNでも書き込む）
+        changes = {}
+        was_missing = df_b[list(dict.fromkeys(b_col for _, b_col in column_pairs))].isna() if delta else None
+        row_updated, updated_cells = apply_updates(
+            df_b, df_a_matched, np.flatnonzero(matched), column_pairs, skip_missing=False, changes=changes)
+        updated_rows = int(row_updated.sum())
+
+        # システムAに顧客番号が存在しない場合、データを表示したい
+        for customer_id in df_b[key_b][df_b[key_b].isna()]:
+            print(f"システムBの顧客番号 '{customer_id}' はシステムAに存在しません。")
 
         # 更新統計
         print(f"\n更新統計: {len(df_b)}行中{updated_rows}行が更新されました（更新セル数: {updated_cells}）")
 
         # 結果を出力CSVに保存
-        df_b.to_csv(output_csv, index=False)
+        if delta:
+            # NaNのセルにNaNを書き込んだ場合は値が変わらないので、更新されたセルに含めない
+            # （更新統計は従来どおり 1セルずつ != で比較した場合の数のまま）
+            for b_col, positions in list(changes.items()):
+                unchanged = was_missing[b_col].to_numpy() & df_b[b_col].isna().to_numpy()
+                positions = [rows[~unchanged[rows]] for rows in positions]
+                if any(len(rows) for rows in positions):
+                    changes[b_col] = positions
+                else:
+                    del changes[b_col]
+            # 更新された行（と更新されたカラム）だけを書き込む（このスクリプトの出力にはカテゴリ行がない）
+            df_output, _ = select_delta(df_b, '', changes, keep_columns=[key_b],
+                                        drop_unchanged_columns=drop_unchanged_columns)
+            print(f"出力した行数: {len(df_output)}件、列数: {len(df_output.columns)}列（更新された行のみ）")
+            df_output.to_csv(output_csv, index=False)
+        else:
+            df_b.to_csv(output_csv, index=False)
         print(f"\n結果を '{output_csv}' に保存しました。")
+        if store is not None:
+            # システムBの行に対応付けたキーの分だけ保存する（システムBにまだない顧客は次回も処理する）
+            store.save(df_a_clean[key_a].iloc[a_rows[matched]])
 
         return df_b
 
@@ -1,16 +1,65 @@
+import os
+import sys
+
 import pandas as pd
 import chardet
-from pyasn1.type import tag
+
+# 共通のマージ処理（kuzen-import-csv/csv_merge_engine.py）を使う
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'kuzen-import-csv'))
+from csv_cp932_writer import write_cp932_csv
+from csv_fingerprint_store import FingerprintStore
+from csv_merge_engine import (apply_tags, apply_updates, build_multi_slot_index, lookup_multi_slot, plan_usecols,
+                              print_column_plan, read_two_row_header_csv, select_delta, update_in_chunks,
+                              TAG_SOURCE_COLUMN)
+from csv_snapshot_cache import SnapshotCache
+
+
+def _print_key_conflicts(conflicts, key_columns):
+    """複数のスロット、または同じスロットの複数行にある顧客番号を表示する"""
+    if conflicts['multi_slot']:
+        print(f"\n警告: 複数の生徒のスロットにある顧客番号が{len(conflicts['multi_slot'])}件あります（番号の小さいスロットを使います）")
+        for customer_id, slots in conflicts['multi_slot'].items():
+            print(f"  {customer_id}: {', '.join(key_columns[slot - 1] for slot in slots)}")
+    if conflicts['duplicated']:
+        print(f"\n警告: 同じスロットの複数行にある顧客番号が{len(conflicts['duplicated'])}件あります（最後の行を使います）")
+        for customer_id, slots in conflicts['duplicated'].items():
+            print(f"  {customer_id}: {', '.join(key_columns[slot - 1] for slot in slots)}")
+
+
+def _update_rows(df_b, df_a_matched, targets, slots, slot_columns, tags, changes=None):
+    """
+    システムAの各行の値で、対応するシステムBの行をスロットごとに更新する
+    （スロットごとに更新するカラムは重ならないので、スロットの順に適用しても結果は同じ）
+    （changes を指定した場合は、更新したセルの行の位置をカラムごとに記録する）
+
+    Returns:
+    - (更新された行数, 更新されたセル数)
+    """
+    updated_rows = 0
+    updated_cells = 0
+    for slot, column_pairs in slot_columns.items():
+        in_slot = slots == slot
+        row_updated, slot_updated_cells = apply_updates(df_b, df_a_matched[in_slot], targets[in_slot], column_pairs,
+                                                        changes=changes)
+        updated_rows += int(row_updated.sum())
+        updated_cells += slot_updated_cells
+
+        if slot == 1:
+            # 校舎タグが一致するタグのカラムにフラグを立てる
+            apply_tags(df_b, df_a_matched[in_slot], targets[in_slot], tags, changes=changes)
+    return updated_rows, updated_cells
 
 
 def update_customer_data(system_a_csv, system_b_csv, output_csv,
                          key_a='顧客番号', key_b1='顧客番号', key_b2='生徒2_顧客番号', key_b3='生徒3_顧客番号',
                          tags=None,
                          columns_to_update=None,
-                         columns_to_update_student1=None, columns_to_update_student2=None, columns_to_update_student3=None):
+                         columns_to_update_student1=None, columns_to_update_student2=None, columns_to_update_student3=None,
+                         chunksize=None, encoding_errors='strict', delta=False, drop_unchanged_columns=False,
+                         fingerprint_store=None, full_resync=False, snapshot_cache=None):
     """
     システムAのデータを使ってシステムBのデータを上書き更新する関数
-    システムAのデータを基準にループ処理を行う
+    システムAの各行を生徒1〜3の顧客番号でシステムBの行に対応付け、スロットごとにカラム単位でまとめて更新する
 
     Parameters:
     - system_a_csv: システムAのCSVファイルパス（更新元）
@@ -19,6 +68,19 @@ def update_customer_data(system_a_csv, system_b_csv, output_csv,
     - key_a: システムAでの顧客番号カラム名
     - key_b: システムBでの顧客番号カラム名
     - columns_to_update: 更新するカラムのマッピング辞書 {'システムBのカラム名': 'システムAのカラム名'}
+    - chunksize: 指定した場合、システムBをこの行数ずつ読み込んで更新し、出力CSVに追記する
+      （システムB全体をメモリに保持しないため、更新後のデータフレームの代わりに出力CSVファイルパスを返す）
+    - encoding_errors: 出力CSVにCP932でエンコードできない文字があった場合の処理方法
+      （'strict' はセルの一覧を表示してエラーにする。'replace' は '?' に置き換えて、置き換えたセルの一覧を表示する）
+    - delta: True の場合、1セル以上更新された行だけを出力CSVに書き込む（カテゴリ行とカラム名の行はそのまま）
+    - drop_unchanged_columns: delta の場合に、どの行でも更新されなかったカラムも除く（生徒1〜3の顧客番号のカラムは残す。
+      chunksize とは同時に指定できない）
+    - fingerprint_store: 指定した場合、このファイルに保存した前回のフィンガープリントと比べて、
+      新しく追加された、または更新に使うカラムの値が変わったシステムAの行だけを処理する（正常に終了したら、
+      システムBの行に対応付けたキーの分だけ保存し直す）
+    - full_resync: True の場合、fingerprint_store があってもすべての行を処理する
+    - snapshot_cache: 指定した場合、システムAとシステムBのファイルを読み込んだ結果をこのディレクトリにParquet形式で保存し、
+      2回目以降は同じ内容のファイルをCSVを解析せずに読み込む（pyarrow が必要。ない場合は毎回CSVを読み込む）
     """
     try:
         # システムAのCSVファイルを読み込む
@@ -34,37 +96,58 @@ def update_customer_data(system_a_csv, system_b_csv, output_csv,
         for col, cat in category_dict.items():
             print(f"{col}: {cat}")
 
+        # 更新対象カラムの設定
+        if tags is None or columns_to_update is None or columns_to_update_student1 is None or columns_to_update_student2 is None or columns_to_update_student3 is None:
+            raise ValueError(f"関数への入力が正しくありません。")
+        if chunksize and drop_unchanged_columns:
+            raise ValueError(f"chunksize と drop_unchanged_columns は同時に指定できません。")
+
+        # マッピング辞書から更新に使うシステムAのカラムを求め、そのカラムだけを読み込む
+        columns_a = [key_a, "ステータス"]
+        for mapping in (columns_to_update, columns_to_update_student1, columns_to_update_student2,
+                        columns_to_update_student3):
+            columns_a.extend(mapping.values())
+        if tags:
+            columns_a.append(TAG_SOURCE_COLUMN)
+        plan = plan_usecols(system_a_csv, columns_a, optional=["氏名"], header=1, encoding="UTF-8")
+        if key_a in plan['missing']:
+            raise ValueError(f"システムAのCSVに '{key_a}' という列が見つかりません。")
+        if TAG_SOURCE_COLUMN in plan['missing']:
+            raise ValueError(f"システムAのCSVに '{TAG_SOURCE_COLUMN}' という列が見つかりません。")
+        print_column_plan(plan, "システムA")
+
+        # スナップショットキャッシュを使う場合は、同じ内容のファイルはCSVを解析せずに読み込む
+        snapshots = SnapshotCache(snapshot_cache) if snapshot_cache else None
+        read_csv = snapshots.read_csv if snapshots else pd.read_csv
+        read_two_row_header = snapshots.read_two_row_header_csv if snapshots else read_two_row_header_csv
+
         # データ部分を読み込む
-        df_a = pd.read_csv(system_a_csv, header=1, encoding="UTF-8", dtype=str)
+        df_a = read_csv(system_a_csv, header=1, encoding="UTF-8", dtype=str, usecols=plan['usecols'])
         print(f"システムAのデータ: {len(df_a)}行, {len(df_a.columns)}列")
         print(df_a[[key_a]].head())  # 顧客番号のカラムを表示
 
         # システムBのCSVファイルを読み込む
         print(f"\nシステムBのCSVファイル '{system_b_csv}' を読み込んでいます...")
-        # with open(system_b_csv, 'rb') as f:
-        #     result = chardet.detect(f.read())
-        #
-        # print(f"検出されたエンコーディング: {result['encoding']} (信頼度: {result['confidence']})")
-        with open(system_b_csv, 'r', encoding='CP932') as f:
-            header_line = f.readline().strip()
-
-        # 検出されたエンコーディングを使用
-        df_b = pd.read_csv(system_b_csv, header=1, encoding="CP932", dtype=str)
+        key_columns = [key_b1, key_b2, key_b3]
+        if chunksize:
+            # システムB全体は読み込まず、先に顧客番号のカラムだけを読み込む（更新はチャンクごとに行う）
+            df_b = None
+            df_b_keys, category_line, _ = read_two_row_header_csv(
+                system_b_csv, encoding="CP932", dtype=str, usecols=lambda column: column in key_columns)
+            columns_b = df_b_keys.columns
+        else:
+            df_b, category_line, _ = read_two_row_header(system_b_csv, encoding="CP932", dtype=str)
+            columns_b = df_b.columns
+        header_line = category_line.strip()
 
         # キー列の存在チェック
-        if key_a not in df_a.columns:
-            raise ValueError(f"システムAのCSVに '{key_a}' という列が見つかりません。")
-        if key_b1 not in df_b.columns:
+        if key_b1 not in columns_b:
             raise ValueError(f"システムBのCSVに '{key_b1}' という列が見つかりません。")
-        if key_b2 not in df_b.columns:
+        if key_b2 not in columns_b:
             raise ValueError(f"システムBのCSVに '{key_b2}' という列が見つかりません。")
-        if key_b3 not in df_b.columns:
+        if key_b3 not in columns_b:
             raise ValueError(f"システムBのCSVに '{key_b3}' という列が見つかりません。")
 
-        # 更新対象カラムの設定
-        if tags is None or columns_to_update is None or columns_to_update_student1 is None or columns_to_update_student2 is None or columns_to_update_student3 is None:
-            raise ValueError(f"関数への入力が正しくありません。")
-
         # print("\n--- 更新対象カラム ---")
         # for b_col, a_col in columns_to_update.items():
         #     print(f"システムB '{b_col}' ← システムA '{a_col}'")
@@ -80,125 +163,61 @@ def update_customer_data(system_a_csv, system_b_csv, output_csv,
         df_a_clean = df_a.dropna(subset=[key_a])
         print(f"\n有効なデータ行数: {len(df_a_clean)}行（除外された行数: {len(df_a) - len(df_a_clean)}行）")
 
+        # 前回から変わっていないシステムAの行はマージ処理に渡さない
+        store = None
+        if fingerprint_store:
+            store = FingerprintStore(fingerprint_store)
+            df_a_clean = store.filter_changed(
+                df_a_clean, key_a, columns_a,
+                signature=([list(mapping.items()) for mapping in (columns_to_update, columns_to_update_student1,
+                                                                   columns_to_update_student2, columns_to_update_student3)],
+                           sorted(tags.items())),
+                full_resync=full_resync)
+
         # 更新前の状態をバックアップ
         # df_b_original = df_b.copy()
 
-        # システムBの顧客番号をキーにして辞書を作成（高速なルックアップのため）
-        system_b_dict1 = {str(customer_id): idx for idx, customer_id in enumerate(df_b[key_b1])}
-        system_b_dict2 = {str(customer_id): idx for idx, customer_id in enumerate(df_b[key_b2])}
-        system_b_dict3 = {str(customer_id): idx for idx, customer_id in enumerate(df_b[key_b3])}
-
-        # 更新カウンタ
-        updated_rows = 0
-        updated_cells = 0
-        missing_customers = 0
-
-        # システムAの各行を処理 (変更部分: システムAをベースにループ)
-        for idx, row in df_a_clean.iterrows():
-            customer_id = row[key_a]
-
-            # システムBにこの顧客番号が存在するか確認
-            if str(customer_id) in system_b_dict1:
-                b_idx = system_b_dict1[str(customer_id)]
-                row_updated = False
-
-                for b_col, a_col in columns_to_update.items():
-                    if a_col in df_a_clean.columns:
-                        # 元の値と新しい値を取得
-                        original_value = df_b.at[b_idx, b_col]
-                        new_value = row[a_col]
-
-                        # システムAに値が存在していて、値が異なる場合のみ更新
-                        if original_value != new_value and not pd.isna(new_value):
-                            df_b.at[b_idx, b_col] = new_value
-                            updated_cells += 1
-                            row_updated = True
-                for tag_a_value, tag_b_column in tags.items():
-                    df_a_tag_name = row['校舎=校舎名のタグで1']
-                    if tag_a_value == df_a_tag_name:
-                        original_value = df_b.at[b_idx, tag_b_column]
-                        new_value = 1
-                        if original_value != 1:
-                            # タグが一致する場合のみ更新
-                            df_b.at[b_idx, tag_b_column] = new_value
-                for b_col, a_col in columns_to_update_student1.items():
-                    if a_col in df_a_clean.columns:
-                        # 元の値と新しい値を取得
-                        original_value = df_b.at[b_idx, b_col]
-                        new_value = row[a_col]
-
-                        # システムAに値が存在していて、値が異なる場合のみ更新
-                        if original_value != new_value and not pd.isna(new_value):
-                            df_b.at[b_idx, b_col] = new_value
-                            updated_cells += 1
-                            row_updated = True
-                if "ステータス" in df_a_clean.columns:
-                    original_value = df_b.at[b_idx, "生徒1_ステータス"]
-                    new_value = row["ステータス"]
-                    if original_value != new_value and not pd.isna(new_value):
-                        df_b.at[b_idx, "生徒1_ステータス"] = new_value
-                        updated_cells += 1
-                        row_updated = True
-
-                if row_updated:
-                    updated_rows += 1
-            elif str(customer_id) in system_b_dict2:
-                print("2!!!!!!!!!!!!!!!" + str(customer_id))
-                b_idx = system_b_dict2[str(customer_id)]
-                row_updated = False
-
-                for b_col, a_col in columns_to_update_student2.items():
-                    if a_col in df_a_clean.columns:
-                        # 元の値と新しい値を取得
-                        original_value = df_b.at[b_idx, b_col]
-                        new_value = row[a_col]
-
-                        # システムAに値が存在していて、値が異なる場合のみ更新
-                        if original_value != new_value and not pd.isna(new_value):
-                            df_b.at[b_idx, b_col] = new_value
-                            updated_cells += 1
-                            row_updated = True
-                if "ステータス" in df_a_clean.columns:
-                    original_value = df_b.at[b_idx, "生徒2_ステータス"]
-                    new_value = row["ステータス"]
-                    if original_value != new_value and not pd.isna(new_value):
-                        df_b.at[b_idx, "生徒2_ステータス"] = new_value
-                        updated_cells += 1
-                        row_updated = True
-
-                if row_updated:
-                    updated_rows += 1
-            elif str(customer_id) in system_b_dict3:
-                b_idx = system_b_dict3[str(customer_id)]
-                row_updated = False
-
-                for b_col, a_col in columns_to_update_student3.items():
-                    if a_col in df_a_clean.columns:
-                        # 元の値と新しい値を取得
-                        original_value = df_b.at[b_idx, b_col]
-                        new_value = row[a_col]
-
-                        # システムAに値が存在していて、値が異なる場合のみ更新
-                        if original_value != new_value and not pd.isna(new_value):
-                            df_b.at[b_idx, b_col] = new_value
-                            updated_cells += 1
-                            row_updated = True
-
-                if "ステータス" in df_a_clean.columns:
-                    original_value = df_b.at[b_idx, "生徒3_ステータス"]
-                    new_value = row["ステータス"]
-                    if original_value != new_value and not pd.isna(new_value):
-                        df_b.at[b_idx, "生徒3_ステータス"] = new_value
-                        updated_cells += 1
-                        row_updated = True
-
-                if row_updated:
-                    updated_rows += 1
-
-            else:
-                # システムBに顧客番号が存在しない場合
-                missing_customers += 1
-                print(f"システムAの顧客番号 '{customer_id}'、名前　'{row['氏名']}' はLinyのシステムに存在しません。")
+        # 生徒1〜3の顧客番号を1つのインデックスにまとめ、システムAの全行の対応先（行とスロット）をまとめて求める
+        # 複数のスロットにある顧客番号は生徒1 > 生徒2 > 生徒3 の順に優先する
+        system_b_index, conflicts = build_multi_slot_index(df_b_keys if df_b is None else df_b, key_columns)
+        _print_key_conflicts(conflicts, key_columns)
+        targets, slots = lookup_multi_slot(system_b_index, df_a_clean[key_a])
+        for slot in (1, 2, 3):
+            print(f"生徒{slot}の顧客番号で一致した顧客: {int((slots == slot).sum())}件")
+
+        # スロットごとに更新するカラムの組 [(システムAのカラム名, システムBのカラム名), ...]
+        slot_columns = {
+            1: list(columns_to_update.items()) + list(columns_to_update_student1.items()),
+            2: list(columns_to_update_student2.items()),
+            3: list(columns_to_update_student3.items()),
+        }
+        slot_columns = {
+            slot: [(a_col, b_col) for b_col, a_col in columns] + [("ステータス", f"生徒{slot}_ステータス")]
+            for slot, columns in slot_columns.items()
+        }
+
+        matched = slots > 0
+        df_a_matched = df_a_clean[matched]
+        matched_targets = targets[matched]
+        matched_slots = slots[matched]
+        changes = {}
+        if df_b is None:
+            updated_rows, updated_cells, output_rows = update_in_chunks(
+                system_b_csv, output_csv, header_line, matched_targets,
+                lambda df_chunk, in_chunk, chunk_targets, chunk_changes: _update_rows(
+                    df_chunk, df_a_matched[in_chunk], chunk_targets, matched_slots[in_chunk], slot_columns, tags,
+                    chunk_changes),
+                chunksize, errors=encoding_errors, delta=delta)
+        else:
+            updated_rows, updated_cells = _update_rows(
+                df_b, df_a_matched, matched_targets, matched_slots, slot_columns, tags, changes)
+
+        # システムBに顧客番号が存在しない場合
+        missing = df_a_clean[slots == 0]
+        missing_customers = len(missing)
+        if missing_customers:
+            for customer_id, name in zip(missing[key_a], missing['氏名']):
+                print(f"システムAの顧客番号 '{customer_id}'、名前　'{name}' はLinyのシステムに存在しません。")
 
         # 更新統計
         print(f"\n更新統計:")
@@ -207,15 +226,30 @@ def update_customer_data(system_a_csv, system_b_csv, output_csv,
         print(f"更新された顧客: {updated_rows}件")
         print(f"更新されたセル: {updated_cells}件")
 
+        if df_b is None:
+            # チャンクごとに処理した場合は、既に出力CSVに保存済み
+            if delta:
+                print(f"出力した行数: {output_rows}件（更新された行のみ）")
+            print(f"\n結果を '{output_csv}' に保存しました。")
+            if store is not None:
+                store.save(df_a_matched[key_a])
+            return output_csv
+
         # 結果を出力CSVに保存
         # df_b.to_csv(output_csv, index=False, encoding="shift_jis")
-        with open(output_csv, 'w', encoding='CP932') as f:
-            # まず、保存していたカテゴリ行を書き込む
-            f.write(header_line + '\n')
-            # その後、データフレームを書き込む
-            df_b.to_csv(f, index=False, encoding='CP932')
+        # まず、保存していたカテゴリ行を書き込み、その後、データフレームをブロックごとに並列にエンコードして書き込む
+        if delta:
+            # 更新された行（と更新されたカラム）だけを書き込む
+            df_output, category_output = select_delta(df_b, header_line, changes, keep_columns=key_columns,
+                                                      drop_unchanged_columns=drop_unchanged_columns)
+            print(f"出力した行数: {len(df_output)}件、列数: {len(df_output.columns)}列（更新された行のみ）")
+            write_cp932_csv(df_output, output_csv, category_output, errors=encoding_errors)
+        else:
+            write_cp932_csv(df_b, output_csv, header_line, errors=encoding_errors)
 
         print(f"\n結果を '{output_csv}' に保存しました。")
+        if store is not None:
+            store.save(df_a_matched[key_a])
 
         return df_b
 
@@ -0,0 +1,230 @@
+"""
+CSV変換キャッシュ
+
+入力ファイルの内容のハッシュと変換オプションをキーにして、
+検出された文字コードと変換済みファイルをディスク上に保存する。
+同じ入力を繰り返し変換する場合、2回目以降は入力のハッシュ計算とコピーだけで済む。
+
+キャッシュディレクトリには以下のファイルが保存される。
+- <キー>.json: 検出された文字コードや変換方式などのメタデータ（更新日時をLRUの最終利用日時として使う）
+- <キー>.csv: 変換済みファイル（入力をそのままコピーした場合は保存せず、入力から再度コピーする）
+- <キー>_unencodable.txt: CP932にエンコードできなかった文字のレポート（ある場合のみ）
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+
+
+# キャッシュディレクトリ（環境変数 HITOMI_CSV_CACHE_DIR で変更できる）
+DEFAULT_CACHE_DIR = os.environ.get(
+    'HITOMI_CSV_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'hitomi-csv', 'cp932'))
+# キャッシュ全体の最大サイズ（MB単位）
+DEFAULT_CACHE_MAX_SIZE_MB = 1024
+# ハッシュ計算時に1回で読み込むブロックサイズ
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def hash_file(file_path, extra=b''):
+    """
+    ファイルの内容のハッシュ値（BLAKE2b）を計算する
+
+    Args:
+        file_path (str): ファイルのパス
+        extra (bytes): 内容と一緒にハッシュに含めるバイト列（オプションなど）
+
+    Returns:
+        str: 16進数のハッシュ値
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    with open(file_path, 'rb') as file:
+        while True:
+            block = file.read(HASH_BLOCK_SIZE)
+            if not block:
+                break
+            digest.update(block)
+    digest.update(extra)
+    return digest.hexdigest()
+
+
+def _remove_quietly(path):
+    """ファイルを削除する（他のプロセスが先に削除していても無視する）"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class ConversionCache:
+    """
+    変換結果をディスク上に保存し、サイズ上限を超えたら最後に使われた日時が古いものから削除するキャッシュ
+    """
+
+    def __init__(self, cache_dir=None, max_size_mb=DEFAULT_CACHE_MAX_SIZE_MB):
+        """
+        Args:
+            cache_dir (str): キャッシュディレクトリ（Noneの場合は DEFAULT_CACHE_DIR）
+            max_size_mb (float): キャッシュ全体の最大サイズ（MB単位）
+        """
+        self.cache_dir = cache_dir or DEFAULT_CACHE_DIR
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024)
+
+    def key(self, file_path, options):
+        """入力ファイルの内容と変換オプションからキャッシュのキーを計算する"""
+        options_bytes = json.dumps(options, sort_keys=True, ensure_ascii=False).encode('utf-8')
+        return hash_file(file_path, options_bytes)
+
+    def _path(self, key, suffix):
+        return os.path.join(self.cache_dir, f"{key}{suffix}")
+
+    def get(self, key):
+        """
+        キャッシュされた変換結果のメタデータを返す（なければNone）
+        見つかった場合は最終利用日時を更新する
+        """
+        meta_path = self._path(key, '.json')
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as file:
+                meta = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if meta.get('stored') and not os.path.exists(self._path(key, '.csv')):
+            return None
+        os.utime(meta_path)
+        return meta
+
+    def restore(self, key, meta, file_path, output_path, copy_file=shutil.copyfile):
+        """
+        キャッシュされた変換結果を output_path に書き出す
+
+        Args:
+            copy_file (callable): 変換済みファイルを保存していないエントリーで、入力を output_path に
+                コピーする関数 copy_file(file_path, output_path)
+
+        Returns:
+            str: CP932にエンコードできない文字のレポートを書き出した場合はそのパス（なければNone）
+        """
+        if meta.get('stored'):
+            shutil.copyfile(self._path(key, '.csv'), output_path)
+        else:
+            copy_file(file_path, output_path)
+
+        report_path = None
+        cached_report = self._path(key, '_unencodable.txt')
+        if os.path.exists(cached_report):
+            report_path = f"{os.path.splitext(output_path)[0]}_unencodable.txt"
+            shutil.copyfile(cached_report, report_path)
+        return report_path
+
+    def put(self, key, result):
+        """
+        変換結果をキャッシュに保存する
+
+        Args:
+            key (str): キャッシュのキー
+            result (dict): detect_and_convert_to_cp932 の変換結果
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # 入力をそのままコピーした場合は、変換済みファイルを保存しなくても入力から再現できる
+        stored = result['method'] == 'transcode'
+        meta = {
+            'encoding': result['encoding'],
+            'method': result['method'],
+            'unencodable': result['unencodable'],
+            'stored': stored,
+            'created': time.time(),
+        }
+
+        # 他のプロセスと同時に書き込んでも壊れないよう、一時ファイルに書いてから置き換える
+        suffix = f".{os.getpid()}.tmp"
+        if stored:
+            shutil.copyfile(result['output'], self._path(key, '.csv' + suffix))
+            os.replace(self._path(key, '.csv' + suffix), self._path(key, '.csv'))
+        report_path = f"{os.path.splitext(result['output'])[0]}_unencodable.txt"
+        if result['unencodable'] and os.path.exists(report_path):
+            shutil.copyfile(report_path, self._path(key, '_unencodable.txt' + suffix))
+            os.replace(self._path(key, '_unencodable.txt' + suffix), self._path(key, '_unencodable.txt'))
+        with open(self._path(key, '.json' + suffix), 'w', encoding='utf-8') as file:
+            json.dump(meta, file, ensure_ascii=False)
+        os.replace(self._path(key, '.json' + suffix), self._path(key, '.json'))
+
+        self.evict()
+
+    def entries(self):
+        """
+        キャッシュのエントリーを最終利用日時が新しい順に返す
+
+        Returns:
+            list: [{'key', 'size', 'last_used', 'encoding', 'method'}, ...]
+        """
+        if not os.path.isdir(self.cache_dir):
+            return []
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.json'):
+                continue
+            key = name[:-len('.json')]
+            try:
+                last_used = os.path.getmtime(self._path(key, '.json'))
+                with open(self._path(key, '.json'), 'r', encoding='utf-8') as file:
+                    meta = json.load(file)
+            except (FileNotFoundError, json.JSONDecodeError):
+                continue
+            size = 0
+            for suffix in ('.json', '.csv', '_unencodable.txt'):
+                try:
+                    size += os.path.getsize(self._path(key, suffix))
+                except FileNotFoundError:
+                    pass
+            entries.append({'key': key, 'size': size, 'last_used': last_used,
+                            'encoding': meta.get('encoding'), 'method': meta.get('method')})
+        entries.sort(key=lambda entry: entry['last_used'], reverse=True)
+        return entries
+
+    def remove(self, key):
+        """エントリーを削除する"""
+        for suffix in ('.json', '.csv', '_unencodable.txt'):
+            _remove_quietly(self._path(key, suffix))
+
+    def evict(self):
+        """
+        キャッシュ全体のサイズが上限を超えている間、最終利用日時が古いエントリーから削除する
+
+        Returns:
+            int: 削除したエントリー数
+        """
+        entries = self.entries()
+        total = sum(entry['size'] for entry in entries)
+        removed = 0
+        while entries and total > self.max_size_bytes:
+            entry = entries.pop()
+            self.remove(entry['key'])
+            total -= entry['size']
+            removed += 1
+        return removed
+
+    def clear(self):
+        """
+        キャッシュをすべて削除する
+
+        Returns:
+            int: 削除したエントリー数
+        """
+        entries = self.entries()
+        for entry in entries:
+            self.remove(entry['key'])
+        return len(entries)
+
+    def print_info(self):
+        """キャッシュの内容を表示する"""
+        entries = self.entries()
+        total = sum(entry['size'] for entry in entries)
+        print(f"キャッシュディレクトリ: {self.cache_dir}")
+        print(f"エントリー数: {len(entries)}件")
+        print(f"使用量: {total / (1024 * 1024):.2f} MB / {self.max_size_bytes / (1024 * 1024):.2f} MB")
+        for entry in entries:
+            last_used = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['last_used']))
+            print(f"- {entry['key']}  {entry['size'] / (1024 * 1024):8.2f} MB  {last_used}  "
+                  f"{entry['encoding']} ({entry['method']})")
@@ -1,65 +1,366 @@
 import chardet
+import codecs
+import contextlib
+import glob
+import io
+import json
 import os
+import shutil
+import threading
+import time
+import unicodedata
 import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
+from csv_conversion_cache import ConversionCache, DEFAULT_CACHE_MAX_SIZE_MB
 
-def detect_file_encoding(file_path):
+
+# エンコーディング推定時に1回で読み込むブロックサイズ（全体を走査する場合）
+SNIFF_BLOCK_SIZE = 64 * 1024
+# 先頭サンプルとして読み込む最大バイト数（chardet.detect が調べる最大バイト数。これより多く渡しても先頭しか使われない）
+SNIFF_MAX_SAMPLE_BYTES = chardet.DEFAULT_MAX_BYTES
+# 読み込みを試すエンコーディング（先にあるものほど優先される）
+ENCODING_CANDIDATES = ['ascii', 'utf-8', 'utf-8-sig', 'shift_jis', 'cp932', 'euc-jp', 'iso-2022-jp']
+# デコードせずにそのままCP932としてコピーできる文字コード
+# （ascii と shift_jis はデコード→CP932エンコードと完全に同じバイト列になる。
+#   cp932 はNEC選定IBM拡張文字などの重複コードがIBM拡張側に正規化されず、元のバイト列のまま残る）
+CP932_COMPATIBLE_ENCODINGS = ('ascii', 'shift_jis', 'cp932')
+# エンコーディング検証時に1回で読み込むブロックサイズ
+VALIDATE_BLOCK_SIZE = 1024 * 1024
+# CP932への変換時に1回で読み込むチャンクサイズ
+TRANSCODE_CHUNK_SIZE = 1024 * 1024
+# CP932にエンコードできない文字を集計するコーデックエラーハンドラの登録名
+UNENCODABLE_ERROR_HANDLER = 'cp932_unencodable_report'
+
+
+def _normalize_encoding_name(encoding):
+    """codecs に登録された正式な名前にする（'SHIFT_JIS' -> 'shift_jis' など。不明な名前や None は None）"""
+    try:
+        return codecs.lookup(encoding).name
+    except (LookupError, TypeError):
+        return None
+
+
+def sniff_file_encoding(file_path, trusted_encodings=ENCODING_CANDIDATES,
+                        block_size=SNIFF_BLOCK_SIZE, max_sample_bytes=SNIFF_MAX_SAMPLE_BYTES):
     """
-    ファイルの文字コードを検出し、内容を読み込む
-    BOM（Byte Order Mark）も適切に処理する
+    ファイルの先頭サンプルで文字コードを推定する
+    推定結果の1位が trusted_encodings のいずれかであれば、そこで読み込みを打ち切る
+
+    chardet の信頼度は日本語の文字コードでは低く出る（実際のCP932のファイルでも0.1程度）ため、
+    打ち切るかどうかは信頼度ではなく、1位の文字コードで判断する。
+    trusted_encodings は detect_source_encoding が後でファイル全体を検証する候補なので、
+    サンプルでの推定が外れていても、変換に使う文字コードは検証結果で決まる。
+    1位がそれ以外の文字コードの場合のみ、ファイル全体をインクリメンタル検出器で走査する。
 
     Args:
         file_path (str): 入力ファイルのパス
+        trusted_encodings (list): 推定結果の1位であれば読み込みを打ち切る文字コード
+        block_size (int): 全体を走査する場合に1回に読み込むバイト数
+        max_sample_bytes (int): 先頭サンプルとして読み込む最大バイト数
 
     Returns:
-        tuple: (content, encoding) - ファイルの内容と検出された文字コード
+        tuple: (encoding, confidence, bytes_inspected) - 推定された文字コード、信頼度、検査したバイト数
     """
-    # ファイルを読み込んで文字コードを検出
+    trusted = {_normalize_encoding_name(encoding) for encoding in trusted_encodings}
+
     with open(file_path, 'rb') as file:
-        raw_data = file.read()
+        # 先頭サンプルで1回だけ推定する
+        sample = file.read(max_sample_bytes)
+        detected = chardet.detect(sample)
+        at_eof = len(sample) < max_sample_bytes
+        if at_eof or _normalize_encoding_name(detected['encoding']) in trusted:
+            return detected['encoding'], detected['confidence'] or 0.0, len(sample)
+
+        # サンプルでは候補の文字コードにならなかったので、全体をインクリメンタル検出器で走査する
+        # （検出器もデフォルトでは先頭 DEFAULT_MAX_BYTES バイトしか調べないので、上限をファイルサイズにする）
+        print(f"先頭{len(sample)}バイトでは文字コードを特定できませんでした（推定: {detected['encoding']}）。全体を走査します")
+        detector = chardet.UniversalDetector(max_bytes=os.fstat(file.fileno()).st_size)
+        detector.feed(sample)
+        bytes_inspected = len(sample)
+        del sample
+        while not detector.done:
+            block = file.read(block_size)
+            if not block:
+                break
+            detector.feed(block)
+            bytes_inspected += len(block)
+        result = detector.close()
+
+    return result['encoding'], result['confidence'] or 0.0, bytes_inspected
+
+
+def _iter_blocks(source, block_size):
+    """ファイルパスまたはバイト列をブロック単位で返す"""
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as file:
+            while True:
+                block = file.read(block_size)
+                if not block:
+                    return
+                yield block
+    else:
+        view = memoryview(source)
+        for start in range(0, len(view), block_size):
+            yield view[start:start + block_size]
+
+
+def find_decodable_encoding(source, candidates=ENCODING_CANDIDATES, block_size=VALIDATE_BLOCK_SIZE):
+    """
+    複数のエンコーディング候補を1回の走査でまとめて検証する
+
+    候補ごとにインクリメンタルデコーダーを用意し、同じブロックを順に流し込む。
+    不正なバイトが現れた候補はその時点で脱落させるため、
+    全候補の検証に必要なメモリはブロックサイズ分だけで済む。
+
+    Args:
+        source (str | bytes): 入力ファイルのパス、またはバイト列
+        candidates (list): 検証するエンコーディング（先にあるものほど優先される）
+        block_size (int): 1回に検証するバイト数
+
+    Returns:
+        tuple: (encoding, failures) - 最後まで読み込めた最優先の候補（なければNone）と、
+               脱落した候補ごとの不正なバイトの位置 {encoding: offset}
+    """
+    decoders = {enc: codecs.getincrementaldecoder(enc)('strict') for enc in candidates}
+    failures = {}
+    consumed = 0
+
+    def drop(enc, error):
+        # error.object は保留中のバイト + 今回のブロック（BOMは除かれる）なので末尾から位置を逆算する
+        failures[enc] = consumed - len(error.object) + error.start
+        del decoders[enc]
+
+    for block in _iter_blocks(source, block_size):
+        consumed += len(block)
+        for enc, decoder in list(decoders.items()):
+            try:
+                decoder.decode(block)
+            except UnicodeDecodeError as e:
+                drop(enc, e)
+        if not decoders:
+            break
+
+    # 末尾で途切れたマルチバイト文字を検出する
+    for enc, decoder in list(decoders.items()):
+        try:
+            decoder.decode(b'', final=True)
+        except UnicodeDecodeError as e:
+            drop(enc, e)
+
+    winner = next((enc for enc in candidates if enc in decoders), None)
+    return winner, failures
+
+
+def detect_source_encoding(file_path):
+    """
+    ファイル全体をメモリに読み込まずに、デコードに使う文字コードを決定する
+    BOM（Byte Order Mark）付きのUTF-8も適切に判定する
+
+    Args:
+        file_path (str): 入力ファイルのパス
+
+    Returns:
+        tuple: (encoding, errors) - デコードに使う文字コードと、デコード時のエラー処理方法
+               （どの候補でも完全に読み込めない場合は 'replace'）
+    """
+    with open(file_path, 'rb') as file:
+        head = file.read(len(codecs.BOM_UTF8))
 
     # BOMを検出
-    has_bom = False
-    if raw_data.startswith(b'\xef\xbb\xbf'):
+    if head == codecs.BOM_UTF8:
         print("UTF-8 BOMが検出されました")
-        has_bom = True
-        # BOMを持つUTF-8として読み込む
-        try:
-            content = raw_data.decode('utf-8-sig')
+        # BOMを持つUTF-8として読み込めるか検証する
+        encoding, _ = find_decodable_encoding(file_path, candidates=['utf-8-sig'])
+        if encoding is not None:
             print("utf-8-sig エンコーディングで正常に読み込めました")
-            return content, 'utf-8-sig'
-        except UnicodeDecodeError:
-            print("utf-8-sig でも読み込めませんでした")
+            return 'utf-8-sig', 'strict'
+        print("utf-8-sig でも読み込めませんでした")
 
-    # 文字コードを検出
-    detected = chardet.detect(raw_data)
-    encoding = detected['encoding']
-    confidence = detected['confidence']
+    # 文字コードを検出（先頭サンプルで十分な信頼度が得られればそこで打ち切る）
+    encoding, confidence, bytes_inspected = sniff_file_encoding(file_path)
 
     print(f"検出された文字コード: {encoding}")
     print(f"信頼度: {confidence:.2%}")
+    print(f"検査したバイト数: {bytes_inspected} / {os.path.getsize(file_path)}")
 
-    # 異なるエンコーディングで読み込みを試みる
-    encodings_to_try = ['utf-8', 'utf-8-sig', 'shift_jis', 'cp932', 'euc-jp', 'iso-2022-jp']
-    content = None
+    # すべての候補エンコーディングを1回の走査で検証する
+    valid_encoding, failures = find_decodable_encoding(file_path)
+    for enc in ENCODING_CANDIDATES:
+        if enc in failures:
+            print(f"エンコーディング {enc} では読み込めませんでした（{failures[enc]}バイト目）")
 
-    for enc in encodings_to_try:
-        try:
-            content = raw_data.decode(enc, errors='strict')
-            print(f"エンコーディング {enc} で正常に読み込めました")
-            break
-        except UnicodeDecodeError:
-            print(f"エンコーディング {enc} では読み込めませんでした")
+    if valid_encoding is not None:
+        print(f"エンコーディング {valid_encoding} で正常に読み込めました")
+        return valid_encoding, 'strict'
+
+    # どのエンコーディングでも完全に読み込めない場合は、errors='replace'で代替文字に置き換えて読み込む
+    print(f"完全な読み込みができませんでした。{encoding} で代替文字を使用して読み込みます")
+    return encoding, 'replace'
 
-    if content is None:
-        # どのエンコーディングでも完全に読み込めない場合は、errors='replace'で代替文字に置き換えて読み込む
-        content = raw_data.decode(encoding, errors='replace')
-        print(f"完全な読み込みができませんでした。{encoding} で代替文字を使用して読み込みました")
+
+def detect_file_encoding(file_path):
+    """
+    ファイルの文字コードを検出し、内容を読み込む
+    BOM（Byte Order Mark）も適切に処理する
+
+    Args:
+        file_path (str): 入力ファイルのパス
+
+    Returns:
+        tuple: (content, encoding) - ファイルの内容と検出された文字コード
+    """
+    encoding, errors = detect_source_encoding(file_path)
+
+    # 検証済みの文字コードで1回だけデコードする
+    with open(file_path, 'rb') as file:
+        content = file.read().decode(encoding, errors=errors)
 
     return content, encoding
 
 
-def convert_to_cp932(content, file_path, output_path=None):
+# エンコード中のレポートをスレッドごとに保持する（コーデックのエラーハンドラはプロセス全体で共有されるため）
+_active_report = threading.local()
+
+
+def _handle_unencodable(error):
+    """エンコード中のUnencodableCharReportにエラー処理を委譲する"""
+    report = getattr(_active_report, 'report', None)
+    if report is None:
+        raise error
+    return report.handle(error)
+
+
+codecs.register_error(UNENCODABLE_ERROR_HANDLER, _handle_unencodable)
+
+
+class UnencodableCharReport:
+    """
+    CP932にエンコードできない文字を1回のエンコードで集計し、置換するクラス
+
+    コーデックのエラーハンドラとしてエンコード中に呼び出され、
+    エンコードできない文字ごとに出現位置（行:列）と件数を記録する。
+    置換後の文字は次の順で決める。
+    1. substitutions に指定された置換文字
+    2. NFKC正規化した文字（nfkc_fallback=True で、CP932にエンコードできる場合）
+    3. default（'?'）
+    """
+
+    def __init__(self, substitutions=None, nfkc_fallback=True, default='?'):
+        """
+        Args:
+            substitutions (dict): 置換テーブル {'置換前の文字': '置換後の文字列'}
+            nfkc_fallback (bool): 置換テーブルにない文字をNFKC正規化で置換するか
+            default (str): どの方法でも置換できない場合の代替文字
+        """
+        self.substitutions = dict(substitutions or {})
+        self.nfkc_fallback = nfkc_fallback
+        self.default = default
+        # 文字ごとの集計 {文字: {'count': 件数, 'replacement': 置換後, 'positions': [(行, 列), ...]}}
+        self.chars = {}
+        self._line = 1
+        self._column = 1
+        self._text = ''
+        self._scanned = 0
+
+    @property
+    def total(self):
+        """エンコードできなかった文字の総数"""
+        return sum(entry['count'] for entry in self.chars.values())
+
+    def _resolve(self, char):
+        """文字の置換後の文字列を決める"""
+        candidates = []
+        if char in self.substitutions:
+            candidates.append(self.substitutions[char])
+        if self.nfkc_fallback:
+            normalized = unicodedata.normalize('NFKC', char)
+            if normalized != char:
+                candidates.append(normalized)
+        for candidate in candidates:
+            try:
+                candidate.encode('cp932')
+                return candidate
+            except UnicodeEncodeError:
+                print(f"置換文字 '{candidate}' もCP932にエンコードできないため使用しません")
+        return self.default
+
+    def _advance(self, end):
+        """現在のテキストの end 位置まで行・列を進める"""
+        segment = self._text[self._scanned:end]
+        newlines = segment.count('\n')
+        if newlines:
+            self._line += newlines
+            self._column = len(segment) - segment.rfind('\n')
+        else:
+            self._column += len(segment)
+        self._scanned = end
+
+    def handle(self, error):
+        """コーデックのエラーハンドラとしてエンコードできない文字を記録し、置換後の文字列を返す"""
+        self._advance(error.start)
+        replacement = []
+        for offset, char in enumerate(error.object[error.start:error.end]):
+            entry = self.chars.get(char)
+            if entry is None:
+                entry = self.chars[char] = {'count': 0, 'replacement': self._resolve(char), 'positions': []}
+            entry['count'] += 1
+            entry['positions'].append((self._line, self._column + offset))
+            replacement.append(entry['replacement'])
+        self._advance(error.end)
+        return ''.join(replacement), error.end
+
+    def encode(self, encoder, text, final=False):
+        """
+        インクリメンタルエンコーダーでテキストをエンコードする
+        エンコーダーは errors=UNENCODABLE_ERROR_HANDLER で作成しておくこと
+        """
+        self._text = text
+        self._scanned = 0
+        _active_report.report = self
+        try:
+            return encoder.encode(text, final)
+        finally:
+            _active_report.report = None
+            self._advance(len(text))
+            self._text = ''
+
+    def write(self, report_path):
+        """集計結果をUTF-8のタブ区切りテキストとして保存する"""
+        with open(report_path, 'w', encoding='utf-8') as file:
+            file.write("コードポイント\t文字\t文字名\t件数\t置換後\t出現位置（行:列）\n")
+            for char, entry in sorted(self.chars.items(), key=lambda item: -item[1]['count']):
+                positions = ' '.join(f"{line}:{column}" for line, column in entry['positions'])
+                name = unicodedata.name(char, '')
+                file.write(f"U+{ord(char):04X}\t{char}\t{name}\t{entry['count']}\t{entry['replacement']}\t{positions}\n")
+        return report_path
+
+    def summarize(self, output_path):
+        """集計結果を表示し、エンコードできない文字があればサイドカーレポートを保存する"""
+        if not self.chars:
+            print("すべての文字がCP932でエンコード可能です")
+            return None
+        report_path = f"{os.path.splitext(output_path)[0]}_unencodable.txt"
+        self.write(report_path)
+        print(f"CP932にエンコードできない文字が{len(self.chars)}種類、{self.total}件ありました（置換済み）")
+        for char, entry in sorted(self.chars.items(), key=lambda item: -item[1]['count'])[:10]:
+            line, column = entry['positions'][0]
+            print(f"  U+{ord(char):04X} '{char}' {entry['count']}件 → '{entry['replacement']}'（最初の出現: {line}行{column}列）")
+        print(f"詳細レポート: {report_path}")
+        return report_path
+
+
+def load_substitutions(path):
+    """
+    置換テーブルをJSONファイルから読み込む
+
+    ファイルの形式: {"置換前の文字": "置換後の文字列", ...}
+    """
+    with open(path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+def convert_to_cp932(content, file_path, output_path=None, report=None):
     """
     文字列をCP932(Shift_JIS)に変換して保存する
     BOM（Byte Order Mark）が含まれる場合は適切に処理する
@@ -68,6 +369,7 @@ def convert_to_cp932(content, file_path, output_path=None):
         content (str): 変換する文字列
         file_path (str): 入力ファイルのパス（出力パスが指定されていない場合に使用）
         output_path (str): 出力ファイルのパス（Noneの場合は元ファイル名_cp932.csvとする）
+        report (UnencodableCharReport): エンコードできない文字の集計・置換方法（Noneの場合はデフォルト設定）
 
     Returns:
         str: 保存されたファイルのパス
@@ -76,6 +378,8 @@ def convert_to_cp932(content, file_path, output_path=None):
     if output_path is None:
         base_name = os.path.splitext(file_path)[0]
         output_path = f"{base_name}_cp932.csv"
+    if report is None:
+        report = UnencodableCharReport()
 
     # BOMが文字列の先頭に含まれている可能性がある場合、削除する
     # UTF-8のBOMはU+FEFFという文字で、Pythonの文字列では'\ufeff'として表現される
@@ -83,45 +387,342 @@ def convert_to_cp932(content, file_path, output_path=None):
         print("文字列の先頭からBOMを削除します")
         content = content[1:]
 
-    # CP932でエンコード可能か事前にチェック
-    try:
-        content.encode('cp932')
-        print("すべての文字がCP932でエンコード可能です")
-    except UnicodeEncodeError as e:
-        print(f"CP932にエンコードできない文字があります: {e}")
-        print("変換できない文字は置換または省略されます")
+    # エンコードできない文字を集計・置換しながら1回でエンコードして保存
+    encoder = codecs.getincrementalencoder('cp932')(UNENCODABLE_ERROR_HANDLER)
+    with open(output_path, 'wb') as file:
+        file.write(report.encode(encoder, content, final=True))
+    print(f"CP932で保存完了: {output_path}")
+    report.summarize(output_path)
 
-    # CP932で保存
+    return output_path
+
+
+def transcode_file_to_cp932(file_path, source_encoding, output_path=None, decode_errors='strict',
+                            chunk_size=TRANSCODE_CHUNK_SIZE, report=None):
+    """
+    ファイルを一定サイズのチャンクごとに読み込み、CP932(Shift_JIS)に変換して保存する
+    ファイル全体を文字列として保持しないため、入力サイズに関係なくメモリ使用量は一定
+
+    インクリメンタルデコーダーを使うので、チャンク境界をまたぐマルチバイト文字や
+    BOM（Byte Order Mark）も正しく処理される。
+    CP932にエンコードできない文字は report で集計・置換し、サイドカーレポートに出力する。
+
+    Args:
+        file_path (str): 入力ファイルのパス
+        source_encoding (str): 入力ファイルの文字コード
+        output_path (str): 出力ファイルのパス（Noneの場合は元ファイル名_cp932.csvとする）
+        decode_errors (str): デコード時のエラー処理方法
+        chunk_size (int): 1回に読み込むバイト数
+        report (UnencodableCharReport): エンコードできない文字の集計・置換方法（Noneの場合はデフォルト設定）
+
+    Returns:
+        str: 保存されたファイルのパス
+    """
+    # 出力ファイル名を決定
+    if output_path is None:
+        base_name = os.path.splitext(file_path)[0]
+        output_path = f"{base_name}_cp932.csv"
+    if report is None:
+        report = UnencodableCharReport()
+
+    # 入力と同じパスに出力する場合に読み込む前に切り詰めないよう、一時ファイルに書いてから置き換える
+    temp_path = output_path + '.tmp'
     try:
-        with open(output_path, 'w', encoding='cp932') as file:
-            file.write(content)
-        print(f"CP932で保存完了: {output_path}")
-    except UnicodeEncodeError as e:
-        print(f"CP932に変換できない文字があります: {e}")
-        # エラーを無視して変換する場合
-        with open(output_path, 'w', encoding='cp932', errors='replace') as file:
-            file.write(content)
-        print(f"一部文字を置換してCP932で保存: {output_path}")
-        # どうしても保存できない場合は以下の方法も試せます
-        # with open(output_path, 'wb') as file:
-        #     file.write(content.encode('cp932', errors='replace'))
+        with open(temp_path, 'wb') as dst:
+            for data in iter_cp932_chunks(file_path, source_encoding, decode_errors, chunk_size, report):
+                dst.write(data)
+        os.replace(temp_path, output_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    print(f"CP932で保存完了: {output_path}")
+    report.summarize(output_path)
 
     return output_path
 
 
-def detect_and_convert_to_cp932(file_path, output_path=None):
+def iter_cp932_chunks(file_path, source_encoding, decode_errors='strict', chunk_size=TRANSCODE_CHUNK_SIZE,
+                      report=None):
+    """
+    ファイルを一定サイズのチャンクごとに読み込み、CP932(Shift_JIS)にエンコードしたバイト列を順に返す
+    ファイルに保存せずに変換結果を後続の処理（分割など）に流すときに使う
+
+    Args:
+        file_path (str): 入力ファイルのパス
+        source_encoding (str): 入力ファイルの文字コード
+        decode_errors (str): デコード時のエラー処理方法
+        chunk_size (int): 1回に読み込むバイト数
+        report (UnencodableCharReport): エンコードできない文字の集計・置換方法（Noneの場合はデフォルト設定）
+
+    Yields:
+        bytes: CP932にエンコードされたバイト列
+    """
+    if report is None:
+        report = UnencodableCharReport()
+
+    decoder = codecs.getincrementaldecoder(source_encoding)(decode_errors)
+    encoder = codecs.getincrementalencoder('cp932')(UNENCODABLE_ERROR_HANDLER)
+    at_start = True
+
+    with open(file_path, 'rb') as src:
+        while True:
+            chunk = src.read(chunk_size)
+            final = not chunk
+            text = decoder.decode(chunk, final=final)
+
+            # BOMが文字列の先頭に含まれている場合は削除する（utf-8-sig以外で読み込んだ場合）
+            if at_start and text:
+                if text.startswith('\ufeff'):
+                    print("文字列の先頭からBOMを削除します")
+                    text = text[1:]
+                at_start = False
+
+            data = report.encode(encoder, text, final=final)
+            if data:
+                yield data
+
+            if final:
+                break
+
+
+def copy_file_fast(file_path, output_path, allow_hardlink=False):
+    """
+    ファイルの内容をPython側で読み込まずにコピーする
+
+    allow_hardlink=True の場合はまずハードリンクを試し、できなければ
+    os.copy_file_range → os.sendfile → 通常のコピーの順にカーネル側でのコピーを試す。
+
+    Args:
+        file_path (str): コピー元のファイルパス
+        output_path (str): コピー先のファイルパス
+        allow_hardlink (bool): ハードリンクの作成を許可するか（出力を編集すると入力も変わるので注意）
+
+    Returns:
+        str: 実際に使われた方法（'same_file', 'hardlink', 'copy_file_range', 'sendfile', 'copyfile'）
+    """
+    # コピー先がコピー元と同じファイルなら何もしない（開き直すとコピー元が切り詰められる）
+    if os.path.exists(output_path) and os.path.samefile(file_path, output_path):
+        return 'same_file'
+
+    if allow_hardlink:
+        # 既存のコピー先は、一時的な名前で新しいリンクを作ってから置き換える
+        temp_path = f"{output_path}.{os.getpid()}.tmp"
+        try:
+            os.link(file_path, temp_path)
+            os.replace(temp_path, output_path)
+            return 'hardlink'
+        except OSError as e:
+            if os.path.lexists(temp_path):
+                os.remove(temp_path)
+            print(f"ハードリンクを作成できませんでした: {e}")
+
+    size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as src, open(output_path, 'wb') as dst:
+        for method in ('copy_file_range', 'sendfile'):
+            if not hasattr(os, method):
+                continue
+            copied = 0
+            try:
+                while copied < size:
+                    if method == 'copy_file_range':
+                        sent = os.copy_file_range(src.fileno(), dst.fileno(), size - copied, copied, copied)
+                    else:
+                        sent = os.sendfile(dst.fileno(), src.fileno(), copied, size - copied)
+                    if sent == 0:
+                        break
+                    copied += sent
+                if copied == size:
+                    return method
+            except OSError:
+                pass
+            # 途中で失敗した場合は最初からやり直す
+            dst.seek(0)
+            dst.truncate()
+
+        src.seek(0)
+        shutil.copyfileobj(src, dst)
+    return 'copyfile'
+
+
+def detect_and_convert_to_cp932(file_path, output_path=None, substitutions=None, nfkc_fallback=True,
+                                allow_hardlink=False, cache=None):
     """
     ファイルの文字コードを確認してCP932(Shift_JIS)に変換する
+    ファイル全体をメモリに読み込まず、チャンクごとに変換する
+
+    入力が既にCP932としてそのまま使える文字コード（ASCII、Shift_JIS、CP932）で
+    BOMもない場合は、デコード・エンコードを行わずにファイルをコピーする。
 
     Args:
         file_path (str): 入力ファイルのパス
         output_path (str): 出力ファイルのパス（Noneの場合は元ファイル名_cp932.csvとする）
+        substitutions (dict): CP932にエンコードできない文字の置換テーブル {'置換前の文字': '置換後の文字列'}
+        nfkc_fallback (bool): 置換テーブルにない文字をNFKC正規化で置換するか
+        allow_hardlink (bool): コピーできる場合にハードリンクの作成を許可するか
+        cache (ConversionCache): 変換キャッシュ（Noneの場合はキャッシュを使わない）
+
+    Returns:
+        dict: 変換結果 {'input', 'output', 'encoding', 'method', 'unencodable'}
+    """
+    # 出力ファイル名を決定
+    if output_path is None:
+        base_name = os.path.splitext(file_path)[0]
+        output_path = f"{base_name}_cp932.csv"
+
+    # 同じ内容・同じオプションで変換済みならキャッシュから書き出す
+    cache_key = None
+    if cache is not None:
+        cache_key = cache.key(file_path, {'substitutions': substitutions, 'nfkc_fallback': nfkc_fallback})
+        cached = cache.get(cache_key)
+        if cached is not None:
+            # 入力をそのままコピーしたエントリーは、キャッシュを使わない場合と同じく copy_file_fast でコピーする
+            # （出力先が入力と同じファイルなら何もしない）
+            report_path = cache.restore(
+                cache_key, cached, file_path, output_path,
+                copy_file=lambda source, target: copy_file_fast(source, target, allow_hardlink=allow_hardlink))
+            print(f"キャッシュから変換結果を書き出しました: {output_path}")
+            if report_path:
+                print(f"CP932にエンコードできない文字が{cached['unencodable']}件ありました（置換済み）。詳細レポート: {report_path}")
+            print("\n--- 変換結果 ---")
+            print(f"入力ファイル: {file_path}")
+            print(f"出力ファイル: {output_path}")
+            print(f"文字コード: {cached['encoding']}")
+            print(f"変換方式: cache（{cached['method']}）")
+            return {
+                'input': file_path,
+                'output': output_path,
+                'encoding': cached['encoding'],
+                'method': 'cache',
+                'unencodable': cached['unencodable'],
+            }
+
+    # 文字コードを検出する
+    encoding, errors = detect_source_encoding(file_path)
+
+    if encoding in CP932_COMPATIBLE_ENCODINGS and errors == 'strict':
+        # 変換しても同じバイト列になるので、そのままコピーする
+        method = copy_file_fast(file_path, output_path, allow_hardlink=allow_hardlink)
+        unencodable = 0
+        print(f"{encoding} はCP932としてそのまま使えるため、変換せずにコピーしました: {output_path}")
+    else:
+        # CP932に変換して保存
+        report = UnencodableCharReport(substitutions, nfkc_fallback=nfkc_fallback)
+        transcode_file_to_cp932(file_path, encoding, output_path, decode_errors=errors, report=report)
+        method = 'transcode'
+        unencodable = report.total
+
+    print("\n--- 変換結果 ---")
+    print(f"入力ファイル: {file_path}")
+    print(f"出力ファイル: {output_path}")
+    print(f"文字コード: {encoding}")
+    print(f"変換方式: {method}")
+
+    result = {
+        'input': file_path,
+        'output': output_path,
+        'encoding': encoding,
+        'method': method,
+        'unencodable': unencodable,
+    }
+    if cache is not None:
+        cache.put(cache_key, result)
+    return result
+
+
+def collect_input_files(patterns):
+    """
+    ファイルパス・ディレクトリ・globパターンから変換対象のCSVファイルを集める
+    ディレクトリの場合は直下の *.csv を対象とする
+    ディレクトリやglobパターンに含まれる変換済みの *_cp932.csv は除外する
+
+    Args:
+        patterns (list): ファイルパス、ディレクトリ、またはglobパターンのリスト
+
+    Returns:
+        list: 変換対象のファイルパスのリスト（重複なし、指定順）
     """
-    # 文字コードを検出してファイルを読み込む
-    content, _ = detect_file_encoding(file_path)
+    file_paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = sorted(glob.glob(os.path.join(pattern, '*.csv')))
+        elif os.path.exists(pattern):
+            matches = [pattern]
+        else:
+            matches = sorted(glob.glob(pattern))
+            if not matches:
+                print(f"警告: '{pattern}' に一致するファイルがありません")
+        if matches != [pattern]:
+            matches = [path for path in matches if not path.endswith('_cp932.csv')]
+        for path in matches:
+            if os.path.isfile(path) and path not in file_paths:
+                file_paths.append(path)
+    return file_paths
+
 
-    # CP932に変換して保存
-    convert_to_cp932(content, file_path, output_path)
+def _convert_in_worker(file_path, options):
+    """
+    ワーカープロセスで1ファイルを変換する
+    ログは結果に含めて返し、失敗しても例外を送出しない
+    """
+    log = io.StringIO()
+    started = time.perf_counter()
+    result = {'input': file_path, 'output': None, 'error': None}
+    try:
+        with contextlib.redirect_stdout(log):
+            result.update(detect_and_convert_to_cp932(file_path, **options))
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    result['seconds'] = time.perf_counter() - started
+    result['bytes'] = os.path.getsize(file_path) if os.path.exists(file_path) else 0
+    result['log'] = log.getvalue()
+    return result
+
+
+def convert_files_to_cp932(file_paths, workers=None, **options):
+    """
+    複数のファイルをプロセスプールで並列にCP932(Shift_JIS)に変換する
+    1ファイルの失敗で他のファイルの変換は中断されない
+
+    Args:
+        file_paths (list): 入力ファイルのパスのリスト（出力は各ファイルの元ファイル名_cp932.csvとなる）
+        workers (int): ワーカープロセス数（Noneの場合はCPU数）
+        **options: detect_and_convert_to_cp932 に渡すオプション
+
+    Returns:
+        list: ファイルごとの変換結果（入力順）
+    """
+    started = time.perf_counter()
+    results = {}
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_convert_in_worker, path, options): path for path in file_paths}
+        for future in as_completed(futures):
+            result = future.result()
+            results[result['input']] = result
+            if result['error'] is None:
+                print(f"[完了] {result['input']} → {result['output']}"
+                      f"（{result['encoding']}, {result['method']}, {result['seconds']:.2f}秒）")
+                if result['unencodable']:
+                    print(f"       CP932にエンコードできない文字を{result['unencodable']}件置換しました")
+            else:
+                print(f"[失敗] {result['input']}: {result['error']}")
+
+    elapsed = time.perf_counter() - started
+    ordered = [results[path] for path in file_paths]
+    succeeded = [result for result in ordered if result['error'] is None]
+    total_bytes = sum(result['bytes'] for result in succeeded)
+
+    print(f"\n--- 一括変換結果 ---")
+    print(f"成功: {len(succeeded)}件 / 失敗: {len(ordered) - len(succeeded)}件")
+    print(f"処理量: {total_bytes / (1024 * 1024):.2f} MB（{elapsed:.2f}秒, "
+          f"{total_bytes / (1024 * 1024) / elapsed if elapsed > 0 else 0:.2f} MB/秒）")
+    for result in ordered:
+        if result['error'] is not None:
+            print(f"\n[失敗] {result['input']}\n{result['log']}{result['error']}")
+
+    return ordered
 
 
 # 文字列の文字コードを確認する関数
@@ -149,11 +750,52 @@ def check_string_encoding(text):
 if __name__ == "__main__":
     # コマンドライン引数の設定
     parser = argparse.ArgumentParser(description='CSVファイルをCP932(Shift_JIS)に変換するツール')
-    parser.add_argument('input_file', help='変換するCSVファイルのパス')
-    parser.add_argument('-o', '--output', help='出力ファイルのパス（指定しない場合は元ファイル名_cp932.csvとなります）')
+    parser.add_argument('inputs', nargs='*',
+                        help='変換するCSVファイルのパス（ディレクトリやglobパターンを指定すると一括変換します）')
+    parser.add_argument('-o', '--output', help='出力ファイルのパス（指定しない場合は元ファイル名_cp932.csvとなります。1ファイルの場合のみ）')
+    parser.add_argument('--substitutions', help='CP932にエンコードできない文字の置換テーブル（JSON形式: {"置換前の文字": "置換後の文字列"}）')
+    parser.add_argument('--no-nfkc', action='store_true', help='置換テーブルにない文字をNFKC正規化で置換しない（"?"に置換する）')
+    parser.add_argument('--hardlink', action='store_true', help='入力が既にCP932の場合、コピーの代わりにハードリンクを作成する')
+    parser.add_argument('-j', '--workers', type=int, help='一括変換時のワーカープロセス数（デフォルト: CPU数）')
+    parser.add_argument('--cache', action='store_true', help='変換キャッシュを使う（同じ内容のファイルは再変換しない）')
+    parser.add_argument('--cache-dir', help='変換キャッシュのディレクトリ（指定するとキャッシュを使う）')
+    parser.add_argument('--cache-max-size', type=float, default=DEFAULT_CACHE_MAX_SIZE_MB,
+                        help=f'変換キャッシュの最大サイズ（MB単位、デフォルト: {DEFAULT_CACHE_MAX_SIZE_MB}）')
+    parser.add_argument('--cache-info', action='store_true', help='変換キャッシュの内容を表示して終了する')
+    parser.add_argument('--cache-clear', action='store_true', help='変換キャッシュをすべて削除して終了する')
 
     # 引数の解析
     args = parser.parse_args()
 
-    # ファイルの文字コード確認と変換
-    detect_and_convert_to_cp932(args.input_file, args.output)
+    cache = None
+    if args.cache or args.cache_dir or args.cache_info or args.cache_clear:
+        cache = ConversionCache(args.cache_dir, max_size_mb=args.cache_max_size)
+    if args.cache_clear:
+        print(f"変換キャッシュを{cache.clear()}件削除しました: {cache.cache_dir}")
+    if args.cache_info:
+        cache.print_info()
+    if (args.cache_info or args.cache_clear) and not args.inputs:
+        raise SystemExit(0)
+
+    substitutions = load_substitutions(args.substitutions) if args.substitutions else None
+    options = {
+        'substitutions': substitutions,
+        'nfkc_fallback': not args.no_nfkc,
+        'allow_hardlink': args.hardlink,
+        'cache': cache,
+    }
+
+    input_files = collect_input_files(args.inputs)
+    if not input_files:
+        parser.error("変換するファイルが見つかりません")
+
+    if len(input_files) == 1 and not any(os.path.isdir(path) for path in args.inputs):
+        # ファイルの文字コード確認と変換
+        detect_and_convert_to_cp932(input_files[0], args.output, **options)
+    else:
+        if args.output:
+            parser.error("-o/--output は1ファイルを変換する場合のみ指定できます")
+        # 複数ファイルを並列に変換
+        batch_results = convert_files_to_cp932(input_files, workers=args.workers, **options)
+        if any(result['error'] is not None for result in batch_results):
+            raise SystemExit(1)
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+CP932(Shift_JIS) CSV書き込み
+
+マージ結果のデータフレームを、カテゴリ行に続けてCP932のCSVファイルに書き込む。
+データフレームを一定の行数のブロックごとにCSVの文字列にしてエンコードし、順に書き込む
+（ファイル全体の文字列をメモリに保持しない）。エンコードできない文字がなければ、
+open(output_csv, 'w', encoding='CP932') に df.to_csv で書き込んだ場合と同じバイト列になる。
+
+エンコードできない文字を含むセルは、行番号とカラム名を記録する。errors='strict' の場合は
+該当するセルの一覧を含むエラーにし、書き込み途中のファイルは残さない。
+それ以外の場合は、コーデックのエラー処理（'replace' なら '?'）で置き換えて書き込みを続ける。
+"""
+
+import os
+
+
+# 1回にCSVの文字列にしてエンコードする行数
+DEFAULT_BLOCK_ROWS = 10000
+# エラーメッセージ・ログに表示するセルの最大数
+MAX_REPORTED_CELLS = 20
+
+
+def _is_encodable(text, encoding):
+    try:
+        text.encode(encoding)
+        return True
+    except UnicodeEncodeError:
+        return False
+
+
+def _unencodable_chars(text, encoding):
+    """エンコードできない文字を出現順に重複なく返す"""
+    return ''.join(dict.fromkeys(char for char in text if not _is_encodable(char, encoding)))
+
+
+def find_unencodable_cells(df, encoding='CP932', header=True, row_offset=0):
+    """
+    エンコードできない文字を含むセルを探す
+
+    カラムごとにまとめてエンコードを試し、エンコードできなかったカラムだけをセルごとに確認する。
+
+    Args:
+        df (pd.DataFrame): 確認するデータフレーム
+        encoding (str): 書き込むエンコーディング
+        header (bool): カラム名も確認するか
+        row_offset (int): df の先頭行のデータ全体での位置
+
+    Returns:
+        list: [{'row': データの行番号（1始まり、カラム名は0）, 'column': カラム名, 'value': セルの値, 'chars': エンコードできない文字}, ...]
+    """
+    cells = []
+    if header:
+        for column in df.columns:
+            name = str(column)
+            if not _is_encodable(name, encoding):
+                cells.append({'row': 0, 'column': column, 'value': name, 'chars': _unencodable_chars(name, encoding)})
+
+    for column in df.columns:
+        values = [(position, value) for position, value in enumerate(df[column].tolist()) if isinstance(value, str)]
+        if _is_encodable('\n'.join(value for _, value in values), encoding):
+            continue
+        for position, value in values:
+            if not _is_encodable(value, encoding):
+                cells.append({'row': row_offset + position + 1, 'column': column, 'value': value,
+                              'chars': _unencodable_chars(value, encoding)})
+
+    cells.sort(key=lambda cell: cell['row'])
+    return cells
+
+
+def _format_cells(cells):
+    lines = [f"  {cell['row']}行目 '{cell['column']}': '{cell['chars']}'（値: {cell['value']!r}）"
+             for cell in cells[:MAX_REPORTED_CELLS]]
+    if len(cells) > MAX_REPORTED_CELLS:
+        lines.append(f"  ...ほか{len(cells) - MAX_REPORTED_CELLS}件")
+    return '\n'.join(lines)
+
+
+def _encode_block(block, text, encoding, errors, header, row_offset):
+    """
+    ブロックの文字列をエンコードする
+
+    Returns:
+        tuple: (エンコードしたバイト列, エンコードできない文字を含むセルのリスト)
+    """
+    try:
+        return text.encode(encoding), []
+    except UnicodeEncodeError:
+        cells = find_unencodable_cells(block, encoding, header, row_offset)
+        if errors == 'strict':
+            return None, cells
+        return text.encode(encoding, errors), cells
+
+
+class Cp932CsvWriter:
+    """
+    カテゴリ行に続けて、データフレームをブロックごとにエンコードしながら書き込むクラス
+
+    書き込み中は 出力ファイル名.tmp に書き込み、close() で出力ファイル名に変更する。
+    write() を複数回呼ぶと、データフレームを順に追記する（チャンクごとの書き込み用）。
+    """
+
+    def __init__(self, output_csv, category_line, encoding='CP932', errors='strict',
+                 block_rows=DEFAULT_BLOCK_ROWS):
+        """
+        Parameters:
+        - output_csv: 出力CSVファイルパス
+        - category_line: 先頭に書き込むカテゴリ行（末尾の改行はあってもなくてもよい）
+        - encoding: 出力ファイルのエンコーディング
+        - errors: エンコードできない文字の処理方法（'strict' はエラーにする。'replace' などコーデックのエラー処理名）
+        - block_rows: 1回にCSVの文字列にしてエンコードする行数
+        """
+        self.output_csv = output_csv
+        self.encoding = encoding
+        self.errors = errors
+        self.block_rows = max(1, int(block_rows))
+        self.unencodable_cells = []
+        self.rows = 0
+        self._temp_path = output_csv + '.tmp'
+        self._file = open(self._temp_path, 'wb')
+
+        try:
+            self._file.write(self._encode_text(category_line.rstrip('\r\n') + '\n', 'カテゴリ行'))
+        except BaseException:
+            self.abort()
+            raise
+
+    def _encode_text(self, text, name):
+        """カテゴリ行など、データフレーム以外の文字列をエンコードする"""
+        text = text.replace('\n', os.linesep)
+        try:
+            return text.encode(self.encoding)
+        except UnicodeEncodeError:
+            chars = _unencodable_chars(text, self.encoding)
+            if self.errors == 'strict':
+                raise ValueError(f"{name}に{self.encoding}にエンコードできない文字があります: '{chars}'")
+            print(f"警告: {name}の{self.encoding}にエンコードできない文字を置き換えました: '{chars}'")
+            return text.encode(self.encoding, self.errors)
+
+    def _serialize(self, block, header):
+        # テキストモードのファイルに書き込んだ場合と同じ改行にする
+        text = block.to_csv(index=False, header=header)
+        if os.linesep != '\n':
+            text = text.replace('\n', os.linesep)
+        return text
+
+    def write(self, df, header=True):
+        """
+        データフレームを書き込む
+
+        Args:
+            df (pd.DataFrame): 書き込むデータフレーム
+            header (bool): カラム名の行を書き込むか（追記する2回目以降は False）
+        """
+        try:
+            for start in range(0, max(len(df), 1), self.block_rows):
+                block = df.iloc[start:start + self.block_rows]
+                block_header = header and start == 0
+                self._write_result(_encode_block(block, self._serialize(block, block_header), self.encoding,
+                                                 self.errors, block_header, self.rows + start))
+            self.rows += len(df)
+        except BaseException:
+            self.abort()
+            raise
+
+    def _write_result(self, result):
+        data, cells = result
+        self.unencodable_cells.extend(cells)
+        if data is None:
+            raise ValueError(f"{self.encoding}にエンコードできない文字を含むセルがあります"
+                             f"（{len(cells)}件）:\n{_format_cells(cells)}")
+        self._file.write(data)
+
+    def close(self):
+        """
+        書き込みを終えて出力ファイル名に変更する
+
+        Returns:
+        - エンコードできない文字を含んでいたセルのリスト（find_unencodable_cells と同じ形式）
+        """
+        self._file.close()
+        os.replace(self._temp_path, self.output_csv)
+        if self.unencodable_cells:
+            print(f"\n警告: {self.encoding}にエンコードできない文字を含むセルが{len(self.unencodable_cells)}件あり、"
+                  f"'{self.errors}' で置き換えました")
+            print(_format_cells(self.unencodable_cells))
+        return self.unencodable_cells
+
+    def abort(self):
+        """書き込み途中のファイルを削除する"""
+        if not self._file.closed:
+            self._file.close()
+        if os.path.exists(self._temp_path):
+            os.remove(self._temp_path)
+
+
+def write_cp932_csv(df, output_csv, category_line, encoding='CP932', errors='strict',
+                    block_rows=DEFAULT_BLOCK_ROWS):
+    """
+    カテゴリ行に続けて、データフレームをCP932のCSVファイルに書き込む
+
+    Args:
+        df (pd.DataFrame): 書き込むデータフレーム
+        output_csv (str): 出力CSVファイルパス
+        category_line (str): 先頭に書き込むカテゴリ行
+        encoding (str): 出力ファイルのエンコーディング
+        errors (str): エンコードできない文字の処理方法（'strict' はエラーにする）
+        block_rows (int): 1回にCSVの文字列にしてエンコードする行数
+
+    Returns:
+        list: エンコードできない文字を含んでいたセルのリスト
+    """
+    writer = Cp932CsvWriter(output_csv, category_line, encoding, errors, block_rows)
+    writer.write(df)
+    return writer.close()
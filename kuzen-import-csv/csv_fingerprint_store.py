@@ -0,0 +1,136 @@
+"""
+行フィンガープリントストア
+
+更新元（Kuzen・Salesforce）のエクスポートの各行について、マッチングキーごとに
+更新に使うカラムの値のハッシュ（フィンガープリント）を保存しておく。
+次回の実行では、前回正常に終了したときから新しく追加されたキーと値が変わったキーの行だけをマージ処理に渡す。
+フィンガープリントは更新先の行に対応付けて適用したキーの分だけ保存するので、更新先にまだないキーの行は
+更新先に追加された後の実行で処理される。
+
+ストアは pickle 形式の1つのファイルで、以下の内容を保存する。
+- signature: 更新に使うカラムの組やタグのマッピングなど（前回と異なる場合はすべての行を変更ありとする）
+- fingerprints: マッチングキーをインデックス、フィンガープリント（uint64）を値とする pd.Series
+"""
+
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+
+# ストアのファイル形式のバージョン（形式を変えたら上げる。異なる場合はすべての行を変更ありとする）
+STORE_VERSION = 1
+
+
+def fingerprint_rows(df, columns):
+    """
+    各行の columns の値のハッシュ（uint64）をまとめて計算する
+
+    Args:
+        df (pd.DataFrame): ハッシュを計算するデータフレーム
+        columns (list): ハッシュに含めるカラム名（df にないカラムは無視する）
+
+    Returns:
+        np.ndarray: 各行のフィンガープリント
+    """
+    columns = [column for column in dict.fromkeys(columns) if column in df.columns]
+    return pd.util.hash_pandas_object(df[columns], index=False).to_numpy()
+
+
+class FingerprintStore:
+    """
+    マッチングキーごとのフィンガープリントをファイルに保存し、前回から変わった行を求めるクラス
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): ストアのファイルパス
+        """
+        self.path = path
+        self._pending = None
+        self._unchanged_keys = None
+
+    def _load(self, signature):
+        """前回のフィンガープリントを読み込む（ファイルがない場合や signature が異なる場合は None）"""
+        if not os.path.exists(self.path):
+            print(f"フィンガープリントストア '{self.path}' がないため、すべての行を処理します")
+            return None
+        with open(self.path, 'rb') as f:
+            stored = pickle.load(f)
+        if stored.get('version') != STORE_VERSION or stored.get('signature') != signature:
+            print("更新に使うカラムが前回と異なるため、すべての行を処理します")
+            return None
+        return stored['fingerprints']
+
+    def changed_rows(self, df, key_column, columns, signature=None, full_resync=False):
+        """
+        前回から新しく追加されたキー、または columns の値が変わったキーの行を求める
+
+        同じキーが複数行ある場合は、そのキーの行はすべて変更ありとする（フィンガープリントも保存しない）。
+        計算したフィンガープリントは save() を呼ぶまで保存しない。
+
+        Args:
+            df (pd.DataFrame): 更新元のデータフレーム（キーがNaNの行は除いておく）
+            key_column (str): マッチングキーのカラム名
+            columns (list): フィンガープリントに含めるカラム名（更新に使うカラム）
+            signature: 更新の設定（カラムの組やタグのマッピングなど、pickle できる値）
+            full_resync (bool): True の場合は前回の値を使わず、すべての行を変更ありとする
+
+        Returns:
+            np.ndarray: 各行が新しい、または変わったかを表すbool配列
+        """
+        keys = df[key_column].astype(str).to_numpy()
+        fingerprints = fingerprint_rows(df, columns)
+        unique = ~pd.Series(keys).duplicated(keep=False).to_numpy()
+        self._pending = {
+            'version': STORE_VERSION,
+            'signature': signature,
+            'fingerprints': pd.Series(fingerprints[unique], index=keys[unique]),
+        }
+
+        previous = None if full_resync else self._load(signature)
+        if previous is None:
+            self._unchanged_keys = keys[:0]
+            return np.ones(len(df), dtype=bool)
+
+        positions = previous.index.get_indexer(keys)
+        found = positions >= 0
+        unchanged = np.zeros(len(df), dtype=bool)
+        unchanged[found] = previous.to_numpy()[positions[found]] == fingerprints[found]
+        unchanged &= unique
+        # 変わっていない行は前回適用済みなので、今回マージ処理に渡さなくてもフィンガープリントを保存し直す
+        self._unchanged_keys = keys[unchanged]
+        return ~unchanged
+
+    def filter_changed(self, df, key_column, columns, signature=None, full_resync=False):
+        """changed_rows() で求めた、新しい、または変わった行だけを返す（処理しない行数を表示する）"""
+        changed = self.changed_rows(df, key_column, columns, signature, full_resync)
+        print(f"前回から変わっていない行: {int((~changed).sum())}件（処理しません）")
+        return df[changed]
+
+    def save(self, applied_keys=None):
+        """
+        changed_rows() で計算したフィンガープリントを保存する（マージ処理が正常に終了した後に呼ぶ）
+
+        Args:
+            applied_keys (iterable): 更新先の行に対応付けて適用したキー（None の場合はすべてのキー）
+                これ以外の変更ありのキーは保存しないので、更新先にまだないキーの行は次回も処理する
+        """
+        if self._pending is None:
+            return
+        if applied_keys is not None:
+            fingerprints = self._pending['fingerprints']
+            keep = fingerprints.index.isin(pd.Index(applied_keys).astype(str)) | \
+                fingerprints.index.isin(self._unchanged_keys)
+            self._pending = dict(self._pending, fingerprints=fingerprints[keep])
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            pickle.dump(self._pending, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, self.path)
+        print(f"フィンガープリントを '{self.path}' に保存しました（{len(self._pending['fingerprints'])}件）")
+        self._pending = None
+        self._unchanged_keys = None
@@ -0,0 +1,226 @@
+"""
+Linyの会員スナップショットのキーインデックス（SQLite）
+
+Linyのエクスポート（スナップショット）のマッチングキーと行の位置（row_id）、
+マッピングされたカラムの最後に取り込んだ値をローカルのSQLiteファイルに保存する。
+同じスナップショットを繰り返し処理する場合は、ファイルのハッシュが同じなら取り込みを省略し、
+キーの検索と値の比較はSQLの結合でまとめて行う。
+
+データベースには以下のテーブルを作成する。
+- members: key（マッチングキー）, row_id（データ行の位置、0始まり）, c0, c1, ...（マッピングされたカラムの値）
+- meta: 取り込んだスナップショットのハッシュ、キーのカラム名、値のカラム名の一覧など
+
+新しいスナップショットを取り込む場合は、一時テーブルに読み込んでから
+追加・変更されたキーだけを書き込み、スナップショットからなくなったキーを削除する。
+"""
+
+import json
+import os
+import sqlite3
+import time
+
+import numpy as np
+import pandas as pd
+
+from csv_conversion_cache import hash_file
+
+
+# スナップショットを取り込むときに1回に読み込む行数
+INGEST_CHUNK_ROWS = 50000
+# データベースの形式のバージョン（形式を変えたら上げる。異なる場合は作り直す）
+INDEX_VERSION = 1
+
+
+def _value_columns_sql(count, prefix=''):
+    return ''.join(f", {prefix}c{i}" for i in range(count))
+
+
+class KeyIndex:
+    """
+    マッチングキーから行の位置と最後に取り込んだ値を引くSQLiteのインデックス
+    """
+
+    def __init__(self, db_path):
+        """
+        Args:
+            db_path (str): SQLiteファイルのパス（なければ作成する）
+        """
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+        self.value_columns = self._meta('value_columns', [])
+
+    def close(self):
+        self.conn.close()
+
+    def _meta(self, name, default=None):
+        row = self.conn.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def _set_meta(self, **values):
+        self.conn.executemany("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)",
+                              [(name, json.dumps(value, ensure_ascii=False)) for name, value in values.items()])
+
+    def _create_members(self, value_columns):
+        """members テーブルを作り直す"""
+        self.conn.execute("DROP TABLE IF EXISTS members")
+        self.conn.execute(f"CREATE TABLE members (key TEXT PRIMARY KEY, row_id INTEGER NOT NULL"
+                          f"{''.join(f', c{i} TEXT' for i in range(len(value_columns)))}) WITHOUT ROWID")
+        self.value_columns = list(value_columns)
+
+    def ingest(self, csv_path, key_column, value_columns=(), header=1, encoding='CP932',
+               chunksize=INGEST_CHUNK_ROWS, df=None):
+        """
+        スナップショットのキーの列と値の列だけを読み込み、インデックスを更新する
+
+        前回取り込んだスナップショットと内容（ハッシュ）・カラムが同じ場合は何もしない。
+        同じキーが複数行ある場合は最後の行を使う（build_key_index と同じ）。キーがNaNの行は無視する。
+
+        Args:
+            csv_path (str): スナップショットのCSVファイルパス
+            key_column (str): マッチングキーのカラム名
+            value_columns (list): 値を保存するカラム名（マッピングされたシステムBのカラム）
+            header (int): カラム名の行番号（0始まり）
+            encoding (str): CSVファイルのエンコーディング
+            chunksize (int): 1回に読み込む行数
+            df (pd.DataFrame): 読み込み済みのスナップショット（指定した場合はCSVを読み込み直さずに取り込む。
+                ハッシュは csv_path の内容で計算する）
+
+        Returns:
+            dict: {'skipped', 'rows', 'inserted', 'updated', 'deleted', 'seconds'}
+        """
+        start_time = time.perf_counter()
+        value_columns = list(dict.fromkeys(value_columns))
+        snapshot_hash = hash_file(csv_path)
+        if (self._meta('version') == INDEX_VERSION and self._meta('snapshot_hash') == snapshot_hash
+                and self._meta('key_column') == key_column and self.value_columns == value_columns):
+            seconds = time.perf_counter() - start_time
+            print(f"キーインデックス: '{csv_path}' は取り込み済みのため、取り込みを省略しました（{seconds:.2f}秒）")
+            return {'skipped': True, 'rows': self._meta('rows', 0), 'inserted': 0, 'updated': 0, 'deleted': 0,
+                    'seconds': seconds}
+
+        with self.conn:
+            if (self._meta('version') != INDEX_VERSION or self._meta('key_column') != key_column
+                    or self.value_columns != value_columns):
+                self._create_members(value_columns)
+
+            # 一時テーブルにスナップショット全体のキーと値を読み込む（同じキーは後の行で上書きする）
+            columns_sql = _value_columns_sql(len(value_columns))
+            self.conn.execute("DROP TABLE IF EXISTS temp.incoming")
+            self.conn.execute(f"CREATE TEMP TABLE incoming (key TEXT PRIMARY KEY, row_id INTEGER NOT NULL"
+                              f"{''.join(f', c{i} TEXT' for i in range(len(value_columns)))}) WITHOUT ROWID")
+            placeholders = ', '.join('?' * (len(value_columns) + 2))
+            rows = 0
+            if df is None:
+                chunks = pd.read_csv(csv_path, header=header, encoding=encoding, dtype=str,
+                                     usecols=[key_column, *value_columns], chunksize=chunksize)
+            else:
+                chunks = (df.iloc[start:start + chunksize] for start in range(0, len(df), chunksize))
+            for df_chunk in chunks:
+                df_chunk = df_chunk[[key_column, *value_columns]].astype(object)
+                records = df_chunk.where(df_chunk.notna(), None)
+                records.insert(1, '__row_id', np.arange(rows, rows + len(df_chunk)))
+                records = records[records[key_column].notna()]
+                self.conn.executemany(f"INSERT OR REPLACE INTO incoming VALUES ({placeholders})",
+                                      records.itertuples(index=False, name=None))
+                rows += len(df_chunk)
+
+            # なくなったキーを削除し、追加・変更されたキーだけを書き込む
+            deleted = self.conn.execute(
+                "DELETE FROM members WHERE key NOT IN (SELECT key FROM incoming)").rowcount
+            inserted = self.conn.execute(
+                f"INSERT INTO members SELECT key, row_id{columns_sql} FROM incoming "
+                f"WHERE key NOT IN (SELECT key FROM members)").rowcount
+            differs = ' OR '.join(['m.row_id IS NOT i.row_id']
+                                  + [f"m.c{i} IS NOT i.c{i}" for i in range(len(value_columns))])
+            updated = self.conn.execute(
+                f"REPLACE INTO members SELECT i.key, i.row_id{_value_columns_sql(len(value_columns), 'i.')} "
+                f"FROM incoming i JOIN members m ON m.key = i.key WHERE {differs}").rowcount
+            self.conn.execute("DROP TABLE temp.incoming")
+
+            self._set_meta(version=INDEX_VERSION, snapshot_hash=snapshot_hash, source=os.path.abspath(csv_path),
+                           key_column=key_column, value_columns=value_columns, rows=rows, ingested_at=time.time())
+        # WALの内容をデータベースファイルに書き戻し、サイズを実際のデータベースの大きさにする
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+        seconds = time.perf_counter() - start_time
+        print(f"キーインデックス: '{csv_path}' を取り込みました（{rows}行、{seconds:.2f}秒、{rows / max(seconds, 1e-9):,.0f}行/秒）")
+        print(f"  追加: {inserted}件、変更: {updated}件、削除: {deleted}件、"
+              f"データベースのサイズ: {self.size() / (1024 * 1024):.2f} MB")
+        return {'skipped': False, 'rows': rows, 'inserted': inserted, 'updated': updated, 'deleted': deleted,
+                'seconds': seconds}
+
+    def size(self):
+        """データベースファイル（WALを含む）のサイズ（バイト単位）"""
+        return sum(os.path.getsize(path) for path in (self.db_path, self.db_path + '-wal')
+                   if os.path.exists(path))
+
+    def _stage_keys(self, keys, values=None):
+        """検索するキー（と値）を一時テーブル query に入れる"""
+        keys = pd.Series(keys, dtype=object).reset_index(drop=True)
+        staged = pd.DataFrame({'pos': np.arange(len(keys)), 'key': keys.where(keys.notna(), None)})
+        value_count = 0 if values is None else len(values.columns)
+        if values is not None:
+            for i, column in enumerate(values.columns):
+                column_values = values[column].astype(object).reset_index(drop=True)
+                staged[f'v{i}'] = column_values.where(column_values.notna(), None)
+        self.conn.execute("DROP TABLE IF EXISTS temp.query")
+        self.conn.execute(f"CREATE TEMP TABLE query (pos INTEGER PRIMARY KEY, key TEXT"
+                          f"{''.join(f', v{i} TEXT' for i in range(value_count))})")
+        self.conn.executemany(f"INSERT INTO query VALUES ({', '.join('?' * (value_count + 2))})",
+                              staged.itertuples(index=False, name=None))
+
+    def lookup(self, keys):
+        """
+        各キーの行の位置をまとめて求める
+
+        Args:
+            keys (pd.Series): 検索するキー
+
+        Returns:
+            np.ndarray: 各キーの行の位置（見つからないキーは -1）
+        """
+        start_time = time.perf_counter()
+        with self.conn:
+            self._stage_keys(keys)
+            found = self.conn.execute(
+                "SELECT q.pos, m.row_id FROM query q JOIN members m ON m.key = q.key").fetchall()
+            self.conn.execute("DROP TABLE temp.query")
+        targets = np.full(len(keys), -1, dtype=np.int64)
+        if found:
+            positions, row_ids = np.array(found, dtype=np.int64).T
+            targets[positions] = row_ids
+        seconds = time.perf_counter() - start_time
+        print(f"キーインデックス: {len(keys)}件のキーを検索しました（一致: {len(found)}件、{seconds:.3f}秒、"
+              f"{len(keys) / max(seconds, 1e-9):,.0f}件/秒）")
+        return targets
+
+    def changed_cells(self, df_a, key_column, column_pairs):
+        """
+        システムAの値と、最後に取り込んだスナップショットの値が異なるセルの数をカラムごとに求める
+        （システムAの値がNaNのセルは数えない。apply_updates の skip_missing=True と同じ）
+
+        Args:
+            df_a (pd.DataFrame): システムAのデータフレーム
+            key_column (str): システムAのマッチングキーのカラム名
+            column_pairs (list): [(システムAのカラム名, システムBのカラム名), ...]
+                df_a にないカラムとインデックスに値を保存していないカラムは無視する
+
+        Returns:
+            dict: {システムBのカラム名: 値が異なるセルの数}
+        """
+        column_pairs = [(a_col, b_col) for a_col, b_col in column_pairs
+                        if a_col in df_a.columns and b_col in self.value_columns]
+        a_columns = list(dict.fromkeys(a_col for a_col, _ in column_pairs))
+        with self.conn:
+            self._stage_keys(df_a[key_column], df_a[a_columns])
+            counts = {}
+            for a_col, b_col in column_pairs:
+                v = f"q.v{a_columns.index(a_col)}"
+                c = f"m.c{self.value_columns.index(b_col)}"
+                counts[b_col] = counts.get(b_col, 0) + self.conn.execute(
+                    f"SELECT COUNT(*) FROM query q JOIN members m ON m.key = q.key "
+                    f"WHERE {v} IS NOT NULL AND {v} IS NOT {c}").fetchone()[0]
+            self.conn.execute("DROP TABLE temp.query")
+        return counts
@@ -0,0 +1,463 @@
+"""
+CSVマージエンジン
+
+システムA（更新元）の行をマッチングキーでシステムB（更新先）の行に対応付け、
+マッピングされたカラムの値をカラム単位でまとめて更新する。
+行ごとに iterrows() と df.at[] で1セルずつ比較・代入する処理と同じ結果・同じ統計になる。
+"""
+
+import csv
+import io
+import os
+import re
+
+import chardet
+import numpy as np
+import pandas as pd
+
+from csv_cp932_writer import Cp932CsvWriter
+
+
+# YYYY-MM-DD形式の日付を検出する正規表現
+DATE_PATTERN = re.compile(r'(\d{4})-(\d{1,2})-(\d{1,2})')
+# 日付の変換後の形式（YYYY/MM/DD）
+DATE_REPLACEMENT = r'\1/\2/\3'
+# 校舎タグの値が入っているシステムAのカラム
+TAG_SOURCE_COLUMN = '校舎=校舎名のタグで1'
+# エンコーディングを推定するときに読み込むファイル先頭のバイト数
+SNIFF_PREFIX_BYTES = 64 * 1024
+# 先頭がASCIIだけの場合に、エンコーディングの推定のために読み進める最大バイト数
+SNIFF_MAX_SCAN_BYTES = 1024 * 1024
+# SNIFF_MAX_SCAN_BYTES まで読んでもASCIIだけだった場合のエンコーディング（パイプラインの入力はCP932）
+SNIFF_FALLBACK_ENCODING = 'CP932'
+
+
+def date_converters(columns, pattern=DATE_PATTERN, replacement=DATE_REPLACEMENT):
+    """
+    日付のカラムの値を変換する関数を返す（デフォルトは YYYY-MM-DD -> YYYY/MM/DD）
+    apply_updates の converters に渡すと、比較は変換前の値で行い、更新するセルの値だけをまとめて変換する
+
+    Args:
+        columns (list): 日付のカラム名
+        pattern (str or re.Pattern): 日付を検出する正規表現
+        replacement (str): 変換後の形式（re.sub と同じ置換文字列）
+
+    Returns:
+        dict: {カラム名: 値の配列を変換する関数}
+    """
+    pattern = re.compile(pattern)
+
+    def convert(values):
+        return pd.Series(values, dtype=object).str.replace(pattern, replacement, regex=True).to_numpy(dtype=object)
+
+    return {column: convert for column in columns}
+
+
+def _key_strings(keys):
+    """マッチングキーの値を文字列のリストにする（NaNはNoneとする）"""
+    return [None if pd.isna(key) else str(key) for key in pd.Series(keys).to_numpy(dtype=object)]
+
+
+def build_key_index(keys):
+    """
+    マッチングキーの値から行の位置を引くインデックスを作成する
+
+    同じキーが複数行にある場合は、{str(key): idx for idx, key in enumerate(keys)} と同じく最後の行を使う。
+    NaNのキーはインデックスに含めない。
+
+    Args:
+        keys (pd.Series): マッチングキーのカラム
+
+    Returns:
+        pd.Series: キー（文字列）をインデックス、行の位置を値とするSeries
+    """
+    keys = _key_strings(keys)
+    valid = [key is not None for key in keys]
+    index = pd.Series(np.flatnonzero(valid), index=pd.Index([key for key in keys if key is not None], dtype=object))
+    return index[~index.index.duplicated(keep='last')]
+
+
+def lookup_keys(index, keys):
+    """
+    マッチングキーの値ごとに、build_key_index で作成したインデックスから行の位置を求める
+
+    Returns:
+        np.ndarray: 行の位置（見つからないキーは -1）
+    """
+    found = index.index.get_indexer(_key_strings(keys))
+    if len(index) == 0:
+        return found
+    return np.where(found >= 0, index.to_numpy()[found], -1)
+
+
+def build_multi_slot_index(df, key_columns):
+    """
+    複数のカラム（生徒1〜3の顧客番号など）のどれかにあるキーから、行の位置とスロット番号を引くインデックスを作成する
+
+    全スロットのキーを1列に積み上げてまとめて作成する。
+    同じスロットに同じキーが複数行ある場合は最後の行を使い、
+    複数のスロットにあるキーは、スロット番号が小さい方（key_columns の先の方）を使う。
+
+    Args:
+        df (pd.DataFrame): 検索対象のデータフレーム
+        key_columns (list): スロットごとのキーのカラム名（先頭がスロット1）
+
+    Returns:
+        tuple: (index, conflicts)
+            index: キー（文字列）をインデックスとし、'row'（行の位置）と 'slot'（スロット番号）を列に持つDataFrame
+            conflicts: {'multi_slot': {キー: [スロット番号, ...]}, 'duplicated': {キー: [スロット番号, ...]}}
+                multi_slot は複数のスロットにあるキー、duplicated は同じスロットの複数行にあるキー
+    """
+    stacked = pd.DataFrame({
+        'key': [key for column in key_columns for key in _key_strings(df[column])],
+        'row': np.tile(np.arange(len(df)), len(key_columns)),
+        'slot': np.repeat(np.arange(1, len(key_columns) + 1), len(df)),
+    }).dropna(subset=['key'])
+
+    duplicated = stacked[stacked.duplicated(['slot', 'key'], keep=False)]
+    stacked = stacked.drop_duplicates(['slot', 'key'], keep='last')
+    slots_per_key = stacked.groupby('key', sort=False)['slot'].agg(list)
+    conflicts = {
+        'multi_slot': slots_per_key[slots_per_key.map(len) > 1].to_dict(),
+        'duplicated': duplicated.groupby('key', sort=False)['slot'].agg(lambda slots: sorted(set(slots))).to_dict(),
+    }
+
+    index = stacked.sort_values('slot', kind='stable').drop_duplicates('key', keep='first')
+    return index.set_index('key')[['row', 'slot']], conflicts
+
+
+def lookup_multi_slot(index, keys):
+    """
+    マッチングキーの値ごとに、build_multi_slot_index で作成したインデックスから行の位置とスロット番号を求める
+
+    Returns:
+        tuple: (行の位置, スロット番号) の np.ndarray（見つからないキーはそれぞれ -1, 0）
+    """
+    found = index.index.get_indexer(_key_strings(keys))
+    if len(index) == 0:
+        return found, np.zeros(len(found), dtype=np.int64)
+    rows = np.where(found >= 0, index['row'].to_numpy()[found], -1)
+    slots = np.where(found >= 0, index['slot'].to_numpy()[found], 0)
+    return rows, slots
+
+
+def _assign_values(df_b, rows, column, values):
+    """
+    df_b の column 番目のカラムの rows 行に値を書き込む
+    カラムの型のままでは書き込めない値（数値のカラムへの文字列など）の場合は、カラム全体の型を推定し直す
+    """
+    # df.at[] で1セルずつ代入した場合と同じ型になるよう、値の型を推定した配列、値のリストの順に試す
+    for candidate in (pd.Series(values, dtype=object).infer_objects().to_numpy(), values.tolist()):
+        try:
+            df_b.iloc[rows, column] = candidate
+            return
+        except (TypeError, ValueError):
+            pass
+    column_values = df_b.iloc[:, column].to_numpy(dtype=object).copy()
+    column_values[rows] = values
+    df_b.isetitem(column, pd.Series(column_values, index=df_b.index, dtype=object).infer_objects())
+
+
+def apply_updates(df_b, df_a, targets, column_pairs, skip_missing=True, changes=None, converters=None):
+    """
+    システムAの各行の値で、対応するシステムBの行を更新する
+
+    システムAに値があり（NaNでない）、システムBの現在の値と異なるセルだけを更新する。
+    比較は1セルずつ != で比較した場合と同じ結果になる。
+    同じシステムBの行に対応するシステムAの行が複数ある場合は、システムAの行の順に1行ずつ
+    適用した場合と同じ結果になるよう、対応先が重複しない行の組（ラウンド）ごとに適用する。
+
+    Args:
+        df_b (pd.DataFrame): 更新先のデータフレーム（直接更新される）
+        df_a (pd.DataFrame): 更新元のデータフレーム
+        targets (np.ndarray): df_a の各行に対応する df_b の行の位置
+        column_pairs (list): 更新するカラムの組 [(システムAのカラム名, システムBのカラム名), ...]
+            df_a にないカラムは無視する
+        skip_missing (bool): システムAの値がNaNのセルを更新しないか
+            Falseの場合はNaNも他の値と同じく比較して書き込む（NaN同士も異なる値として扱う）
+        changes (dict): 指定した場合、更新したセルの df_b の行の位置をカラムごとに記録する
+            {システムBのカラム名: [行の位置の配列, ...]}
+        converters (dict): 指定した場合、書き込む値をこの関数で変換する {システムAのカラム名: 関数}
+            比較は変換前の値で行い、更新するセルの値だけを変換する
+
+    Returns:
+        tuple: (df_a の各行で1セル以上更新されたかを表すbool配列, 更新されたセル数)
+    """
+    targets = np.asarray(targets, dtype=np.int64)
+    row_updated = np.zeros(len(targets), dtype=bool)
+    updated_cells = 0
+    column_pairs = [(a_col, b_col) for a_col, b_col in column_pairs if a_col in df_a.columns]
+    if len(targets) == 0 or not column_pairs:
+        return row_updated, updated_cells
+
+    a_values = {a_col: df_a[a_col].to_numpy(dtype=object) for a_col, _ in column_pairs}
+    converters = converters or {}
+    rounds = pd.Series(targets).groupby(targets).cumcount().to_numpy()
+
+    for round_number in range(rounds.max() + 1):
+        selected = np.flatnonzero(rounds == round_number)
+        rows_b = targets[selected]
+        for a_col, b_col in column_pairs:
+            column = df_b.columns.get_loc(b_col)
+            original_values = df_b.iloc[rows_b, column].to_numpy(dtype=object)
+            new_values = a_values[a_col][selected]
+
+            # システムAに値が存在していて、値が異なる場合のみ更新
+            changed = original_values != new_values
+            if skip_missing:
+                changed &= pd.notna(new_values)
+            if not changed.any():
+                continue
+
+            new_values = new_values[changed]
+            if a_col in converters:
+                new_values = converters[a_col](new_values)
+            _assign_values(df_b, rows_b[changed], column, new_values)
+            if changes is not None:
+                changes.setdefault(b_col, []).append(rows_b[changed])
+            updated_cells += int(changed.sum())
+            row_updated[selected[changed]] = True
+
+    return row_updated, updated_cells
+
+
+def apply_tags(df_b, df_a, targets, tags, tag_column=TAG_SOURCE_COLUMN, flag='1', changes=None):
+    """
+    システムAのタグの値に対応するシステムBのタグのカラムに、まとめてフラグを立てる
+
+    tag_column の値を tags で変換し、タグのカラムごとに1回の代入で対応するすべての行を更新する。
+    処理量は1行あたりのタグ数によらない。
+
+    Args:
+        df_b (pd.DataFrame): 更新先のデータフレーム（直接更新される）
+        df_a (pd.DataFrame): 更新元のデータフレーム
+        targets (np.ndarray): df_a の各行に対応する df_b の行の位置
+        tags (dict): タグのマッピング辞書 {システムAのタグの値: システムBのタグのカラム名}
+        tag_column (str): タグの値が入っているシステムAのカラム名
+        flag (str): タグのカラムに書き込む値
+        changes (dict): 指定した場合、値が変わったセルの df_b の行の位置をカラムごとに記録する（apply_updates と同じ形式）
+
+    Returns:
+        int: フラグを立てたセルのうち、元の値と異なっていたセルの数
+    """
+    targets = np.asarray(targets, dtype=np.int64)
+    if not tags or len(targets) == 0:
+        return 0
+
+    tag_columns = df_a[tag_column].map(tags).to_numpy(dtype=object)
+    changed_cells = 0
+    for b_col in dict.fromkeys(tags.values()):
+        rows_b = targets[tag_columns == b_col]
+        if len(rows_b) == 0:
+            continue
+        column = df_b.columns.get_loc(b_col)
+        changed = df_b.iloc[rows_b, column].to_numpy(dtype=object) != flag
+        changed_cells += int(changed.sum())
+        df_b.iloc[rows_b, column] = flag
+        if changes is not None and changed.any():
+            changes.setdefault(b_col, []).append(rows_b[changed])
+    return changed_cells
+
+
+def select_delta(df_b, category_line, changes, keep_columns=(), drop_unchanged_columns=False):
+    """
+    apply_updates・apply_tags で記録した changes から、1セル以上更新された行だけを取り出す
+
+    Args:
+        df_b (pd.DataFrame): 更新後のデータフレーム
+        category_line (str): df_b のカテゴリ行
+        changes (dict): 更新したセルの行の位置 {システムBのカラム名: [行の位置の配列, ...]}
+        keep_columns (iterable): drop_unchanged_columns の場合も残すカラム名（マッチングキーなど）
+        drop_unchanged_columns (bool): どの行でも更新されなかったカラムを除くか
+
+    Returns:
+        tuple: (更新された行のデータフレーム, カテゴリ行) - カラムを除いた場合はカテゴリ行の対応するセルも除く
+    """
+    changed_rows = np.zeros(len(df_b), dtype=bool)
+    for positions in changes.values():
+        for rows in positions:
+            changed_rows[rows] = True
+    df_delta = df_b[changed_rows]
+
+    if drop_unchanged_columns:
+        keep = set(keep_columns) | set(changes)
+        positions = [position for position, column in enumerate(df_b.columns) if column in keep]
+        df_delta = df_delta.iloc[:, positions]
+        categories = next(csv.reader([category_line.rstrip('\r\n')]), [])
+        categories += [''] * (len(df_b.columns) - len(categories))
+        output = io.StringIO()
+        csv.writer(output, lineterminator='').writerow([categories[position] for position in positions])
+        category_line = output.getvalue()
+
+    return df_delta, category_line
+
+
+def read_columns(csv_path, header=1, encoding='CP932'):
+    """CSVファイルのカラム名だけを読み込む"""
+    return pd.read_csv(csv_path, header=header, encoding=encoding, dtype=str, nrows=0).columns.tolist()
+
+
+def _sniff_encoding(file, sniff_bytes=SNIFF_PREFIX_BYTES, max_scan_bytes=SNIFF_MAX_SCAN_BYTES):
+    """
+    開いているファイルの先頭 sniff_bytes バイトからエンコーディングを推定し、ファイルの先頭に戻す
+
+    先頭がASCIIだけの場合は、ASCII以外のバイトを含む最初のブロックまで読み進めて推定する
+    （ファイル全体がASCIIなら 'ascii' を返す）。
+    先頭から max_scan_bytes バイトを読んでもASCIIだけの場合は、それ以上読まずに SNIFF_FALLBACK_ENCODING を返す。
+    """
+    block = file.read(sniff_bytes)
+    scanned = len(block)
+    at_eof = len(block) < sniff_bytes
+    while block.isascii() and not at_eof:
+        if scanned >= max_scan_bytes:
+            file.seek(0)
+            return SNIFF_FALLBACK_ENCODING
+        size = min(sniff_bytes, max_scan_bytes - scanned)
+        next_block = file.read(size)
+        at_eof = len(next_block) < size
+        if not next_block:
+            break
+        block = next_block
+        scanned += len(block)
+    file.seek(0)
+    return chardet.detect(block)['encoding'] or 'ascii'
+
+
+def read_two_row_header_csv(csv_path, encoding=None, sniff_bytes=SNIFF_PREFIX_BYTES,
+                            sniff_max_bytes=SNIFF_MAX_SCAN_BYTES, **read_csv_kwargs):
+    """
+    1行目がカテゴリ行、2行目がカラム名のCSVファイルを1回開くだけで読み込む
+
+    encoding を指定しない場合は、ファイルの先頭 sniff_bytes バイトからエンコーディングを推定する
+    （先頭がASCIIだけの場合も、読み進めるのは sniff_max_bytes バイトまで）。
+    カテゴリ行を読み込んだ後、同じファイルの続きをカラム名の行から pd.read_csv で読み込む。
+
+    Args:
+        csv_path (str): CSVファイルパス
+        encoding (str): CSVファイルのエンコーディング（None の場合は推定する）
+        sniff_bytes (int): エンコーディングの推定に使う先頭のバイト数
+        sniff_max_bytes (int): 先頭がASCIIだけの場合に、推定のために読み進める最大バイト数
+        **read_csv_kwargs: pd.read_csv に渡す引数（dtype, usecols など。header は指定できない）
+
+    Returns:
+        tuple: (df, category_line, encoding) - 読み込んだデータフレーム、
+               カテゴリ行（改行を含むファイルのままの文字列）、使ったエンコーディング
+    """
+    with open(csv_path, 'rb') as raw:
+        if encoding is None:
+            encoding = _sniff_encoding(raw, sniff_bytes, sniff_max_bytes)
+        with io.TextIOWrapper(raw, encoding=encoding, newline='') as f:
+            category_line = f.readline()
+            df = pd.read_csv(f, header=0, **read_csv_kwargs)
+    return df, category_line, encoding
+
+
+def plan_usecols(csv_path, columns, optional=(), header=0, encoding='CP932', sample_rows=1000):
+    """
+    更新に使うカラムだけを読み込むための usecols を求める
+
+    ファイルのカラム名を読み込み、columns と optional のうちファイルにあるカラムを usecols とする。
+    読み込まないカラムのバイト数は、先頭 sample_rows 行のバイト数の割合からファイル全体の分を推定する。
+
+    Args:
+        csv_path (str): CSVファイルパス
+        columns (iterable): 更新に使うカラム名（マッチングキー、マッピング辞書の値、タグのカラムなど）
+        optional (iterable): ファイルにあれば読み込むカラム名（ログの表示用など。ファイルになくても missing に含めない）
+        header (int): カラム名の行番号（0始まり）
+        encoding (str): CSVファイルのエンコーディング
+        sample_rows (int): 読み込まないバイト数の推定に使う行数
+
+    Returns:
+        dict: {'usecols': 読み込むカラム名のリスト（ファイルの順）, 'missing': ファイルにないカラム名のリスト,
+               'total_columns': ファイルのカラム数, 'skipped_columns': 読み込まないカラム数,
+               'skipped_bytes': 読み込まないカラムの推定バイト数}
+    """
+    columns = list(dict.fromkeys(columns))
+    available = read_columns(csv_path, header=header, encoding=encoding)
+    wanted = set(columns) | set(optional)
+    usecols = [column for column in available if column in wanted]
+    skipped = [column for column in available if column not in wanted]
+
+    skipped_bytes = 0
+    if skipped:
+        sample = pd.read_csv(csv_path, header=header, encoding=encoding, dtype=str, nrows=sample_rows,
+                             keep_default_na=False)
+        # 各セルのバイト数（区切りのカンマを含む）を数える
+        column_bytes = {column: sum(len(value.encode(encoding)) + 1 for value in sample[column]) for column in available}
+        sample_bytes = sum(column_bytes.values())
+        if sample_bytes:
+            skipped_ratio = sum(column_bytes[column] for column in skipped) / sample_bytes
+            skipped_bytes = int(os.path.getsize(csv_path) * skipped_ratio)
+
+    return {
+        'usecols': usecols,
+        'missing': [column for column in columns if column not in available],
+        'total_columns': len(available),
+        'skipped_columns': len(skipped),
+        'skipped_bytes': skipped_bytes,
+    }
+
+
+def print_column_plan(plan, name):
+    """plan_usecols で求めた読み込むカラムと読み込まないカラムの情報を表示する"""
+    print(f"{name}の読み込み: {plan['total_columns']}列中{len(plan['usecols'])}列を読み込みます"
+          f"（{plan['skipped_columns']}列、推定{plan['skipped_bytes'] / (1024 * 1024):.2f} MBを読み飛ばします）")
+    if plan['missing']:
+        print(f"警告: {name}のCSVにない列は更新に使いません: {', '.join(map(str, plan['missing']))}")
+
+
+def update_in_chunks(system_b_csv, output_csv, header_line, targets, update_chunk, chunksize,
+                     encoding='CP932', errors='strict', delta=False):
+    """
+    システムBをチャンクごとに読み込んで更新し、そのまま出力ファイルに追記する
+    システムB全体をメモリに保持しないので、メモリ使用量はチャンクサイズで決まる
+
+    Args:
+        system_b_csv (str): システムBのCSVファイルパス（1行目がカテゴリ行、2行目がカラム名）
+        output_csv (str): 出力CSVファイルパス
+        header_line (str): 出力の先頭に書き込むカテゴリ行
+        targets (np.ndarray): 更新元の各行に対応するシステムBの行の位置（ファイル全体での位置、対応先がない行は -1）
+        update_chunk (callable): チャンクを更新する関数 update_chunk(df_chunk, in_chunk, chunk_targets, changes)
+            in_chunk は更新元の各行の対応先がこのチャンクにあるかを表すbool配列、
+            chunk_targets はその行のチャンク内での位置、changes は更新したセルを記録する辞書
+            （apply_updates の changes に渡す）。(更新された行数, 更新されたセル数) を返す
+        chunksize (int): 1回に読み込むシステムBの行数
+        encoding (str): システムBと出力ファイルのエンコーディング
+        errors (str): 出力ファイルにエンコードできない文字の処理方法（csv_cp932_writer.Cp932CsvWriter を参照）
+        delta (bool): 1セル以上更新された行だけを出力するか
+
+    Returns:
+        tuple: (更新された行数, 更新されたセル数, 出力した行数)
+    """
+    targets = np.asarray(targets, dtype=np.int64)
+    updated_rows = 0
+    updated_cells = 0
+
+    # まず、保存していたカテゴリ行を書き込む
+    writer = Cp932CsvWriter(output_csv, header_line, encoding=encoding, errors=errors)
+    try:
+        start = 0
+        first_chunk = True
+        for df_chunk in pd.read_csv(system_b_csv, header=1, encoding=encoding, dtype=str, chunksize=chunksize):
+            chunk_length = len(df_chunk)
+            in_chunk = (targets >= start) & (targets < start + chunk_length)
+            changes = {}
+            chunk_rows, chunk_cells = update_chunk(df_chunk, in_chunk, targets[in_chunk] - start, changes)
+            updated_rows += chunk_rows
+            updated_cells += chunk_cells
+            if delta:
+                df_chunk, _ = select_delta(df_chunk, header_line, changes)
+            # その後、チャンクを追記する（カラム名の行は最初のチャンクだけ）
+            writer.write(df_chunk, header=first_chunk)
+            first_chunk = False
+            start += chunk_length
+
+        if first_chunk:
+            # データ行がない場合もカラム名の行は書き込む
+            writer.write(pd.DataFrame(columns=read_columns(system_b_csv, encoding=encoding)))
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
+
+    return updated_rows, updated_cells, writer.rows
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+CSV変換・分割パイプライン
+
+csv_cp932_converter.py でCP932に変換したファイルを csv_splitter.py で分割する2段階の処理を、
+変換後の全体ファイルをディスクに書き出さずに1回の処理で行う。
+エンコーダーから出てきたCP932のバイト列をそのまま分割処理に流し、分割ファイルのサイズは
+エンコード後のバイト数で判定する。出力は2段階で処理した場合と同じファイル名・同じバイト列になる。
+
+Usage:
+    python csv_pipeline.py input.csv [--max-size 1.0]
+"""
+
+import os
+import argparse
+
+from csv_cp932_converter import (
+    CP932_COMPATIBLE_ENCODINGS,
+    UnencodableCharReport,
+    copy_file_fast,
+    detect_source_encoding,
+    iter_cp932_chunks,
+    load_substitutions,
+)
+from csv_splitter import StreamingCsvSplitter, split_csv_bytes, write_manifest
+
+
+def convert_and_split(file_path, max_size_mb=1, substitutions=None, nfkc_fallback=True, workers=None,
+                      manifest=True):
+    """
+    ファイルの文字コードを確認してCP932(Shift_JIS)に変換しながら、指定サイズ以下に分割する
+
+    変換後のサイズが max_size_mb 以下の場合は分割せず、元ファイル名_cp932.csv に保存する。
+    超える場合は元ファイル名_cp932_part1.csv, _part2.csv ... に分割する（元ファイル名_cp932.csv は作成しない）。
+    入力が既にCP932としてそのまま使える場合は、変換せずに入力ファイルを直接分割する。
+
+    Args:
+        file_path (str): 入力ファイルのパス
+        max_size_mb (float): 分割後の各ファイルの最大サイズ（MB単位）
+        substitutions (dict): CP932にエンコードできない文字の置換テーブル {'置換前の文字': '置換後の文字列'}
+        nfkc_fallback (bool): 置換テーブルにない文字をNFKC正規化で置換するか
+        workers (int): 入力を直接分割する場合に、分割ファイルを並列に書き込むスレッド数
+        manifest (bool): 分割した場合に分割ファイルの一覧（マニフェスト）を書き出すか
+
+    Returns:
+        dict: 処理結果 {'input', 'encoding', 'method', 'unencodable', 'files'}
+    """
+    max_size_bytes = max_size_mb * 1024 * 1024  # MBをバイトに変換
+    base_name = os.path.splitext(file_path)[0]
+    output_path = f"{base_name}_cp932.csv"
+    split_base_name = os.path.splitext(output_path)[0]
+
+    # 文字コードを検出する
+    encoding, errors = detect_source_encoding(file_path)
+    unencodable = 0
+
+    if encoding in CP932_COMPATIBLE_ENCODINGS and errors == 'strict':
+        # 変換しても同じバイト列になるので、入力をそのままコピーまたは分割する
+        if os.path.getsize(file_path) <= max_size_bytes:
+            method = copy_file_fast(file_path, output_path)
+            files = [output_path]
+        else:
+            method = 'split'
+            parts = split_csv_bytes(file_path, split_base_name, '.csv', max_size_bytes, 'CP932', workers)
+            if not parts:
+                raise RuntimeError(f"'{file_path}' の分割に失敗しました")
+            if manifest:
+                write_manifest(file_path, split_base_name, 'CP932', parts)
+            files = [part['path'] for part in parts]
+        print(f"{encoding} はCP932としてそのまま使えるため、変換せずに処理しました")
+    else:
+        # CP932に変換しながら分割する
+        report = UnencodableCharReport(substitutions, nfkc_fallback=nfkc_fallback)
+        splitter = StreamingCsvSplitter(output_path, max_size_bytes)
+        try:
+            for data in iter_cp932_chunks(file_path, encoding, errors, report=report):
+                splitter.feed(data)
+            parts = splitter.close()
+        except BaseException:
+            splitter.abort()
+            raise
+        report.summarize(output_path)
+        unencodable = report.total
+
+        if parts:
+            method = 'transcode+split'
+            if manifest:
+                write_manifest(file_path, split_base_name, 'CP932', parts)
+            files = [part['path'] for part in parts]
+        else:
+            method = 'transcode'
+            files = [output_path]
+            print(f"CP932で保存完了: {output_path}")
+
+    print("\n--- 処理結果 ---")
+    print(f"入力ファイル: {file_path}")
+    print(f"文字コード: {encoding}")
+    print(f"処理方式: {method}")
+    print("出力ファイル:")
+    for path in files:
+        print(f"- {path}")
+
+    return {
+        'input': file_path,
+        'encoding': encoding,
+        'method': method,
+        'unencodable': unencodable,
+        'files': files,
+    }
+
+
+if __name__ == "__main__":
+    # コマンドライン引数の設定
+    parser = argparse.ArgumentParser(description='CSVファイルをCP932(Shift_JIS)に変換しながら指定サイズ以下に分割するツール')
+    parser.add_argument('input', help='変換・分割するCSVファイルのパス')
+    parser.add_argument('--max-size', type=float, default=1.0, help='分割後の各ファイルの最大サイズ（MB単位、デフォルト: 1.0）')
+    parser.add_argument('--substitutions', help='CP932にエンコードできない文字の置換テーブル（JSON形式: {"置換前の文字": "置換後の文字列"}）')
+    parser.add_argument('--no-nfkc', action='store_true', help='置換テーブルにない文字をNFKC正規化で置換しない（"?"に置換する）')
+    parser.add_argument('--workers', type=int, help='分割ファイルを並列に書き込むスレッド数（デフォルト: CPU数に応じて自動）')
+    parser.add_argument('--no-manifest', action='store_true', help='分割ファイルの一覧（_manifest.json）を書き出さない')
+
+    # 引数の解析
+    args = parser.parse_args()
+
+    substitutions = load_substitutions(args.substitutions) if args.substitutions else None
+    convert_and_split(args.input, args.max_size, substitutions=substitutions, nfkc_fallback=not args.no_nfkc,
+                      workers=args.workers, manifest=not args.no_manifest)
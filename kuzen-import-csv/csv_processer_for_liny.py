@@ -1,16 +1,50 @@
 import pandas as pd
 import chardet
-import re
-from pyasn1.type import tag
+
+from csv_cp932_writer import write_cp932_csv
+from csv_fingerprint_store import FingerprintStore
+from csv_key_index import KeyIndex
+from csv_merge_engine import (apply_tags, apply_updates, build_key_index, date_converters, lookup_keys,
+                              plan_usecols, print_column_plan, read_two_row_header_csv, select_delta,
+                              update_in_chunks, DATE_PATTERN, DATE_REPLACEMENT, TAG_SOURCE_COLUMN)
+from csv_snapshot_cache import SnapshotCache
+
+
+# 日付形式を変換するKuzenのカラム（YYYY-MM-DD -> YYYY/MM/DD）
+DATE_COLUMNS = [
+    '生年月日',
+    '挙式日',
+    '最終利用日',
+    '利用開始日'
+]
+
+
+def _update_rows(df_b, df_a_matched, targets, columns_to_update, tags, changes=None, converters=None):
+    """
+    Kuzenの各行の値で対応するシステムBの行を更新する
+    （changes を指定した場合は、更新したセルの行の位置をカラムごとに記録する。
+    converters を指定した場合は、値を比較してから更新するセルの値だけを変換する）
+
+    Returns:
+    - (更新された行数, 更新されたセル数)
+    """
+    row_updated, updated_cells = apply_updates(df_b, df_a_matched, targets, list(columns_to_update.items()),
+                                               changes=changes, converters=converters)
+    # 校舎タグが一致するタグのカラムにフラグを立てる（tags が空の場合は何もしない）
+    apply_tags(df_b, df_a_matched, targets, tags, changes=changes)
+    return int(row_updated.sum()), updated_cells
 
 
 def update_customer_data(system_a_csv, system_b_csv, output_csv,
                          matching_key_a='ユーザーID', matching_key_b='LINE UserID',
                          tags=None,
-                         columns_to_update=None):
+                         columns_to_update=None,
+                         date_columns=DATE_COLUMNS, date_pattern=DATE_PATTERN, date_replacement=DATE_REPLACEMENT,
+                         chunksize=None, encoding_errors='strict', delta=False, drop_unchanged_columns=False,
+                         fingerprint_store=None, full_resync=False, key_index=None, snapshot_cache=None):
     """
     システムAのデータを使ってシステムBのデータを上書き更新する関数
-    システムAのデータを基準にループ処理を行う
+    システムAの各行をマッチングキーでシステムBの行に対応付け、カラム単位でまとめて更新する
     共通情報のみを更新する
 
     Parameters:
@@ -19,34 +53,78 @@ def update_customer_data(system_a_csv, system_b_csv, output_csv,
     - output_csv: 出力CSVファイルパス
     - matching_key_a: システムAでの顧客番号カラム名
     - matching_key_b: システムBでの生徒1の顧客番号カラム名
-    - tags: タグのマッピング辞書。今は使っていないので使う時は修正して下さい。
-    - columns_to_update: 共通情報の更新するカラムのマッピング辞書 {'システムBのカラム名': 'システムAのカラム名'}
+    - tags: タグのマッピング辞書 {'校舎=校舎名のタグで1 の値': 'システムBのタグのカラム名'}（空の場合はタグを更新しない）
+    - columns_to_update: 共通情報の更新するカラムのマッピング辞書 {'システムAのカラム名': 'システムBのカラム名'}
+    - date_columns: 日付形式を変換するシステムAのカラム名のリスト
+    - date_pattern: 日付を検出する正規表現（デフォルト: YYYY-MM-DD）
+    - date_replacement: 日付の変換後の形式（デフォルト: YYYY/MM/DD）
+    - chunksize: 指定した場合、システムBをこの行数ずつ読み込んで更新し、出力CSVに追記する
+      （システムB全体をメモリに保持しないため、更新後のデータフレームの代わりに出力CSVファイルパスを返す）
+    - encoding_errors: 出力CSVにCP932でエンコードできない文字があった場合の処理方法
+      （'strict' はセルの一覧を表示してエラーにする。'replace' は '?' に置き換えて、置き換えたセルの一覧を表示する）
+    - delta: True の場合、1セル以上更新された行だけを出力CSVに書き込む（カテゴリ行とカラム名の行はそのまま）
+    - drop_unchanged_columns: delta の場合に、どの行でも更新されなかったカラムも除く（マッチングキーのカラムは残す。
+      chunksize とは同時に指定できない）
+    - fingerprint_store: 指定した場合、このファイルに保存した前回のフィンガープリントと比べて、
+      新しく追加された、または更新に使うカラムの値が変わったKuzenの行だけを処理する（正常に終了したら、
+      システムBの行に対応付けたキーの分だけ保存し直す）
+    - full_resync: True の場合、fingerprint_store があってもすべての行を処理する
+    - key_index: 指定した場合、LinyのマッチングキーとマッピングされたカラムのSQLiteインデックスをこのファイルに保存し、
+      Kuzenの各行の対応先をインデックスから求める（同じLinyのファイルは2回目以降取り込みを省略する）
+    - snapshot_cache: 指定した場合、KuzenとLinyのファイルを読み込んだ結果をこのディレクトリにParquet形式で保存し、
+      2回目以降は同じ内容のファイルをCSVを解析せずに読み込む（pyarrow が必要。ない場合は毎回CSVを読み込む）
     """
     print(f"processing...")
     try:
+        # 更新対象カラムの設定
+        if tags is None or columns_to_update is None:
+            raise ValueError(f"関数への入力が正しくありません。")
+        if chunksize and drop_unchanged_columns:
+            raise ValueError(f"chunksize と drop_unchanged_columns は同時に指定できません。")
+
+        # マッピング辞書から更新に使うシステムAのカラムを求め、そのカラムだけを読み込む
+        columns_a = [matching_key_a, *columns_to_update]
+        if tags:
+            columns_a.append(TAG_SOURCE_COLUMN)
+        plan = plan_usecols(system_a_csv, columns_a, optional=["ID"], header=0, encoding="CP932")
+        if matching_key_a in plan['missing']:
+            raise ValueError(f"システムAのCSVに '{matching_key_a}' という列が見つかりません。")
+        if TAG_SOURCE_COLUMN in plan['missing']:
+            raise ValueError(f"システムAのCSVに '{TAG_SOURCE_COLUMN}' という列が見つかりません。")
+        print_column_plan(plan, "システムA")
+
+        # スナップショットキャッシュを使う場合は、同じ内容のファイルはCSVを解析せずに読み込む
+        snapshots = SnapshotCache(snapshot_cache) if snapshot_cache else None
+        read_csv = snapshots.read_csv if snapshots else pd.read_csv
+        read_two_row_header = snapshots.read_two_row_header_csv if snapshots else read_two_row_header_csv
+
         # データ部分を読み込む
-        df_a = pd.read_csv(system_a_csv, encoding="CP932", dtype=str)
+        df_a = read_csv(system_a_csv, encoding="CP932", dtype=str, usecols=plan['usecols'])
         print(f"システムAのデータ: {len(df_a)}行, {len(df_a.columns)}列")
         print(df_a[[matching_key_a]].head())  # 顧客番号のカラムを表示
 
         # システムBのCSVファイルを読み込む
         print(f"\nシステムBのCSVファイル '{system_b_csv}' を読み込んでいます...")
-        with open(system_b_csv, 'r', encoding='CP932') as f:
-            header_line = f.readline().strip()
-
-        # 検出されたエンコーディングを使用
-        df_b = pd.read_csv(system_b_csv, header=1, encoding="CP932", dtype=str)
+        if chunksize and key_index:
+            # システムB全体は読み込まず、マッチングキーはインデックスから引くのでカラム名までを読み込む
+            df_b = None
+            df_b_keys, category_line, _ = read_two_row_header_csv(system_b_csv, encoding="CP932", dtype=str, nrows=0)
+            columns_b = df_b_keys.columns
+        elif chunksize:
+            # システムB全体は読み込まず、先にマッチングキーのカラムだけを読み込む（更新はチャンクごとに行う）
+            df_b = None
+            df_b_keys, category_line, _ = read_two_row_header_csv(
+                system_b_csv, encoding="CP932", dtype=str, usecols=lambda column: column == matching_key_b)
+            columns_b = df_b_keys.columns
+        else:
+            df_b, category_line, _ = read_two_row_header(system_b_csv, encoding="CP932", dtype=str)
+            columns_b = df_b.columns
+        header_line = category_line.strip()
 
         # キー列の存在チェック
-        if matching_key_a not in df_a.columns:
-            raise ValueError(f"システムAのCSVに '{matching_key_a}' という列が見つかりません。")
-        if matching_key_b not in df_b.columns:
+        if matching_key_b not in columns_b:
             raise ValueError(f"システムBのCSVに '{matching_key_b}' という列が見つかりません。")
 
-        # 更新対象カラムの設定
-        if tags is None or columns_to_update is None:
-            raise ValueError(f"関数への入力が正しくありません。")
-
         nan_rows = df_a[df_a[matching_key_a].isna()]
         if not nan_rows.empty:
             print(f"\n警告: LinyのデータにNaNのマッチングキーが{len(nan_rows)}件あります")
@@ -61,66 +139,57 @@ def update_customer_data(system_a_csv, system_b_csv, output_csv,
         # 更新前の状態をバックアップ
         # df_b_original = df_b.copy()
 
-        # システムBの顧客番号をキーにして辞書を作成（高速なルックアップのため）
-        system_b_lookup_dict = {str(customer_id): idx for idx, customer_id in enumerate(df_b[matching_key_b])}
-
-        # 更新カウンタ
-        updated_rows = 0
-        updated_cells = 0
-        missing_customers = 0
-
-        # Kuzenの各行を処理 (変更部分: Kuzenをベースにループ)
-        for idx, row in df_a_clean.iterrows():
-            matching_id = row[matching_key_a]
-
-            # システムBにこのマッチングキーが存在するか確認
-            if str(matching_id) in system_b_lookup_dict:
-                b_idx = system_b_lookup_dict[str(matching_id)]
-                row_updated = False
-
-                for system_a_col_name, system_b_col_name in columns_to_update.items():
-                    if system_a_col_name in df_a_clean.columns:
-                        # 元の値と新しい値を取得
-                        original_value = df_b.at[b_idx, system_b_col_name]
-                        new_value = row[system_a_col_name]
-
-                        # Kuzenに値が存在していて、値が異なる場合のみ更新
-                        if original_value != new_value and not pd.isna(new_value):
-                            # 日付形式の変換 (YYYY-MM-DD -> YYYY/MM/DD)
-                            date_columns = [
-                                '生年月日',
-                                '挙式日',
-                                '最終利用日',
-                                '利用開始日'
-                            ]
-
-                            # 日付形式の文字列かどうかを正規表現で確認してから変換
-                            if system_a_col_name in date_columns and new_value and isinstance(new_value, str):
-                                # YYYY-MM-DD形式の日付を検出する正規表現
-                                date_pattern = r'(\d{4})-(\d{1,2})-(\d{1,2})'
-                                if re.search(date_pattern, new_value):
-                                    # 日付形式のハイフンのみを置換
-                                    new_value = re.sub(date_pattern, r'\1/\2/\3', new_value)
-
-                            df_b.at[b_idx, system_b_col_name] = new_value
-                            updated_cells += 1
-                            row_updated = True
-                # for tag_a_value, tag_b_column in tags.items():
-                #     df_a_tag_name = row['校舎=校舎名のタグで1']
-                #     if tag_a_value == df_a_tag_name:
-                #         original_value = df_b.at[b_idx, tag_b_column]
-                #         new_value = 1
-                #         if original_value != 1:
-                #             # タグが一致する場合のみ更新
-                #             df_b.at[b_idx, tag_b_column] = new_value
-
-                if row_updated:
-                    updated_rows += 1
-
-            else:
-                # システムBにマッチングキーが存在しない場合
-                missing_customers += 1
-                # print(f"Kuzenのマッチングキー '{matching_id}'、名前　'{row['ユーザー名']}' はLinyのシステムに存在しません。")
+        # 日付形式の変換 (YYYY-MM-DD -> YYYY/MM/DD)
+        # 比較は変換前の値で行い、更新するセルの値だけをカラム単位でまとめて変換する
+        converters = date_converters(date_columns, date_pattern, date_replacement)
+
+        # 前回から変わっていないKuzenの行はマージ処理に渡さない
+        store = None
+        if fingerprint_store:
+            store = FingerprintStore(fingerprint_store)
+            df_a_clean = store.filter_changed(df_a_clean, matching_key_a, columns_a,
+                                              signature=(list(columns_to_update.items()), sorted(tags.items())),
+                                              full_resync=full_resync)
+
+        if key_index:
+            # Linyのスナップショットを（変わっていれば）SQLiteのインデックスに取り込み、キーの検索と値の比較をSQLで行う
+            # （システムB全体を読み込み済みの場合は、CSVを読み込み直さずにそのデータフレームを取り込む）
+            index = KeyIndex(key_index)
+            try:
+                index.ingest(system_b_csv, matching_key_b,
+                             [b_col for b_col in columns_to_update.values() if b_col in columns_b], df=df_b)
+                changed_cells = index.changed_cells(df_a_clean, matching_key_a, list(columns_to_update.items()))
+                targets = index.lookup(df_a_clean[matching_key_a])
+            finally:
+                index.close()
+            # Kuzenの値がLinyの値と1セルも異ならないカラムは、比較・更新しても何も変わらないので除く
+            # （インデックスで比較しなかったカラムはそのまま比較・更新する）
+            columns_to_update = {a_col: b_col for a_col, b_col in columns_to_update.items()
+                                 if changed_cells.get(b_col) != 0}
+            skipped = [b_col for b_col, count in changed_cells.items() if count == 0]
+            print(f"Linyの値と異なるセルがないカラム: {len(skipped)}列（比較・更新しません）")
+        else:
+            # システムBの顧客番号をキーにしてインデックスを作成し、Kuzenの全行の対応先をまとめて求める
+            b_keys = (df_b_keys if df_b is None else df_b)[matching_key_b]
+            system_b_index = build_key_index(b_keys)
+            targets = lookup_keys(system_b_index, df_a_clean[matching_key_a])
+        matched = targets >= 0
+        missing_customers = int((~matched).sum())
+        df_a_matched = df_a_clean[matched]
+        targets = targets[matched]
+
+        # 対応先があるKuzenの行の値で、マッピングされたカラムをまとめて更新する
+        changes = {}
+        if df_b is None:
+            updated_rows, updated_cells, output_rows = update_in_chunks(
+                system_b_csv, output_csv, header_line, targets,
+                lambda df_chunk, in_chunk, chunk_targets, chunk_changes: _update_rows(
+                    df_chunk, df_a_matched[in_chunk], chunk_targets, columns_to_update, tags, chunk_changes,
+                    converters),
+                chunksize, errors=encoding_errors, delta=delta)
+        else:
+            updated_rows, updated_cells = _update_rows(df_b, df_a_matched, targets, columns_to_update, tags, changes,
+                                                       converters)
 
         # 更新統計
         print(f"\n更新統計:")
@@ -129,16 +198,31 @@ def update_customer_data(system_a_csv, system_b_csv, output_csv,
         print(f"更新された顧客: {updated_rows}件")
         print(f"更新されたセル: {updated_cells}件")
 
+        if df_b is None:
+            # チャンクごとに処理した場合は、既に出力CSVに保存済み
+            if delta:
+                print(f"出力した行数: {output_rows}件（更新された行のみ）")
+            print(f"\n結果を '{output_csv}' に保存しました。")
+            if store is not None:
+                store.save(df_a_matched[matching_key_a])
+            return output_csv
+
         # 結果を出力CSVに保存
         # df_b.to_csv(output_csv, index=False, encoding="shift_jis")
         # todo: output_csvをいい感じにできるなら
-        with open(output_csv, 'w', encoding='CP932') as f:
-            # まず、保存していたカテゴリ行を書き込む
-            f.write(header_line + '\n')
-            # その後、データフレームを書き込む
-            df_b.to_csv(f, index=False, encoding='CP932')
+        # まず、保存していたカテゴリ行を書き込み、その後、データフレームをブロックごとに並列にエンコードして書き込む
+        if delta:
+            # 更新された行（と更新されたカラム）だけを書き込む
+            df_output, category_output = select_delta(df_b, header_line, changes, keep_columns=[matching_key_b],
+                                                      drop_unchanged_columns=drop_unchanged_columns)
+            print(f"出力した行数: {len(df_output)}件、列数: {len(df_output.columns)}列（更新された行のみ）")
+            write_cp932_csv(df_output, output_csv, category_output, errors=encoding_errors)
+        else:
+            write_cp932_csv(df_b, output_csv, header_line, errors=encoding_errors)
 
         print(f"\n結果を '{output_csv}' に保存しました。")
+        if store is not None:
+            store.save(df_a_matched[matching_key_a])
 
         return df_b
 
@@ -0,0 +1,328 @@
+"""
+CSVスナップショットキャッシュ（Parquet）
+
+同じエクスポート（Liny・Kuzen・Salesforce）を何度も読み込む場合に、最初に pd.read_csv で読み込んだデータフレームと
+カテゴリ行をParquet形式で保存しておき、2回目以降はCSVを解析せずにメモリマップで読み込む。
+キーは入力ファイルの内容のハッシュと読み込みオプションなので、ファイルが変わると自動的に別のエントリーになる
+（同じファイルパス・同じオプションの古いエントリーは保存時に削除する）。
+
+usecols にカラム名のリストを指定した場合は、CSVを解析するときも usecols のカラムだけを読み込んで保存し、
+キャッシュから読み込むときは保存したカラムから必要なカラムだけを取り出す。
+保存したカラムにないカラムが必要になった場合（columns_to_update を変えた場合など）は、
+保存済みのカラムと合わせてCSVを解析し直して保存し直す。
+
+キャッシュディレクトリには以下のファイルが保存される。
+- <キー>.parquet: 読み込んだデータフレーム
+- <キー>.json: カテゴリ行・エンコーディング・カラムのdtypeなどのメタデータ（更新日時をLRUの最終利用日時として使う）
+
+Parquetの読み書きには pyarrow が必要。インストールされていない場合は、キャッシュを使わずに毎回CSVを読み込む。
+"""
+
+import json
+import os
+import time
+
+import pandas as pd
+
+from csv_conversion_cache import hash_file, _remove_quietly
+from csv_merge_engine import read_two_row_header_csv, SNIFF_MAX_SCAN_BYTES, SNIFF_PREFIX_BYTES
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+
+# キャッシュディレクトリ（環境変数 HITOMI_CSV_SNAPSHOT_DIR で変更できる）
+DEFAULT_SNAPSHOT_DIR = os.environ.get(
+    'HITOMI_CSV_SNAPSHOT_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'hitomi-csv', 'snapshots'))
+# キャッシュ全体の最大サイズ（MB単位）
+DEFAULT_SNAPSHOT_MAX_SIZE_MB = 2048
+# キャッシュの形式のバージョン（形式を変えたら上げる。キーに含めるので古いエントリーは使われなくなる）
+SNAPSHOT_VERSION = 2
+
+
+def _option_to_json(value):
+    """json.dumps で扱えない読み込みオプションの値を文字列にする（関数はキーにできないので TypeError）"""
+    if isinstance(value, type):
+        return value.__name__
+    if callable(value):
+        raise TypeError(f"{value!r} はキャッシュのキーに含められません")
+    return str(value)
+
+
+def _cacheable_options(read_csv_kwargs):
+    """
+    読み込みオプションをキーに含められる形にする（キャッシュできない場合は None）
+
+    usecols や converters に関数を指定した場合や、チャンクごとに読み込む場合はキャッシュしない。
+    """
+    if 'chunksize' in read_csv_kwargs or read_csv_kwargs.get('iterator'):
+        return None
+    try:
+        return json.dumps(read_csv_kwargs, sort_keys=True, ensure_ascii=False, default=_option_to_json)
+    except TypeError:
+        return None
+
+
+def _split_usecols(read_csv_kwargs):
+    """usecols がカラム名のリストなら、読み込み後に取り出すカラムとして分ける"""
+    usecols = read_csv_kwargs.get('usecols')
+    if usecols is None or isinstance(usecols, str) or callable(usecols):
+        return read_csv_kwargs, None
+    usecols = list(usecols)
+    if not all(isinstance(column, str) for column in usecols):
+        return read_csv_kwargs, None
+    return {name: value for name, value in read_csv_kwargs.items() if name != 'usecols'}, usecols
+
+
+def _select_columns(df, usecols):
+    """pd.read_csv の usecols と同じく、ファイルのカラムの順に usecols のカラムだけを取り出す"""
+    wanted = set(usecols)
+    return df[[column for column in df.columns if column in wanted]]
+
+
+class SnapshotCache:
+    """
+    解析済みのデータフレームをParquet形式で保存し、サイズ上限を超えたら最後に使われた日時が古いものから削除するキャッシュ
+    """
+
+    def __init__(self, cache_dir=None, max_size_mb=DEFAULT_SNAPSHOT_MAX_SIZE_MB):
+        """
+        Args:
+            cache_dir (str): キャッシュディレクトリ（Noneの場合は DEFAULT_SNAPSHOT_DIR）
+            max_size_mb (float): キャッシュ全体の最大サイズ（MB単位）
+        """
+        self.cache_dir = cache_dir or DEFAULT_SNAPSHOT_DIR
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024)
+        self.enabled = pq is not None
+        if not self.enabled:
+            print("警告: pyarrow がインストールされていないため、スナップショットキャッシュを使わずにCSVを読み込みます")
+
+    def _path(self, key, suffix):
+        return os.path.join(self.cache_dir, f"{key}{suffix}")
+
+    def read_csv(self, csv_path, **read_csv_kwargs):
+        """
+        pd.read_csv と同じ結果を、キャッシュがあればParquetから読み込んで返す
+
+        Args:
+            csv_path (str): CSVファイルパス
+            **read_csv_kwargs: pd.read_csv に渡す引数
+
+        Returns:
+            pd.DataFrame: 読み込んだデータフレーム
+        """
+        def parse(kwargs):
+            return pd.read_csv(csv_path, **kwargs), None, kwargs.get('encoding')
+
+        df, _, _ = self._load(csv_path, 'read_csv', read_csv_kwargs, parse)
+        return df
+
+    def read_two_row_header_csv(self, csv_path, encoding=None, sniff_bytes=SNIFF_PREFIX_BYTES,
+                                sniff_max_bytes=SNIFF_MAX_SCAN_BYTES, **read_csv_kwargs):
+        """
+        csv_merge_engine.read_two_row_header_csv と同じ結果を、キャッシュがあればParquetから読み込んで返す
+
+        Returns:
+            tuple: (df, category_line, encoding)
+        """
+        def parse(kwargs):
+            return read_two_row_header_csv(csv_path, encoding=encoding, sniff_bytes=sniff_bytes,
+                                           sniff_max_bytes=sniff_max_bytes, **kwargs)
+
+        options = dict(read_csv_kwargs, encoding=encoding, sniff_bytes=sniff_bytes, sniff_max_bytes=sniff_max_bytes)
+        return self._load(csv_path, 'two_row_header', options, parse, read_csv_kwargs)
+
+    def _load(self, csv_path, reader, options, parse, read_csv_kwargs=None):
+        """
+        キャッシュがあれば読み込み、なければ parse で読み込んで保存する
+
+        Args:
+            reader (str): 読み込み方法の名前（キーに含める）
+            options (dict): キーに含める読み込みオプション
+            parse (callable): parse(read_csv_kwargs) で (df, category_line, encoding) を返す関数
+            read_csv_kwargs (dict): parse に渡す引数（None の場合は options）
+        """
+        if read_csv_kwargs is None:
+            read_csv_kwargs = options
+        # usecols のカラムは保存したカラムから取り出すので、キーには含めない
+        key_options, usecols = _split_usecols(options)
+        options_json = _cacheable_options(dict(key_options, reader=reader, version=SNAPSHOT_VERSION))
+        if not self.enabled or options_json is None:
+            return parse(read_csv_kwargs)
+
+        start_time = time.perf_counter()
+        key = hash_file(csv_path, options_json.encode('utf-8'))
+
+        cached = self.get(key, usecols)
+        if cached is not None:
+            df, meta = cached
+            print(f"スナップショットキャッシュ: '{csv_path}' をキャッシュから読み込みました"
+                  f"（{len(df)}行, {len(df.columns)}列、{time.perf_counter() - start_time:.2f}秒）")
+            return df, meta['category_line'], meta['encoding']
+
+        parse_kwargs = read_csv_kwargs
+        if usecols is not None:
+            # usecols のカラムだけを解析する（保存済みのエントリーがあれば、そのカラムも一緒に解析し直して残す）
+            meta = self._read_meta(key)
+            stored = [column for column in meta['dtypes'] if column not in usecols] if meta else []
+            parse_kwargs = dict(read_csv_kwargs, usecols=[*usecols, *stored])
+        df, category_line, encoding = parse(parse_kwargs)
+        self.put(key, df, {'category_line': category_line, 'encoding': encoding, 'complete': usecols is None,
+                           'source': os.path.abspath(csv_path), 'options': options_json})
+        if usecols is not None:
+            df = _select_columns(df, usecols)
+        return df, category_line, encoding
+
+    def _read_meta(self, key):
+        """エントリーのメタデータを返す（なければNone）"""
+        try:
+            with open(self._path(key, '.json'), 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def get(self, key, columns=None):
+        """
+        キャッシュされたデータフレームとメタデータを返す（なければNone）
+        見つかった場合は最終利用日時を更新する
+
+        Args:
+            key (str): キャッシュのキー
+            columns (list): 読み込むカラム名（None の場合はすべて。保存したカラムにない名前がある場合や、
+                None でも一部のカラムしか保存していない場合はNone）
+        """
+        meta = self._read_meta(key)
+        if meta is None or not os.path.exists(self._path(key, '.parquet')):
+            return None
+
+        if columns is None and not meta['complete']:
+            return None
+        if columns is not None:
+            if any(column not in meta['dtypes'] for column in columns):
+                return None
+            # pd.read_csv の usecols と同じく、ファイルのカラムの順にする
+            wanted = set(columns)
+            columns = [column for column in meta['dtypes'] if column in wanted]
+        table = pq.read_table(self._path(key, '.parquet'), columns=columns, memory_map=True)
+        df = table.to_pandas()
+        # CSVから読み込んだときと同じdtypeに戻す
+        restore = {column: dtype for column, dtype in meta['dtypes'].items()
+                   if column in df.columns and str(df[column].dtype) != dtype}
+        if restore:
+            df = df.astype(restore)
+        os.utime(self._path(key, '.json'))
+        return df, meta
+
+    def put(self, key, df, meta):
+        """
+        データフレームをキャッシュに保存する
+
+        カラム名が文字列でない、または重複している場合は保存しない。
+        同じファイルパス・同じ読み込みオプションの古いエントリー（ファイルが変わる前のもの）は削除する。
+
+        Args:
+            key (str): キャッシュのキー
+            df (pd.DataFrame): 読み込んだデータフレーム
+            meta (dict): {'category_line', 'encoding', 'complete', 'source', 'options'}
+                complete は全カラムを保存したか（False の場合は usecols のカラムだけ）
+        """
+        if not all(isinstance(column, str) for column in df.columns) or df.columns.has_duplicates:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        meta = dict(meta, dtypes={column: str(dtype) for column, dtype in df.dtypes.items()},
+                    rows=len(df), created=time.time())
+
+        # 他のプロセスと同時に書き込んでも壊れないよう、一時ファイルに書いてから置き換える
+        suffix = f".{os.getpid()}.tmp"
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), self._path(key, '.parquet' + suffix))
+        os.replace(self._path(key, '.parquet' + suffix), self._path(key, '.parquet'))
+        with open(self._path(key, '.json' + suffix), 'w', encoding='utf-8') as file:
+            json.dump(meta, file, ensure_ascii=False)
+        os.replace(self._path(key, '.json' + suffix), self._path(key, '.json'))
+
+        for entry in self.entries():
+            if entry['key'] != key and entry['source'] == meta['source'] and entry['options'] == meta['options']:
+                self.remove(entry['key'])
+        self.evict()
+
+    def entries(self):
+        """
+        キャッシュのエントリーを最終利用日時が新しい順に返す
+
+        Returns:
+            list: [{'key', 'size', 'last_used', 'source', 'options', 'rows'}, ...]
+        """
+        if not os.path.isdir(self.cache_dir):
+            return []
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.json'):
+                continue
+            key = name[:-len('.json')]
+            try:
+                last_used = os.path.getmtime(self._path(key, '.json'))
+                with open(self._path(key, '.json'), 'r', encoding='utf-8') as file:
+                    meta = json.load(file)
+            except (FileNotFoundError, json.JSONDecodeError):
+                continue
+            size = 0
+            for suffix in ('.json', '.parquet'):
+                try:
+                    size += os.path.getsize(self._path(key, suffix))
+                except FileNotFoundError:
+                    pass
+            entries.append({'key': key, 'size': size, 'last_used': last_used, 'source': meta.get('source'),
+                            'options': meta.get('options'), 'rows': meta.get('rows')})
+        entries.sort(key=lambda entry: entry['last_used'], reverse=True)
+        return entries
+
+    def remove(self, key):
+        """エントリーを削除する"""
+        for suffix in ('.json', '.parquet'):
+            _remove_quietly(self._path(key, suffix))
+
+    def evict(self):
+        """
+        キャッシュ全体のサイズが上限を超えている間、最終利用日時が古いエントリーから削除する
+
+        Returns:
+            int: 削除したエントリー数
+        """
+        entries = self.entries()
+        total = sum(entry['size'] for entry in entries)
+        removed = 0
+        while entries and total > self.max_size_bytes:
+            entry = entries.pop()
+            self.remove(entry['key'])
+            total -= entry['size']
+            removed += 1
+        return removed
+
+    def clear(self):
+        """
+        キャッシュをすべて削除する
+
+        Returns:
+            int: 削除したエントリー数
+        """
+        entries = self.entries()
+        for entry in entries:
+            self.remove(entry['key'])
+        return len(entries)
+
+    def print_info(self):
+        """キャッシュの内容を表示する"""
+        entries = self.entries()
+        total = sum(entry['size'] for entry in entries)
+        print(f"キャッシュディレクトリ: {self.cache_dir}")
+        print(f"エントリー数: {len(entries)}件")
+        print(f"使用量: {total / (1024 * 1024):.2f} MB / {self.max_size_bytes / (1024 * 1024):.2f} MB")
+        for entry in entries:
+            last_used = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['last_used']))
+            print(f"- {entry['key']}  {entry['size'] / (1024 * 1024):8.2f} MB  {last_used}  "
+                  f"{entry['rows']}行  {entry['source']}")
+
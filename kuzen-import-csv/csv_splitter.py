@@ -15,12 +15,37 @@ Arguments:
     max_size_mb - Maximum size of each split file in MB (default: 1)
 """
 
+import codecs
+import csv
+import hashlib
+import json
+import math
+import mmap
 import os
+import re
 import sys
+import zlib
 import argparse
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 
-def split_csv_by_size(csv_file_path, max_size_mb=1, encoding='CP932'):
+# バイト単位で分割できるエンコーディング
+# （改行がASCIIの \r \n だけで表され、マルチバイト文字の一部として現れることがなく、BOMも付かない）
+BYTE_SPLIT_ENCODINGS = {'cp932', 'shift_jis', 'shift_jis_2004', 'shift_jisx0213', 'euc_jp', 'utf-8', 'ascii', 'iso8859-1'}
+
+# テキストモードと同じく \r\n, \r, \n のいずれも改行とみなす
+_NEWLINE = re.compile(rb'\r\n|\r|\n')
+
+# 分割ファイルの書き込み・チェックサム計算時に1回で扱うブロックサイズ
+PART_BLOCK_SIZE = 1024 * 1024
+
+# 列の値で分割するときに同時に開いておく分割ファイルの最大数
+# （超えた場合は最後に書き込んだのが古いファイルから閉じ、次に書き込むときに追記モードで開き直す）
+MAX_OPEN_PART_FILES = 64
+
+
+def split_csv_by_size(csv_file_path, max_size_mb=1, encoding='CP932', workers=None, manifest=True):
     """
     CSVファイルを指定されたサイズ（デフォルト1MB）以下に分割する関数
 
@@ -28,6 +53,8 @@ def split_csv_by_size(csv_file_path, max_size_mb=1, encoding='CP932'):
     - csv_file_path: 分割するCSVファイルのパス
     - max_size_mb: 分割後の各ファイルの最大サイズ（MB単位）
     - encoding: CSVファイルのエンコーディング（デフォルト: CP932）
+    - workers: 分割ファイルを並列に書き込むスレッド数（Noneの場合はCPU数に応じて決まる）
+    - manifest: 分割ファイルの一覧（マニフェスト）を書き出すか
 
     Returns:
     - 分割されたファイルのパスのリスト
@@ -36,6 +63,10 @@ def split_csv_by_size(csv_file_path, max_size_mb=1, encoding='CP932'):
     - 元のファイルは保持されます
     - 分割されたファイルは元のファイル名に _part1, _part2 などの接尾辞が付きます
     - 各分割ファイルにはヘッダー行が含まれます
+    - 各分割ファイルは書き込みが完了した時点で最終的なファイル名に置き換わるので、
+      後続のファイルの書き込み中でも完成したファイルからアップロードを始められます
+    - manifest=True の場合、元のファイル名に _manifest.json が付いたファイルに
+      各分割ファイルのパス・データ行数・バイト数・SHA-256チェックサムを書き出します
     """
     max_size_bytes = max_size_mb * 1024 * 1024  # MBをバイトに変換
 
@@ -52,11 +83,394 @@ def split_csv_by_size(csv_file_path, max_size_mb=1, encoding='CP932'):
     # 元のファイル名から拡張子を分離
     base_name, extension = os.path.splitext(csv_file_path)
 
+    # 改行がASCIIの \r \n だけで表されるエンコーディングなら、デコードせずにバイト単位で分割する
+    if _can_split_bytes(encoding):
+        parts = split_csv_bytes(csv_file_path, base_name, extension, max_size_bytes, encoding, workers)
+    else:
+        parts = _split_csv_text(csv_file_path, base_name, extension, max_size_bytes, encoding)
+
+    if parts and manifest:
+        manifest_path = write_manifest(csv_file_path, base_name, encoding, parts)
+        print(f"マニフェストを作成しました: {manifest_path}")
+
+    return [part['path'] for part in parts]
+
+
+def write_manifest(csv_file_path, base_name, encoding, parts):
+    """
+    分割ファイルのパス・データ行数・バイト数・チェックサムをJSONで書き出す
+
+    Parameters:
+    - csv_file_path: 分割元のCSVファイルのパス
+    - base_name: 分割ファイル名の元になるパス（拡張子なし）。<base_name>_manifest.json に書き出す
+    - encoding: 分割ファイルのエンコーディング
+    - parts: 分割ファイルごとの情報 [{'path', 'rows', 'bytes', 'sha256'}, ...]（split_csv_bytes の戻り値など）
+
+    Returns:
+    - マニフェストのファイルパス
+    """
+    manifest_path = f"{base_name}_manifest.json"
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'source': csv_file_path,
+            'encoding': encoding,
+            'parts': parts,
+        }, f, ensure_ascii=False, indent=2)
+    return manifest_path
+
+
+def _can_split_bytes(encoding):
+    """バイト単位の分割エンジンで扱えるエンコーディングか判定する"""
+    try:
+        return codecs.lookup(encoding).name in BYTE_SPLIT_ENCODINGS
+    except LookupError:
+        return False
+
+
+def _cleanup_split_files(split_files):
+    """作成途中の分割ファイルを削除する"""
+    for file_path in split_files + [f"{file_path}.tmp" for file_path in split_files]:
+        if os.path.exists(file_path):
+            try:
+                os.remove(file_path)
+                print(f"一時ファイル '{file_path}' を削除しました。")
+            except:
+                pass
+
+
+def _next_record(buffer, pos):
+    """
+    pos から始まるレコードの終わりを探す（\r\n, \r, \n のいずれも改行とみなす）
+    ダブルクォートで囲まれたフィールド内の改行はレコードの区切りとみなさない
+
+    クォートの内外は、レコードの先頭から数えた '"' の個数の偶奇で判定する
+    （エスケープされた '""' は2個なので偶奇は変わらない）。
+    CP932/Shift_JISの2バイト目は 0x40 以上、EUC-JP・UTF-8のマルチバイト文字は 0x80 以上のバイトだけで
+    構成されるため、'"'(0x22)・'\r'(0x0D)・'\n'(0x0A) がマルチバイト文字の一部として現れることはなく、
+    デコードせずにバイト列のまま走査できる。
+
+    Returns:
+    - (content_end, next_pos): 改行を除いたレコードの終わりの位置と、次のレコードの開始位置
+    """
+    in_quotes = False
+    scan = pos
+    while True:
+        match = _NEWLINE.search(buffer, scan)
+        content_end = len(buffer) if match is None else match.start()
+        if buffer[scan:content_end].count(b'"') % 2:
+            in_quotes = not in_quotes
+        if match is None:
+            return len(buffer), len(buffer)
+        if not in_quotes:
+            return match.start(), match.end()
+        scan = match.end()
+
+
+def _read_header_records(buffer, encoding):
+    """
+    先頭2レコード（ヘッダー行）を読み込む
+
+    Returns:
+    - (headers, header_bytes, pos): 前後の空白を除いたヘッダー行のリスト、
+      分割ファイルに書き込むヘッダーのバイト列、データ行の開始位置
+    """
+    headers = []
+    pos = 0
+    for _ in range(2):
+        content_end, next_pos = _next_record(buffer, pos)
+        headers.append(buffer[pos:content_end].decode(encoding).strip())
+        pos = next_pos
+    header_bytes = ''.join(header + '\n' for header in headers).encode(encoding)
+    return headers, header_bytes, pos
+
+
+def _translate_newlines(data):
+    """テキストモードでの読み書きと同じように、\r\n と \r を \n に変換する"""
+    return data.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+
+
+def _plan_split_ranges(buffer, start, budget):
+    """
+    改行コードが \n だけのデータについて、各分割ファイルに入れるバイト範囲を求める
+
+    行ごとに判定する代わりに、サイズ上限の位置から直前の改行を逆方向に探すので、
+    処理量は行数ではなく分割ファイル数に比例する。
+    見つかった改行がクォートで囲まれたフィールド内にある場合は、さらに前の改行を探す。
+    1レコードだけでサイズ上限を超えるレコードは、そのレコードだけで1ファイルとなる。
+
+    Parameters:
+    - buffer: ファイル全体のバイト列（mmap）
+    - start: データ行の開始位置
+    - budget: 各ファイルにデータ行として書き込めるバイト数（ヘッダーを除く）
+
+    Returns:
+    - [(開始位置, 終了位置), ...]
+    """
+    end_of_data = len(buffer)
+    allowed = math.floor(budget) if budget >= 0 else -1
+    ranges = []
+
+    while start < end_of_data:
+        if end_of_data - start <= allowed:
+            ranges.append((start, end_of_data))
+            break
+        newline = buffer.rfind(b'\n', start, start + allowed) if allowed > 0 else -1
+        if newline != -1:
+            # start から改行までの '"' が奇数個なら、その改行はクォート内にある
+            odd_quotes = buffer[start:newline].count(b'"') % 2
+            while newline != -1 and odd_quotes:
+                previous = buffer.rfind(b'\n', start, newline)
+                if previous != -1:
+                    odd_quotes ^= buffer[previous:newline].count(b'"') % 2
+                newline = previous
+        if newline == -1:
+            # 1レコードも入らない場合、最初のファイルはヘッダーのみとなり、そのレコードは単独で次のファイルに入る
+            if not ranges:
+                ranges.append((start, start))
+            _, end = _next_record(buffer, start)
+        else:
+            end = newline + 1
+        ranges.append((start, end))
+        start = end
+
+    if not ranges:
+        ranges.append((start, start))
+    return ranges
+
+
+def _plan_split_ranges_by_record(buffer, start, header_size, effective_max_size):
+    """
+    \r を含むデータについて、レコードごとに改行コード変換後のサイズを数えて各分割ファイルのバイト範囲を求める
+
+    Returns:
+    - [(開始位置, 終了位置), ...]
+    """
+    end_of_data = len(buffer)
+    ranges = []
+    part_start = start
+    current_size = header_size
+
+    while start < end_of_data:
+        _, next_start = _next_record(buffer, start)
+        # \r\n は \n の1バイトとして書き込まれる
+        record_size = next_start - start - buffer[start:next_start].count(b'\r\n')
+        if current_size + record_size > effective_max_size:
+            ranges.append((part_start, start))
+            part_start = start
+            current_size = header_size
+        current_size += record_size
+        start = next_start
+
+    ranges.append((part_start, end_of_data))
+    return ranges
+
+
+class _RecordCounter:
+    """ブロック単位で渡されたデータのレコード数を数える（クォート内の改行は数えない）"""
+
+    def __init__(self):
+        self.records = 0
+        self.in_quotes = False
+        self.last_byte = b''
+
+    def update(self, block):
+        if not block:
+            return
+        if not self.in_quotes and b'"' not in block:
+            self.records += block.count(b'\n')
+        else:
+            segments = block.split(b'"')
+            for i, segment in enumerate(segments):
+                if not self.in_quotes:
+                    self.records += segment.count(b'\n')
+                if i < len(segments) - 1:
+                    self.in_quotes = not self.in_quotes
+        self.last_byte = block[-1:]
+
+    def total(self):
+        # 末尾に改行がない最後のレコードも1件として数える
+        return self.records + (1 if self.last_byte not in (b'', b'\n') else 0)
+
+
+def _iter_part_blocks(buffer, start, end, has_cr):
+    """分割ファイルに書き込むデータをブロック単位で返す（\r を含む場合は改行コードを変換する）"""
+    carry = b''
+    for pos in range(start, end, PART_BLOCK_SIZE):
+        block_end = min(pos + PART_BLOCK_SIZE, end)
+        block = carry + buffer[pos:block_end]
+        carry = b''
+        if has_cr:
+            # \r\n がブロック境界で分断されないよう、末尾の \r は次のブロックに回す
+            if block.endswith(b'\r') and block_end < end:
+                block, carry = block[:-1], b'\r'
+            block = _translate_newlines(block)
+        yield block
+
+
+def _copy_range(src_fd, dst_fd, start, end):
+    """os.copy_file_range でファイルの範囲をカーネル側でコピーする（出力はファイルの現在位置に書き込む）"""
+    offset = start
+    while offset < end:
+        copied = os.copy_file_range(src_fd, dst_fd, end - offset, offset)
+        if copied == 0:
+            raise OSError(f"copy_file_range が {offset} バイト目で終了しました")
+        offset += copied
+
+
+def _write_part(buffer, src_fd, file_path, header_bytes, start, end, has_cr):
+    """
+    ヘッダー行とデータ範囲を1つの分割ファイルに書き込む
+    書き込みが完了するまでは一時ファイルに書き、完了後に最終的なファイル名に置き換える
+
+    Returns:
+    - {'path', 'rows', 'bytes', 'sha256'}
+    """
+    digest = hashlib.sha256(header_bytes)
+    counter = _RecordCounter()
+    size = len(header_bytes)
+    use_copy_file_range = not has_cr and hasattr(os, 'copy_file_range')
+
+    temp_path = f"{file_path}.tmp"
+    with open(temp_path, 'wb') as part_file:
+        part_file.write(header_bytes)
+        for block in _iter_part_blocks(buffer, start, end, has_cr):
+            digest.update(block)
+            counter.update(block)
+            size += len(block)
+            if not use_copy_file_range:
+                part_file.write(block)
+
+        if use_copy_file_range:
+            part_file.flush()
+            try:
+                _copy_range(src_fd, part_file.fileno(), start, end)
+            except OSError:
+                # copy_file_range が使えないファイルシステムでは通常の書き込みに切り替える
+                part_file.seek(len(header_bytes))
+                part_file.truncate()
+                for block in _iter_part_blocks(buffer, start, end, has_cr):
+                    part_file.write(block)
+
+    os.replace(temp_path, file_path)
+    return {'path': file_path, 'rows': counter.total(), 'bytes': size, 'sha256': digest.hexdigest()}
+
+
+def _describe_part(file_path, header_records=2):
+    """書き込み済みの分割ファイルを読み直して、データ行数・バイト数・チェックサムを求める"""
+    digest = hashlib.sha256()
+    counter = _RecordCounter()
+    size = 0
+    with open(file_path, 'rb') as f:
+        while True:
+            block = f.read(PART_BLOCK_SIZE)
+            if not block:
+                break
+            digest.update(block)
+            counter.update(block)
+            size += len(block)
+    return {'path': file_path, 'rows': counter.total() - header_records, 'bytes': size, 'sha256': digest.hexdigest()}
+
+
+def split_csv_bytes(csv_file_path, base_name, extension, max_size_bytes, encoding, workers=None):
+    """
+    ファイルをmmapでバイト列のまま扱い、行ごとのデコード・エンコードをせずに分割する
+    分割はクォートで囲まれたフィールド内の改行ではなく、レコードの区切りでのみ行う
+
+    1回の走査で全分割ファイルのバイト範囲を求めてから、スレッドプールで並列に書き込む。
+    出力は _split_csv_text と同じバイト列になる（ヘッダー行は前後の空白を除き、改行コードは \n に統一する）。
+    マニフェストは書き出さないので、必要な場合は戻り値を write_manifest に渡す。
+
+    Parameters:
+    - csv_file_path: 分割するCSVファイルのパス
+    - base_name: 分割ファイル名の元になるパス（拡張子なし）。<base_name>_part1<extension> などに書き出す
+    - extension: 分割ファイルの拡張子（例: '.csv'）
+    - max_size_bytes: 各ファイルの最大サイズ（バイト単位）
+    - encoding: CSVファイルのエンコーディング（BYTE_SPLIT_ENCODINGS のいずれか）
+    - workers: 分割ファイルを並列に書き込むスレッド数（Noneの場合はCPU数に応じて決まる）
+
+    Returns:
+    - 分割ファイルごとの情報 [{'path', 'rows', 'bytes', 'sha256'}, ...]（エラーの場合は空のリスト）
+    """
+    split_files = []
+
+    try:
+        with open(csv_file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            # ヘッダー行を取得（2行目のカテゴリ行も含む）
+            _, header_bytes, pos = _read_header_records(buffer, encoding)
+
+            # max_size_bytesに余裕を持たせる
+            effective_max_size = max_size_bytes * 0.95  # 5%の余裕を持たせる
+
+            # 分割位置をバイトオフセットで求める
+            has_cr = buffer.find(b'\r', pos) != -1
+            if has_cr:
+                ranges = _plan_split_ranges_by_record(buffer, pos, len(header_bytes), effective_max_size)
+            else:
+                ranges = _plan_split_ranges(buffer, pos, effective_max_size - len(header_bytes))
+
+            # レコードの範囲をそのまま分割ファイルにコピーする（並列に書き込む）
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = []
+                for part_num, (start, end) in enumerate(ranges, start=1):
+                    file_path = f"{base_name}_part{part_num}{extension}"
+                    split_files.append(file_path)
+                    print(f"分割ファイルを作成しています: {file_path}")
+                    futures.append(executor.submit(
+                        _write_part, buffer, f.fileno(), file_path, header_bytes, start, end, has_cr))
+                parts = [future.result() for future in futures]
+
+        print(f"CSVファイルを{len(split_files)}個のファイルに分割しました。")
+        return parts
+
+    except UnicodeDecodeError:
+        print(f"エラー: ファイル '{csv_file_path}' を '{encoding}' エンコーディングで読み込めません。")
+        _cleanup_split_files(split_files)
+        return []
+    except Exception as e:
+        print(f"エラーが発生しました: {e}")
+        # 作成途中のファイルをクリーンアップ
+        _cleanup_split_files(split_files)
+        return []
+
+
+def _read_record(f):
+    """
+    テキストファイルから1レコードを読み込む
+    ダブルクォートで囲まれたフィールド内の改行を含む場合は、複数行をまとめて1レコードとする
+    """
+    record = f.readline()
+    odd_quotes = record.count('"') % 2
+    while odd_quotes:
+        line = f.readline()
+        if not line:
+            break
+        record += line
+        odd_quotes ^= line.count('"') % 2
+    return record
+
+
+def _iter_records(f):
+    """テキストファイルの残りをレコード単位で返す"""
+    while True:
+        record = _read_record(f)
+        if not record:
+            return
+        yield record
+
+
+def _split_csv_text(csv_file_path, base_name, extension, max_size_bytes, encoding):
+    """
+    テキストモードで1レコードずつデコードしながら分割する
+    バイト単位で分割できないエンコーディング（UTF-16など）で使う
+
+    Returns:
+    - 分割ファイルごとの情報 [{'path', 'rows', 'bytes', 'sha256'}, ...]（エラーの場合は空のリスト）
+    """
     try:
         # ヘッダー行を取得
         with open(csv_file_path, 'r', encoding=encoding) as f:
-            header_line = f.readline().strip()
-            second_line = f.readline().strip()  # 2行目（カテゴリ行）も取得
+            header_line = _read_record(f).strip()
+            second_line = _read_record(f).strip()  # 2行目（カテゴリ行）も取得
     except UnicodeDecodeError:
         print(f"エラー: ファイル '{csv_file_path}' を '{encoding}' エンコーディングで読み込めません。")
         return []
@@ -68,8 +482,8 @@ def split_csv_by_size(csv_file_path, max_size_mb=1, encoding='CP932'):
         # 元のファイルを読み込んで分割
         with open(csv_file_path, 'r', encoding=encoding) as f:
             # ヘッダー行をスキップ（既に読み取り済み）
-            f.readline()
-            f.readline()
+            _read_record(f)
+            _read_record(f)
 
             part_num = 1
             current_file = None
@@ -96,18 +510,18 @@ def split_csv_by_size(csv_file_path, max_size_mb=1, encoding='CP932'):
             # max_size_bytesに余裕を持たせる
             effective_max_size = max_size_bytes * 0.95  # 5%の余裕を持たせる
 
-            # 行ごとに処理
-            for line in f:
-                # 行のサイズを計算
+            # レコードごとに処理（クォート内の改行では分割しない）
+            for line in _iter_records(f):
+                # レコードのサイズを計算
                 line_size = len(line.encode(encoding))
 
-                # 現在のファイルに行を追加するとサイズ制限を超える場合、新しいファイルを作成
+                # 現在のファイルにレコードを追加するとサイズ制限を超える場合、新しいファイルを作成
                 if current_size + line_size > effective_max_size:
                     current_file.close()
                     current_file_path = create_new_file()
                     print(f"分割ファイルを作成しています: {current_file_path}")
 
-                # 行を書き込む
+                # レコードを書き込む
                 current_file.write(line)
                 current_size += line_size
 
@@ -116,32 +530,350 @@ def split_csv_by_size(csv_file_path, max_size_mb=1, encoding='CP932'):
                 current_file.close()
 
         print(f"CSVファイルを{len(split_files)}個のファイルに分割しました。")
-        return split_files
+        return [_describe_part(file_path) for file_path in split_files]
 
     except Exception as e:
         print(f"エラーが発生しました: {e}")
         # 作成途中のファイルをクリーンアップ
-        for file_path in split_files:
-            if os.path.exists(file_path):
-                try:
-                    os.remove(file_path)
-                    print(f"一時ファイル '{file_path}' を削除しました。")
-                except:
-                    pass
+        _cleanup_split_files(split_files)
         return []
 
 
+class _PartWriter:
+    """
+    ヘッダー行とレコードを1つの分割ファイルに順に書き込み、データ行数・バイト数・チェックサムを記録する
+    書き込みが完了するまでは一時ファイルに書き、close() で最終的なファイル名に置き換える
+    suspend() で一時ファイルを閉じても、次の write() で追記モードで開き直して書き込みを続ける
+    """
+
+    def __init__(self, file_path, header_bytes):
+        self.path = file_path
+        self.file = open(f"{file_path}.tmp", 'wb')
+        self.digest = hashlib.sha256()
+        self.rows = 0
+        self.size = 0
+        self.write(header_bytes)
+
+    def write(self, data, records=0):
+        if self.file.closed:
+            self.file = open(f"{self.path}.tmp", 'ab')
+        self.file.write(data)
+        self.digest.update(data)
+        self.size += len(data)
+        self.rows += records
+
+    def suspend(self):
+        """一時ファイルを閉じる（データ行数・バイト数・チェックサムはそのまま）"""
+        self.file.close()
+
+    def close(self):
+        self.file.close()
+        os.replace(f"{self.path}.tmp", self.path)
+        return {'path': self.path, 'rows': self.rows, 'bytes': self.size, 'sha256': self.digest.hexdigest()}
+
+
+class StreamingCsvSplitter:
+    """
+    順に渡されるバイト列（変換処理の出力など）を、ファイルに保存せずにそのまま指定サイズ以下に分割するクラス
+
+    split_csv_by_size で保存済みのファイルを分割した場合と同じバイト列の分割ファイルを作成する。
+    全体が max_size_bytes 以下で終わった場合は分割せず、output_path に1つのファイルとして保存する。
+    メモリに保持するのは、サイズ判定のための先頭 max_size_bytes と、書き込み途中のレコードだけ。
+    """
+
+    def __init__(self, output_path, max_size_bytes, encoding='CP932'):
+        """
+        Parameters:
+        - output_path: 分割しない場合の出力ファイルのパス（分割ファイル名の元にもなる）
+        - max_size_bytes: 各ファイルの最大サイズ（バイト単位）
+        - encoding: 渡されるバイト列のエンコーディング（ヘッダー行のデコードに使う）
+        """
+        self.output_path = output_path
+        self.base_name, self.extension = os.path.splitext(output_path)
+        self.max_size_bytes = max_size_bytes
+        # max_size_bytesに余裕を持たせる
+        self.effective_max_size = max_size_bytes * 0.95  # 5%の余裕を持たせる
+        self.encoding = encoding
+        self.buffer = bytearray()
+        self.splitting = False
+        self.headers = []
+        self.header_bytes = b''
+        self.writer = None
+        self.parts = []
+        self.split_files = []
+
+    def feed(self, data):
+        """バイト列を追加する"""
+        self.buffer += data
+        if not self.splitting:
+            if len(self.buffer) <= self.max_size_bytes:
+                return
+            self.splitting = True
+        self._consume(final=False)
+
+    def close(self):
+        """
+        残りのデータを書き込んで分割を終える
+
+        Returns:
+        - 分割ファイルごとの情報 [{'path', 'rows', 'bytes', 'sha256'}, ...]
+          （分割しなかった場合は空のリスト）
+        """
+        if not self.splitting:
+            with open(self.output_path, 'wb') as f:
+                f.write(self.buffer)
+            self.buffer = bytearray()
+            return []
+        self._consume(final=True)
+        if self.writer is None:
+            # データ行がない場合もヘッダーのみのファイルを1つ作成する
+            self._start_part()
+        self.parts.append(self.writer.close())
+        self.writer = None
+        print(f"CSVファイルを{len(self.parts)}個のファイルに分割しました。")
+        return self.parts
+
+    def abort(self):
+        """作成途中の分割ファイルを削除する"""
+        if self.writer is not None:
+            self.writer.file.close()
+            self.writer = None
+        _cleanup_split_files(self.split_files)
+
+    def _start_part(self):
+        file_path = f"{self.base_name}_part{len(self.split_files) + 1}{self.extension}"
+        print(f"分割ファイルを作成しています: {file_path}")
+        self.split_files.append(file_path)
+        self.writer = _PartWriter(file_path, self.header_bytes)
+
+    def _consume(self, final):
+        """バッファ内の完結したレコードを書き込む（最後のレコードは続きのデータが来るまで保留する）"""
+        buffer = self.buffer
+        pos = 0
+        while pos < len(buffer):
+            content_end, next_pos = _next_record(buffer, pos)
+            # 末尾まで続くレコードは、改行やクォートの続きがまだ届いていない可能性がある
+            if next_pos == len(buffer) and not final:
+                break
+
+            if len(self.headers) < 2:
+                # ヘッダー行を取得（2行目のカテゴリ行も含む）
+                self.headers.append(bytes(buffer[pos:content_end]).decode(self.encoding).strip())
+                if len(self.headers) == 2:
+                    self.header_bytes = ''.join(header + '\n' for header in self.headers).encode(self.encoding)
+                pos = next_pos
+                continue
+
+            record = bytes(buffer[pos:next_pos])
+            if b'\r' in record:
+                record = _translate_newlines(record)
+            # サイズ制限を超える場合は、新しいファイルを作成
+            if self.writer is not None and self.writer.size + len(record) > self.effective_max_size:
+                self.parts.append(self.writer.close())
+                self.writer = None
+            if self.writer is None:
+                self._start_part()
+                if self.writer.size + len(record) > self.effective_max_size and len(self.parts) == 0:
+                    # 1レコードも入らない場合、最初のファイルはヘッダーのみとなる
+                    self.parts.append(self.writer.close())
+                    self._start_part()
+            self.writer.write(record, records=1)
+            pos = next_pos
+        del buffer[:pos]
+
+
+def _field_value(record, index, encoding):
+    """
+    レコード（改行を除くバイト列）から index 番目のフィールドの値を取り出す
+    クォートを含まないレコードはバイト列のまま区切り、含む場合だけcsvモジュールで解析する
+    """
+    if b'"' not in record:
+        fields = record.split(b',')
+        return fields[index].decode(encoding) if index < len(fields) else ''
+    fields = next(csv.reader([record.decode(encoding)]), [])
+    return fields[index] if index < len(fields) else ''
+
+
+_UNSAFE_FILENAME_CHARS = re.compile(r'[\\/:*?"<>|\s]+')
+# 値が空のレコードのパーティション名
+_BLANK_LABEL = 'blank'
+
+
+def _value_label(value):
+    """
+    列の値からパーティション名を作る
+
+    ファイル名にそのまま使える値は値をそのまま使う。使えない文字を含む値や空の値は、
+    使えない文字を '_' に置き換えた名前（空の場合は 'blank'）に値のハッシュを付けて、
+    'a/b' と 'a_b'、空の値と 'blank' のように異なる値が同じ名前にならないようにする。
+    """
+    safe = _UNSAFE_FILENAME_CHARS.sub('_', value)
+    if safe == value and value:
+        return value
+    digest = hashlib.blake2b(value.encode('utf-8'), digest_size=4).hexdigest()
+    return f"{safe or _BLANK_LABEL}_{digest}"
+
+
+def split_csv_by_key(csv_file_path, key_column, partitions=None, max_size_mb=1, encoding='CP932', manifest=True,
+                     max_open_files=MAX_OPEN_PART_FILES):
+    """
+    CSVファイルを指定した列の値ごとに分割する関数
+    同じ値のレコードは必ず同じパーティションに入るので、各パーティションを別々のインポート処理に
+    割り当てても、同じ顧客のレコードを複数の処理が同時に更新することはない
+
+    Parameters:
+    - csv_file_path: 分割するCSVファイルのパス
+    - key_column: パーティション分けに使う列名（1行目・2行目のどちらのヘッダーにある列名でもよい）
+    - partitions: パーティション数。指定した場合は列の値のハッシュで振り分け、
+      Noneの場合は列の値ごとに1つのパーティションとする
+    - max_size_mb: 分割後の各ファイルの最大サイズ（MB単位）。超える場合はパーティション内でさらに分割する
+    - encoding: CSVファイルのエンコーディング（デフォルト: CP932）
+    - manifest: 分割ファイルの一覧（マニフェスト）を書き出すか
+    - max_open_files: 同時に開いておく分割ファイルの最大数（値の種類が多い列で分割しても、
+      ファイルディスクリプタを使い切らないよう、最後に書き込んだのが古いファイルから閉じて開き直す）
+
+    Returns:
+    - パーティションごとの分割ファイルのパスのリスト {パーティション名: [パス, ...]}
+
+    Note:
+    - 分割されたファイルは、ハッシュで振り分けた場合は元のファイル名に _key1_part1 など、
+      値ごとに分けた場合は _<値>_part1 などの接尾辞が付きます（ファイル名に使えない文字を含む値や空の値は、
+      使えない文字を _ に置き換えた名前に値のハッシュを付けます）
+    - 各分割ファイルにはヘッダー行が含まれます
+    - ファイルは1回の走査で読み込み、レコードは元のファイルの順序のまま書き込まれます
+    """
+    max_size_bytes = max_size_mb * 1024 * 1024  # MBをバイトに変換
+
+    # 元のファイルが存在するか確認
+    if not os.path.exists(csv_file_path):
+        print(f"エラー: ファイル '{csv_file_path}' が見つかりません。")
+        return {}
+    if not _can_split_bytes(encoding):
+        print(f"エラー: '{encoding}' エンコーディングのファイルは列の値で分割できません。")
+        return {}
+    if os.path.getsize(csv_file_path) == 0:
+        print(f"エラー: ファイル '{csv_file_path}' が空です。")
+        return {}
+
+    base_name, extension = os.path.splitext(csv_file_path)
+    writers = {}
+    # ファイルを開いている分割ファイル（最後に書き込んだのが古い順）
+    open_writers = OrderedDict()
+    parts = []
+    split_files = []
+
+    try:
+        with open(csv_file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            headers, header_bytes, pos = _read_header_records(buffer, encoding)
+
+            # 列名は2行目（カラム名の行）を優先して探す
+            key_index = None
+            for header in reversed(headers):
+                columns = next(csv.reader([header]), [])
+                if key_column in columns:
+                    key_index = columns.index(key_column)
+                    break
+            if key_index is None:
+                print(f"エラー: ヘッダーに '{key_column}' という列が見つかりません。")
+                return {}
+
+            # max_size_bytesに余裕を持たせる
+            effective_max_size = max_size_bytes * 0.95  # 5%の余裕を持たせる
+            has_cr = buffer.find(b'\r', pos) != -1
+            part_numbers = {}
+            # 値ごとに分割する場合の、パーティション名と列の値の対応（異なる値が同じ名前にならないか確認する）
+            label_values = {}
+
+            while pos < len(buffer):
+                content_end, next_pos = _next_record(buffer, pos)
+                value = _field_value(buffer[pos:content_end], key_index, encoding)
+                record = buffer[pos:next_pos]
+                if has_cr:
+                    record = _translate_newlines(record)
+                pos = next_pos
+
+                if partitions:
+                    label = f"key{zlib.crc32(value.encode('utf-8')) % partitions + 1}"
+                else:
+                    label = _value_label(value)
+                    if label_values.setdefault(label, value) != value:
+                        raise ValueError(f"'{label_values[label]}' と '{value}' のパーティション名が同じ '{label}' になります")
+
+                writer = writers.get(label)
+                # パーティション内でサイズ制限を超える場合は、新しいファイルを作成
+                if writer is not None and writer.size + len(record) > effective_max_size:
+                    parts.append(dict(writer.close(), partition=label))
+                    open_writers.pop(label, None)
+                    writer = None
+                # 同時に開いているファイルが max_open_files を超えないよう、最後に書き込んだのが古いものから閉じる
+                if label not in open_writers:
+                    while len(open_writers) >= max(max_open_files, 1):
+                        open_writers.popitem(last=False)[1].suspend()
+                if writer is None:
+                    part_numbers[label] = part_numbers.get(label, 0) + 1
+                    file_path = f"{base_name}_{label}_part{part_numbers[label]}{extension}"
+                    print(f"分割ファイルを作成しています: {file_path}")
+                    split_files.append(file_path)
+                    writer = writers[label] = _PartWriter(file_path, header_bytes)
+                open_writers[label] = writer
+                open_writers.move_to_end(label)
+                writer.write(record, records=1)
+
+        for label, writer in writers.items():
+            parts.append(dict(writer.close(), partition=label))
+        writers.clear()
+
+    except Exception as e:
+        print(f"エラーが発生しました: {e}")
+        for writer in writers.values():
+            writer.file.close()
+        # 作成途中のファイルをクリーンアップ
+        _cleanup_split_files(split_files)
+        return {}
+
+    # 作成順に並べ直す
+    order = {file_path: i for i, file_path in enumerate(split_files)}
+    parts.sort(key=lambda part: order[part['path']])
+    if manifest:
+        manifest_path = write_manifest(csv_file_path, base_name, encoding, parts)
+        print(f"マニフェストを作成しました: {manifest_path}")
+
+    result = {}
+    for part in parts:
+        result.setdefault(part['partition'], []).append(part['path'])
+    print(f"CSVファイルを{len(result)}個のパーティション、{len(parts)}個のファイルに分割しました。")
+    return result
+
+
 def main():
     """コマンドライン引数を解析して実行する関数"""
     parser = argparse.ArgumentParser(description='CSVファイルを指定されたサイズに分割します。')
     parser.add_argument('csv_file', help='分割するCSVファイルのパス')
     parser.add_argument('--max-size', type=float, default=1.0, help='分割後の各ファイルの最大サイズ（MB単位、デフォルト: 1.0）')
     parser.add_argument('--encoding', default='CP932', help='CSVファイルのエンコーディング（デフォルト: CP932）')
+    parser.add_argument('--workers', type=int, help='分割ファイルを並列に書き込むスレッド数（デフォルト: CPU数に応じて自動）')
+    parser.add_argument('--no-manifest', action='store_true', help='分割ファイルの一覧（_manifest.json）を書き出さない')
+    parser.add_argument('--key', help='指定した列の値でパーティション分けする（例: "LINE UserID"）')
+    parser.add_argument('--partitions', type=int,
+                        help='--key の値のハッシュで振り分けるパーティション数（指定しない場合は値ごとに分割）')
     
     args = parser.parse_args()
     
+    if args.key:
+        # 列の値でパーティション分けして分割
+        partitioned_files = split_csv_by_key(args.csv_file, args.key, args.partitions, args.max_size, args.encoding,
+                                             manifest=not args.no_manifest)
+        if partitioned_files:
+            print("\n分割されたファイル:")
+            for label, file_paths in partitioned_files.items():
+                print(f"[{label}]")
+                for file_path in file_paths:
+                    print(f"- {file_path}")
+        return
+
     # CSVファイルを分割
-    split_files = split_csv_by_size(args.csv_file, args.max_size, args.encoding)
+    split_files = split_csv_by_size(args.csv_file, args.max_size, args.encoding,
+                                    workers=args.workers, manifest=not args.no_manifest)
     
     if split_files:
         print("\n分割されたファイル:")
@@ -13,6 +13,235 @@ Example:
 import subprocess
 import sys
 import os
+import tempfile
+
+from csv_cp932_converter import (find_decodable_encoding, transcode_file_to_cp932, UnencodableCharReport,
+                                 detect_and_convert_to_cp932, copy_file_fast, sniff_file_encoding,
+                                 SNIFF_MAX_SAMPLE_BYTES)
+from csv_conversion_cache import ConversionCache
+
+
+def test_find_decodable_encoding():
+    """
+    find_decodable_encoding関数が1回の走査で候補を絞り込めるか確認する関数
+    """
+    text = "顧客番号,氏名\n" + "".join(f"{i},テスト太郎{i}\n" for i in range(1000))
+
+    # ブロック境界をまたぐマルチバイト文字があっても正しく判定できる
+    encoding, failures = find_decodable_encoding(text.encode('cp932'), block_size=7)
+    assert encoding == 'shift_jis'
+    assert failures['utf-8'] == 0
+
+    encoding, failures = find_decodable_encoding(text.encode('utf-8'), block_size=7)
+    assert encoding == 'utf-8'
+    assert 'utf-8-sig' not in failures
+
+    # 途中の不正なバイトの位置を返す
+    data = b'abc' * 1000 + '漢字'.encode('cp932')
+    encoding, failures = find_decodable_encoding(data, block_size=64)
+    assert encoding == 'shift_jis'
+    assert failures['utf-8'] == 3000
+
+    # 末尾で途切れたマルチバイト文字も不正とみなす
+    encoding, failures = find_decodable_encoding('漢'.encode('utf-8')[:2], candidates=['utf-8'])
+    assert encoding is None
+    assert failures == {'utf-8': 0}
+
+
+def test_sniff_file_encoding_stops_early():
+    """
+    CP932のファイルは先頭サンプルの推定だけで打ち切り、候補にない推定結果の場合だけ全体を走査するか確認する関数
+    """
+    rows = [f"{i},髙橋 太郎{i},タカハシ タロウ,東京都渋谷区神南1-{i},①備考" for i in range(20000)]
+    data = ("ID,名前,フリガナ,住所,メモ\r\n" + "\r\n".join(rows) + "\r\n").encode('cp932')
+    assert len(data) > SNIFF_MAX_SAMPLE_BYTES
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        input_path = os.path.join(temp_dir, "input.csv")
+        with open(input_path, 'wb') as f:
+            f.write(data)
+
+        encoding, _, bytes_inspected = sniff_file_encoding(input_path)
+        assert encoding.lower() in ('cp932', 'shift_jis')
+        assert bytes_inspected == SNIFF_MAX_SAMPLE_BYTES
+
+        encoding, _, bytes_inspected = sniff_file_encoding(input_path, trusted_encodings=['utf-8'])
+        assert bytes_inspected == len(data)
+
+
+def test_transcode_file_to_cp932():
+    """
+    チャンク境界をまたぐマルチバイト文字やBOMを含むファイルを正しく変換できるか確認する関数
+    """
+    text = "顧客番号,氏名\n" + "".join(f"{i},テスト太郎{i}①\n" for i in range(1000))
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        input_path = os.path.join(temp_dir, "input.csv")
+        output_path = os.path.join(temp_dir, "output.csv")
+        with open(input_path, 'wb') as f:
+            f.write(b'\xef\xbb\xbf' + text.encode('utf-8'))
+
+        # チャンクサイズを小さくして、BOMやマルチバイト文字をチャンク境界で分断させる
+        for encoding in ['utf-8-sig', 'utf-8']:
+            for chunk_size in [1, 2, 5, 1024]:
+                transcode_file_to_cp932(input_path, encoding, output_path, chunk_size=chunk_size)
+                with open(output_path, 'rb') as f:
+                    assert f.read() == text.encode('cp932')
+
+
+def test_transcode_in_place():
+    """
+    入力と同じパスに出力しても、読み込む前にファイルが切り詰められないか確認する関数
+    """
+    text = "顧客番号,氏名\n" + "".join(f"{i},テスト太郎{i}\n" for i in range(1000))
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        input_path = os.path.join(temp_dir, "input.csv")
+        with open(input_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+        result = detect_and_convert_to_cp932(input_path, input_path)
+        assert result['method'] == 'transcode'
+        with open(input_path, 'rb') as f:
+            assert f.read() == text.encode('cp932')
+        assert os.listdir(temp_dir) == ["input.csv"]
+
+
+def test_unencodable_char_report():
+    """
+    CP932にエンコードできない文字を1回の変換で集計・置換できるか確認する関数
+    """
+    text = "ID,名前\n1,x😀y\n2,™🍣\n" * 2
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        input_path = os.path.join(temp_dir, "input.csv")
+        output_path = os.path.join(temp_dir, "output.csv")
+        with open(input_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+        report = UnencodableCharReport({'🍣': '寿司'})
+        transcode_file_to_cp932(input_path, 'utf-8', output_path, chunk_size=3, report=report)
+
+        # 置換テーブル → NFKC正規化 → '?' の順で置換される
+        with open(output_path, 'rb') as f:
+            assert f.read() == ("ID,名前\n1,x?y\n2,TM寿司\n" * 2).encode('cp932')
+
+        # 出現位置（行:列）と件数が記録される
+        assert report.chars['😀']['positions'] == [(2, 4), (5, 4)]
+        assert report.chars['🍣']['count'] == 2
+        assert report.total == 6
+        assert os.path.exists(os.path.join(temp_dir, "output_unencodable.txt"))
+
+
+def test_detect_and_convert_to_cp932_copies_compatible_input():
+    """
+    既にCP932やASCIIのファイルはデコードせずにそのままコピーされるか確認する関数
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for name, data in [('ascii', b'ID,name\n1,test\n'), ('cp932', "ID,名前\n1,髙橋①\n".encode('cp932'))]:
+            input_path = os.path.join(temp_dir, f"{name}.csv")
+            with open(input_path, 'wb') as f:
+                f.write(data * 100)
+
+            result = detect_and_convert_to_cp932(input_path)
+            assert result['method'] != 'transcode'
+            assert result['output'] == os.path.join(temp_dir, f"{name}_cp932.csv")
+            with open(result['output'], 'rb') as f:
+                assert f.read() == data * 100
+
+        # BOM付きのファイルは変換される
+        input_path = os.path.join(temp_dir, "bom.csv")
+        with open(input_path, 'wb') as f:
+            f.write(b'\xef\xbb\xbfID,name\n')
+        result = detect_and_convert_to_cp932(input_path)
+        assert result['method'] == 'transcode'
+        with open(result['output'], 'rb') as f:
+            assert f.read() == b'ID,name\n'
+
+
+def test_copy_file_fast_same_path():
+    """
+    コピー先がコピー元と同じパスでも、コピー元を削除・切り詰めないか確認する関数
+    """
+    data = "ID,名前\n1,髙橋\n".encode('cp932') * 100
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        input_path = os.path.join(temp_dir, "input.csv")
+        with open(input_path, 'wb') as f:
+            f.write(data)
+
+        for allow_hardlink in (True, False):
+            assert copy_file_fast(input_path, input_path, allow_hardlink=allow_hardlink) == 'same_file'
+            with open(input_path, 'rb') as f:
+                assert f.read() == data
+
+        # 既存のコピー先はハードリンクで置き換える
+        output_path = os.path.join(temp_dir, "output.csv")
+        with open(output_path, 'wb') as f:
+            f.write(b'old')
+        assert copy_file_fast(input_path, output_path, allow_hardlink=True) == 'hardlink'
+        assert os.path.samefile(input_path, output_path)
+        assert sorted(os.listdir(temp_dir)) == ["input.csv", "output.csv"]
+
+
+def test_conversion_cache():
+    """
+    同じ内容のファイルはキャッシュから書き出され、サイズ上限を超えると古いものから削除されるか確認する関数
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cache = ConversionCache(os.path.join(temp_dir, "cache"))
+        input_path = os.path.join(temp_dir, "input.csv")
+        with open(input_path, 'w', encoding='utf-8') as f:
+            f.write("ID,名前\n1,テスト😀\n")
+
+        first = detect_and_convert_to_cp932(input_path, cache=cache)
+        assert first['method'] == 'transcode'
+        os.remove(first['output'])
+
+        second = detect_and_convert_to_cp932(input_path, cache=cache)
+        assert second['method'] == 'cache'
+        assert second['encoding'] == first['encoding']
+        assert second['unencodable'] == 1
+        with open(second['output'], 'rb') as f:
+            assert f.read() == "ID,名前\n1,テスト?\n".encode('cp932')
+
+        # オプションが違えば別のキーになる
+        third = detect_and_convert_to_cp932(input_path, substitutions={'😀': ':)'}, cache=cache)
+        assert third['method'] == 'transcode'
+        assert len(cache.entries()) == 2
+
+        # サイズ上限を超えると最終利用日時が古いものから削除される
+        cache.max_size_bytes = cache.entries()[0]['size']
+        assert cache.evict() == 1
+        assert len(cache.entries()) == 1
+        assert cache.clear() == 1
+
+
+def test_conversion_cache_in_place():
+    """
+    入力をそのままコピーしたエントリーのキャッシュから、入力と同じパスに書き出しても入力が変わらないか確認する関数
+    """
+    data = "ID,名前\n1,髙橋\n".encode('cp932') * 100
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cache = ConversionCache(os.path.join(temp_dir, "cache"))
+        input_path = os.path.join(temp_dir, "input.csv")
+        with open(input_path, 'wb') as f:
+            f.write(data)
+
+        first = detect_and_convert_to_cp932(input_path, input_path, cache=cache)
+        assert first['method'] == 'same_file'
+        for allow_hardlink in (False, True):
+            second = detect_and_convert_to_cp932(input_path, input_path, allow_hardlink=allow_hardlink, cache=cache)
+            assert second['method'] == 'cache'
+            with open(input_path, 'rb') as f:
+                assert f.read() == data
+
+        # 別のパスに書き出す場合は、allow_hardlink に従ってハードリンクを作る
+        output_path = os.path.join(temp_dir, "output.csv")
+        detect_and_convert_to_cp932(input_path, output_path, allow_hardlink=True, cache=cache)
+        assert os.path.samefile(input_path, output_path)
+
 
 def main():
     # Check if at least one argument is provided
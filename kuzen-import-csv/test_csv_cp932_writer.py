@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test script for csv_cp932_writer.py
+
+ブロックごとにエンコードして書き込んだ出力が、テキストモードのファイルに df.to_csv で
+書き込んだ場合と同じバイト列になるか、エンコードできない文字を含むセルを記録するかを確認する。
+"""
+
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from csv_cp932_writer import write_cp932_csv
+
+
+def _sample_frame(rows):
+    return pd.DataFrame({
+        'ID': np.arange(rows),
+        '名前': [['髙橋', '', None, 'a,b', '"引用"', '複数行の\nメモ'][i % 6] for i in range(rows)],
+        '数値': [[1.5, np.nan, 1e20][i % 3] for i in range(rows)],
+    })
+
+
+def test_write_matches_to_csv():
+    """
+    ブロックの行数に関係なく、df.to_csv で書き込んだ場合と同じバイト列になるか確認する関数
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        expected_path = os.path.join(temp_dir, "expected.csv")
+        output_path = os.path.join(temp_dir, "output.csv")
+        for rows in (0, 1, 25):
+            df = _sample_frame(rows)
+            with open(expected_path, 'w', encoding='CP932') as f:
+                f.write("基本,基本,基本\n")
+                df.to_csv(f, index=False, encoding='CP932')
+            with open(expected_path, 'rb') as f:
+                expected = f.read()
+
+            for block_rows in (1, 4, 100):
+                assert write_cp932_csv(df, output_path, "基本,基本,基本\r\n", block_rows=block_rows) == []
+                with open(output_path, 'rb') as f:
+                    assert f.read() == expected
+
+
+def test_unencodable_cells():
+    """
+    エンコードできない文字を含むセルの行番号とカラム名を記録し、errors に応じて置き換えるかエラーにするか確認する関数
+    """
+    df = pd.DataFrame({'名前': ['a', '😀b', 'c', 'ok', 'x♥'], '番号': [1, 2, 3, 4, 5]})
+    with tempfile.TemporaryDirectory() as temp_dir:
+        output_path = os.path.join(temp_dir, "output.csv")
+        cells = write_cp932_csv(df, output_path, "基本,基本", errors='replace', block_rows=2)
+        assert [(cell['row'], cell['column'], cell['chars']) for cell in cells] == [(2, '名前', '😀'), (5, '名前', '♥')]
+        with open(output_path, 'rb') as f:
+            assert f.read().decode('CP932').splitlines()[3:] == ['?b,2', 'c,3', 'ok,4', 'x?,5']
+
+        os.remove(output_path)
+        try:
+            write_cp932_csv(df, output_path, "基本,基本", block_rows=2)
+            raise AssertionError("エンコードできない文字があるのにエラーになりませんでした")
+        except ValueError as e:
+            assert "2行目 '名前'" in str(e)
+        # 書き込み途中のファイルは残さない
+        assert os.listdir(temp_dir) == []
+
+
+if __name__ == "__main__":
+    test_write_matches_to_csv()
+    test_unencodable_cells()
+    print("テストが完了しました。")
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test script for csv_fingerprint_store.py
+
+前回保存したフィンガープリントと比べて、新しいキーと値が変わったキーの行だけを変更ありとするか確認する。
+"""
+
+import os
+import tempfile
+
+import pandas as pd
+
+from csv_fingerprint_store import FingerprintStore
+
+
+def test_changed_rows():
+    """
+    新しいキー・値が変わったキー・重複したキーの行だけを変更ありとし、設定が変わった場合や full_resync ではすべての行を変更ありとするか確認する関数
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        store_path = os.path.join(temp_dir, "fingerprints.pkl")
+        first = pd.DataFrame({'ユーザーID': ['U1', 'U2', 'U3'], 'お名前': ['a', 'b', None], 'メモ': ['x', 'y', 'z']})
+
+        store = FingerprintStore(store_path)
+        assert store.changed_rows(first, 'ユーザーID', ['お名前'], signature='v1').tolist() == [True, True, True]
+        store.save()
+
+        # U1 は変更なし、U2 は値が変わった、U3 はハッシュに含めないカラムだけが変わった、U4 は新しいキー、U5 は重複
+        second = pd.DataFrame({'ユーザーID': ['U1', 'U2', 'U3', 'U4', 'U5', 'U5'],
+                               'お名前': ['a', 'B', None, 'd', 'e', 'e'],
+                               'メモ': ['x', 'y', 'changed', 'w', 'v', 'v']})
+        store = FingerprintStore(store_path)
+        changed = store.changed_rows(second, 'ユーザーID', ['お名前'], signature='v1')
+        assert changed.tolist() == [False, True, False, True, True, True]
+        assert store.filter_changed(second, 'ユーザーID', ['お名前'], signature='v1')['ユーザーID'].tolist() == \
+            ['U2', 'U4', 'U5', 'U5']
+
+        assert store.changed_rows(second, 'ユーザーID', ['お名前'], signature='v2').all()
+        assert store.changed_rows(second, 'ユーザーID', ['お名前'], signature='v1', full_resync=True).all()
+
+        # 保存しなければ前回のフィンガープリントのまま
+        assert not FingerprintStore(store_path).changed_rows(first, 'ユーザーID', ['お名前'], signature='v1').any()
+
+
+def test_save_applied_keys():
+    """
+    更新先に対応する行がなかったキーは保存せず、更新先に追加された後の実行で処理するか確認する関数
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        store_path = os.path.join(temp_dir, "fingerprints.pkl")
+        df = pd.DataFrame({'ユーザーID': ['U1', 'U2'], 'お名前': ['a', 'b']})
+
+        # 1回目: U2 は更新先にまだないので適用しなかった
+        store = FingerprintStore(store_path)
+        assert store.changed_rows(df, 'ユーザーID', ['お名前']).all()
+        store.save(['U1'])
+
+        # 2回目: U2 は値が変わっていなくても処理する（更新先に追加されて適用した）
+        store = FingerprintStore(store_path)
+        assert store.filter_changed(df, 'ユーザーID', ['お名前'])['ユーザーID'].tolist() == ['U2']
+        store.save(['U2'])
+
+        # 3回目: 前回処理しなかった U1 のフィンガープリントも残っている
+        assert not FingerprintStore(store_path).changed_rows(df, 'ユーザーID', ['お名前']).any()
+
+
+if __name__ == "__main__":
+    test_changed_rows()
+    test_save_applied_keys()
+    print("テストが完了しました。")
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test script for csv_key_index.py
+
+SQLiteのキーインデックスで求めた行の位置が build_key_index と同じになるか、
+新しいスナップショットを取り込んだときに変わったキーだけを書き込むかを確認する。
+"""
+
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from csv_key_index import KeyIndex
+from csv_merge_engine import build_key_index, lookup_keys
+
+
+def _write_snapshot(csv_path, rows):
+    with open(csv_path, 'w', encoding='CP932') as f:
+        f.write("基本,基本,基本\nLINE UserID,フリガナ,メモ\n")
+        f.write("".join(f"{key},{name},{memo}\n" for key, name, memo in rows))
+
+
+def test_ingest_and_lookup():
+    """
+    スナップショットを取り込み、キーの検索・値の比較・差分の取り込みができるか確認する関数
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        csv_path = os.path.join(temp_dir, "member.csv")
+        db_path = os.path.join(temp_dir, "member_index.sqlite")
+        # U1 は2行あるので最後の行を使う。キーが空の行は無視する
+        _write_snapshot(csv_path, [('U0', 'あ', 'x'), ('U1', 'い', 'y'), ('', 'う', 'z'), ('U1', 'え', ''),
+                                   ('U2', '', 'w')])
+
+        index = KeyIndex(db_path)
+        result = index.ingest(csv_path, 'LINE UserID', ['フリガナ'])
+        assert (result['rows'], result['inserted'], result['updated'], result['deleted']) == (5, 3, 0, 0)
+        assert index.ingest(csv_path, 'LINE UserID', ['フリガナ'])['skipped']
+
+        keys = pd.Series(['U1', 'U9', None, 'U0', 'U2'])
+        df_b = pd.read_csv(csv_path, header=1, encoding='CP932', dtype=str)
+        expected = lookup_keys(build_key_index(df_b['LINE UserID']), keys)
+        assert np.array_equal(index.lookup(keys), expected)
+        assert index.lookup(pd.Series([], dtype=object)).tolist() == []
+
+        df_a = pd.DataFrame({'ユーザーID': ['U0', 'U1', 'U2', 'U9'], 'お名前': ['あ', 'お', None, 'か']})
+        assert index.changed_cells(df_a, 'ユーザーID', [('お名前', 'フリガナ')]) == {'フリガナ': 1}
+        index.close()
+
+        # 新しいスナップショット: U0 は削除、U1 は値が変わり、U2 は行の位置だけ変わり、U3 は追加
+        _write_snapshot(csv_path, [('U3', 'さ', ''), ('U1', 'し', ''), ('U2', '', 'w')])
+        index = KeyIndex(db_path)
+        result = index.ingest(csv_path, 'LINE UserID', ['フリガナ'])
+        assert (result['rows'], result['inserted'], result['updated'], result['deleted']) == (3, 1, 2, 1)
+        assert index.lookup(pd.Series(['U0', 'U1', 'U2', 'U3'])).tolist() == [-1, 1, 2, 0]
+        assert index.size() > 0
+        index.close()
+
+        # 読み込み済みのデータフレームを取り込んでも、CSVから読み込んだ場合と同じになる
+        index = KeyIndex(os.path.join(temp_dir, "frame_index.sqlite"))
+        df_b = pd.read_csv(csv_path, header=1, encoding='CP932', dtype=str)
+        result = index.ingest(csv_path, 'LINE UserID', ['フリガナ'], chunksize=2, df=df_b)
+        assert (result['rows'], result['inserted'], result['updated'], result['deleted']) == (3, 3, 0, 0)
+        assert index.lookup(pd.Series(['U0', 'U1', 'U2', 'U3'])).tolist() == [-1, 1, 2, 0]
+        index.close()
+
+
+if __name__ == "__main__":
+    test_ingest_and_lookup()
+    print("テストが完了しました。")
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test script for csv_merge_engine.py
+"""
+
+import codecs
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from csv_merge_engine import (apply_tags, apply_updates, build_key_index, build_multi_slot_index, lookup_keys, lookup_multi_slot,
+                              date_converters, plan_usecols, read_two_row_header_csv, select_delta,
+                              update_in_chunks)
+
+
+def test_build_key_index_and_lookup():
+    """
+    重複するキーは最後の行を使い、NaNのキーや存在しないキーは -1 になるか確認する関数
+    """
+    index = build_key_index(pd.Series(['U1', None, 'U2', 'U1'], dtype=object))
+    assert lookup_keys(index, pd.Series(['U1', 'U2', 'U3', 'nan'])).tolist() == [3, 2, -1, -1]
+    assert lookup_keys(build_key_index(pd.Series([], dtype=object)), pd.Series(['U1'])).tolist() == [-1]
+
+
+def test_multi_slot_index():
+    """
+    複数のスロットにあるキーは番号の小さいスロットを使い、重複するキーを報告するか確認する関数
+    """
+    df_b = pd.DataFrame({
+        '生徒1_顧客番号': ['K1', 'K2', None, 'K1'],
+        '生徒2_顧客番号': ['K2', None, 'K3', None],
+        '生徒3_顧客番号': [None, None, 'K9', 'K9'],
+    }, dtype=object)
+    index, conflicts = build_multi_slot_index(df_b, list(df_b.columns))
+    assert conflicts == {'multi_slot': {'K2': [1, 2]}, 'duplicated': {'K1': [1], 'K9': [3]}}
+
+    rows, slots = lookup_multi_slot(index, pd.Series(['K1', 'K2', 'K3', 'K9', 'K0']))
+    assert rows.tolist() == [3, 1, 2, 3, -1]
+    assert slots.tolist() == [1, 1, 2, 3, 0]
+
+
+def test_apply_updates_matches_row_by_row():
+    """
+    同じ更新先に対応する行が複数あっても、1行ずつ更新した場合と同じ結果・同じ統計になるか確認する関数
+    """
+    df_b = pd.DataFrame({'名前': ['a', None, 'c'], '日付': ['2020/01/02', None, None]}, dtype=object)
+    df_a = pd.DataFrame({
+        '名前': ['A', 'a', None, 'A'],
+        '日付': ['2020/01/02', None, None, '2020/01/02'],
+    }, dtype=object)
+    targets = np.array([0, 0, 1, 2])
+
+    row_updated, updated_cells = apply_updates(
+        df_b, df_a, targets, [('名前', '名前'), ('日付', '日付'), ('無い列', '名前')])
+
+    # 1行目で 'A' に更新された後、2行目の 'a' で元に戻る
+    assert df_b['名前'].tolist() == ['a', None, 'A']
+    assert df_b['日付'].tolist() == ['2020/01/02', None, '2020/01/02']
+    assert row_updated.tolist() == [True, True, False, True]
+    assert updated_cells == 4
+
+
+def test_date_converters():
+    """
+    日付のカラムは変換前の値で比較し、更新するセルの値だけが指定した形式に変換されるか確認する関数
+    """
+    df_b = pd.DataFrame({
+        '生年月日': ['2020-01-02', '2020/1/2', None, '2021/3/4'],
+        'メモ': [None, None, None, None],
+    }, dtype=object)
+    df_a = pd.DataFrame({
+        '生年月日': ['2020-01-02', '2020-1-2', '不明', '2021-3-4', '2021-3-4'],
+        'メモ': ['2020-01-02', None, None, None, None],
+    }, dtype=object)
+    targets = np.array([0, 1, 2, 3, 3])
+
+    converters = date_converters(['生年月日', '挙式日'])
+    assert sorted(converters) == ['挙式日', '生年月日']
+    row_updated, updated_cells = apply_updates(
+        df_b, df_a, targets, [('生年月日', '生年月日'), ('メモ', 'メモ')], converters=converters)
+    # 同じ値の '2020-01-02' はそのまま残り、日付のカラムではない 'メモ' は変換されない
+    assert df_b['生年月日'].tolist() == ['2020-01-02', '2020/1/2', '不明', '2021/3/4']
+    assert df_b['メモ'].tolist() == ['2020-01-02', None, None, None]
+    # 変換後の値は変換前の値と異なるので、同じ更新先に対応する2行目の '2021-3-4' も更新として数える
+    assert row_updated.tolist() == [True, True, True, True, True]
+    assert updated_cells == 5
+
+    convert = date_converters(['メモ'], replacement=r'\1年\2月\3日')['メモ']
+    assert convert(np.array(['2020-01-02', None], dtype=object)).tolist() == ['2020年01月02日', None]
+
+
+def test_apply_tags():
+    """
+    校舎タグの値に対応するタグのカラムにだけフラグが立つか確認する関数
+    """
+    df_b = pd.DataFrame({'池袋校': [None, '0', None], '慶應NY校': [None, None, '1']}, dtype=object)
+    df_a = pd.DataFrame({'校舎=校舎名のタグで1': ['池袋校', 'KR館', '池袋校', None]}, dtype=object)
+    tags = {'池袋校': '池袋校', 'KR館': '慶應NY校', '横浜校': '横浜校'}
+
+    changed_cells = apply_tags(df_b, df_a, np.array([0, 2, 1, 1]), tags)
+    assert df_b['池袋校'].tolist() == ['1', '1', None]
+    assert df_b['慶應NY校'].tolist() == [None, None, '1']
+    assert changed_cells == 2
+
+
+def test_update_in_chunks_matches_in_memory():
+    """
+    システムBをチャンクごとに更新・追記しても、全体を読み込んで更新した場合と同じ出力・同じ統計になるか確認する関数
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        system_b_csv = os.path.join(temp_dir, "member.csv")
+        with open(system_b_csv, 'w', encoding='CP932') as f:
+            f.write("基本,基本\nLINE UserID,名前\n")
+            f.write("".join(f"U{i},名前{i}\n" for i in range(10)))
+        df_a = pd.DataFrame({'名前': ['新しい名前', '名前3', '上書き', None]}, dtype=object)
+        targets = np.array([1, 3, 1, 9])
+
+        def update(df_b, in_rows, row_targets, changes=None):
+            row_updated, updated_cells = apply_updates(df_b, df_a[in_rows], row_targets, [('名前', '名前')],
+                                                       changes=changes)
+            return int(row_updated.sum()), updated_cells
+
+        df_b = pd.read_csv(system_b_csv, header=1, encoding='CP932', dtype=str)
+        expected_stats = update(df_b, np.ones(len(df_a), dtype=bool), targets)
+        with open(os.path.join(temp_dir, "expected.csv"), 'w', encoding='CP932') as f:
+            f.write("基本,基本\n")
+            df_b.to_csv(f, index=False)
+
+        output_csv = os.path.join(temp_dir, "chunked.csv")
+        assert update_in_chunks(system_b_csv, output_csv, "基本,基本", targets, update, chunksize=3) == (*expected_stats, 10)
+        assert expected_stats == (2, 2)
+        with open(output_csv, 'rb') as f, open(os.path.join(temp_dir, "expected.csv"), 'rb') as g:
+            assert f.read() == g.read()
+
+
+def test_plan_usecols():
+    """
+    マッピング辞書のカラムだけを読み込むカラムとし、読み込まないカラムの数とバイト数を求めるか確認する関数
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        csv_path = os.path.join(temp_dir, "salesforce.csv")
+        with open(csv_path, 'w', encoding='CP932') as f:
+            f.write("カテゴリ,カテゴリ,カテゴリ,カテゴリ\n顧客番号,氏名,備考,メモ\n")
+            f.write("".join(f"{i},名前{i},{'長い備考' * 20},{'メモ' * 10}\n" for i in range(50)))
+
+        plan = plan_usecols(csv_path, ['顧客番号', 'メモ', '存在しない列'], optional=['氏名', 'ID'], header=1)
+        assert plan['usecols'] == ['顧客番号', '氏名', 'メモ']
+        assert plan['missing'] == ['存在しない列']
+        assert (plan['total_columns'], plan['skipped_columns']) == (4, 1)
+        # 読み込まない「備考」のカラムはファイルの4分の3ほどを占める
+        assert 0.7 * os.path.getsize(csv_path) < plan['skipped_bytes'] < 0.8 * os.path.getsize(csv_path)
+
+        plan = plan_usecols(csv_path, ['顧客番号', '氏名', '備考', 'メモ'], header=1)
+        assert (plan['skipped_columns'], plan['skipped_bytes']) == (0, 0)
+
+
+def test_read_two_row_header_csv():
+    """
+    カテゴリ行とデータを1回で読み込み、header=1 で読み込んだ場合と同じデータフレームになるか確認する関数
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        csv_path = os.path.join(temp_dir, "member.csv")
+        rows = "LINE UserID,名前\r\n" + "".join(f"U{i},名前{i}\r\n" for i in range(100))
+
+        for encoding in ('CP932', 'UTF-8', 'utf-8-sig'):
+            with open(csv_path, 'w', encoding=encoding, newline='') as f:
+                # 先頭はASCIIだけにして、エンコーディングの推定に先のブロックが使われるようにする
+                f.write("a" * 100 + "," + "b" * 100 + "\r\n" + rows)
+            expected = pd.read_csv(csv_path, header=1, encoding=encoding, dtype=str)
+
+            df, category_line, detected = read_two_row_header_csv(csv_path, sniff_bytes=64, dtype=str)
+            pd.testing.assert_frame_equal(df, expected)
+            assert category_line == "a" * 100 + "," + "b" * 100 + "\r\n"
+            assert codecs.lookup(detected).name == codecs.lookup(encoding).name
+
+            df, _, _ = read_two_row_header_csv(csv_path, encoding=encoding, dtype=str,
+                                               usecols=lambda column: column == '名前')
+            pd.testing.assert_frame_equal(df, expected[['名前']])
+
+
+def test_read_two_row_header_csv_sniff_limit():
+    """
+    先頭がASCIIだけの場合に、sniff_max_bytes を超えて読み進めずにCP932として読み込むか確認する関数
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        csv_path = os.path.join(temp_dir, "member.csv")
+        category = "a" * 300 + "\r\n"
+        rows = "LINE UserID,名前\r\n" + "".join(f"U{i},名前{i}\r\n" for i in range(100))
+
+        with open(csv_path, 'w', encoding='UTF-8', newline='') as f:
+            f.write(category + rows)
+        # 上限までに日本語があれば推定し、なければ上限で打ち切ってCP932とする
+        _, _, detected = read_two_row_header_csv(csv_path, sniff_bytes=256, sniff_max_bytes=4096, nrows=0)
+        assert detected == 'utf-8'
+        _, _, detected = read_two_row_header_csv(csv_path, sniff_bytes=256, sniff_max_bytes=256, nrows=0)
+        assert detected == 'CP932'
+
+        with open(csv_path, 'w', encoding='CP932', newline='') as f:
+            f.write(category + rows)
+        df, category_line, _ = read_two_row_header_csv(csv_path, sniff_bytes=256, sniff_max_bytes=256, dtype=str)
+        assert category_line == category
+        pd.testing.assert_frame_equal(df, pd.read_csv(csv_path, header=1, encoding='CP932', dtype=str))
+
+
+def test_select_delta():
+    """
+    更新したセルを記録し、更新された行（と更新されたカラム・カテゴリ行のセル）だけを取り出すか確認する関数
+    """
+    df_b = pd.DataFrame({'LINE UserID': ['U0', 'U1', 'U2', 'U3'], '名前': ['a', 'b', 'c', 'd'],
+                         'メモ': ['x', 'y', 'z', 'w'], 'タグ': [None, '1', None, None]}, dtype=object)
+    df_a = pd.DataFrame({'名前': ['a', 'B', None], 'タグ': ['渋谷', '渋谷', '池袋']}, dtype=object)
+    changes = {}
+    apply_updates(df_b, df_a, np.array([0, 1, 3]), [('名前', '名前')], changes=changes)
+    apply_tags(df_b, df_a, np.array([0, 1, 3]), {'渋谷': 'タグ'}, tag_column='タグ', changes=changes)
+
+    df_delta, category_line = select_delta(df_b, "基本,基本,\"メモ,備考\",タグ\n", changes)
+    assert df_delta['LINE UserID'].tolist() == ['U0', 'U1']
+    assert category_line == "基本,基本,\"メモ,備考\",タグ\n"
+
+    df_delta, category_line = select_delta(df_b, "基本,基本,\"メモ,備考\",タグ\n", changes,
+                                           keep_columns=['LINE UserID'], drop_unchanged_columns=True)
+    assert df_delta.columns.tolist() == ['LINE UserID', '名前', 'タグ']
+    assert df_delta.values.tolist() == [['U0', 'a', '1'], ['U1', 'B', '1']]
+    assert category_line == "基本,基本,タグ"
+
+
+if __name__ == "__main__":
+    test_build_key_index_and_lookup()
+    test_multi_slot_index()
+    test_apply_updates_matches_row_by_row()
+    test_date_converters()
+    test_apply_tags()
+    test_update_in_chunks_matches_in_memory()
+    test_plan_usecols()
+    test_read_two_row_header_csv()
+    test_read_two_row_header_csv_sniff_limit()
+    test_select_delta()
+    print("テストが完了しました。")
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test script for csv_pipeline.py
+
+変換してから分割する2段階の処理と、convert_and_split の出力が同じになるか確認する。
+"""
+
+import filecmp
+import os
+import tempfile
+
+from csv_cp932_converter import detect_and_convert_to_cp932
+from csv_pipeline import convert_and_split
+from csv_splitter import split_csv_by_size
+
+
+def _write_sample(file_path, rows, newline='\n'):
+    lines = ["ID,名前,メモ", "識別子,氏名,備考"]
+    lines += [f'{i},テスト太郎{i},"髙橋さんの\n複数行メモ{i}"' for i in range(rows)]
+    with open(file_path, 'w', encoding='utf-8-sig', newline='') as f:
+        f.write(newline.join(lines) + newline)
+
+
+def _run_both(temp_dir, rows, max_size_mb, newline='\n'):
+    two_step_dir = os.path.join(temp_dir, "two_step")
+    pipeline_dir = os.path.join(temp_dir, "pipeline")
+    for directory in (two_step_dir, pipeline_dir):
+        os.makedirs(directory)
+        _write_sample(os.path.join(directory, "members.csv"), rows, newline)
+
+    # 2段階の処理（分割した場合は変換後の全体ファイルを削除して比較する）
+    result = detect_and_convert_to_cp932(os.path.join(two_step_dir, "members.csv"))
+    split_files = split_csv_by_size(result['output'], max_size_mb=max_size_mb)
+    if split_files != [result['output']]:
+        os.remove(result['output'])
+
+    pipeline_result = convert_and_split(os.path.join(pipeline_dir, "members.csv"), max_size_mb=max_size_mb)
+
+    files = sorted(os.listdir(two_step_dir))
+    assert files == sorted(os.listdir(pipeline_dir))
+    for name in files:
+        if not name.endswith('_manifest.json'):
+            assert filecmp.cmp(os.path.join(two_step_dir, name), os.path.join(pipeline_dir, name), shallow=False)
+    return pipeline_result
+
+
+def test_convert_and_split_matches_two_step():
+    """
+    変換後のファイルを書き出さずに分割しても、2段階で処理した場合と同じファイルが作成されるか確認する関数
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        result = _run_both(os.path.join(temp_dir, "split"), rows=3000, max_size_mb=0.02, newline='\r\n')
+        assert result['method'] == 'transcode+split'
+        assert len(result['files']) > 1
+        assert not any(path.endswith('members_cp932.csv') for path in result['files'])
+
+        # 分割が不要な場合は _cp932.csv に保存する
+        result = _run_both(os.path.join(temp_dir, "single"), rows=10, max_size_mb=0.02)
+        assert result['method'] == 'transcode'
+        assert [os.path.basename(path) for path in result['files']] == ["members_cp932.csv"]
+
+
+if __name__ == "__main__":
+    test_convert_and_split_matches_two_step()
+    print("テストが完了しました。")
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test script for csv_snapshot_cache.py
+
+キャッシュから読み込んだデータフレーム・カテゴリ行が、CSVを解析した場合と同じになるか、
+ファイルが変わったら古いエントリーを使わずに読み込み直すかを確認する。
+（pyarrow がない環境では、キャッシュを使わずにCSVを読み込むことだけを確認する）
+"""
+
+import contextlib
+import glob
+import io
+import json
+import os
+import tempfile
+
+import pandas as pd
+import pytest
+from pandas.testing import assert_frame_equal
+
+from csv_merge_engine import read_two_row_header_csv
+from csv_processer_for_liny import update_customer_data
+from csv_snapshot_cache import SnapshotCache
+
+
+def _write_export(csv_path, rows):
+    with open(csv_path, 'w', encoding='CP932', newline='') as f:
+        f.write("基本,基本,基本\r\nLINE UserID,フリガナ,メモ\r\n")
+        f.write("".join(f"{key},{name},{memo}\r\n" for key, name, memo in rows))
+
+
+def test_read_from_snapshot():
+    """
+    2回目以降はキャッシュから読み込み、usecols を変えても同じキャッシュを使い、ファイルが変わったら読み込み直すか確認する関数
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        csv_path = os.path.join(temp_dir, "member.csv")
+        _write_export(csv_path, [('U1', 'あ', '"a,b"'), ('U2', '', 'x'), ('', '髙橋', '')])
+        cache = SnapshotCache(os.path.join(temp_dir, "snapshots"))
+
+        for _ in range(2):
+            for kwargs in ({'dtype': str}, {'dtype': str, 'usecols': ['メモ', 'LINE UserID']}, {}):
+                expected = read_two_row_header_csv(csv_path, encoding='CP932', **kwargs)
+                df, category_line, encoding = cache.read_two_row_header_csv(csv_path, encoding='CP932', **kwargs)
+                assert_frame_equal(df, expected[0])
+                assert (category_line, encoding) == expected[1:] == ("基本,基本,基本\r\n", 'CP932')
+            assert_frame_equal(cache.read_csv(csv_path, header=1, encoding='CP932', dtype=str, usecols=['フリガナ']),
+                               pd.read_csv(csv_path, header=1, encoding='CP932', dtype=str, usecols=['フリガナ']))
+        if not cache.enabled:
+            assert cache.entries() == []
+            return
+        # usecols だけが異なる読み込みは同じエントリーを使う
+        assert len(cache.entries()) == 3
+
+        # ファイルが変わったら読み込み直し、同じオプションの古いエントリーは削除する
+        _write_export(csv_path, [('U3', 'い', '')])
+        df, _, _ = cache.read_two_row_header_csv(csv_path, encoding='CP932', dtype=str)
+        assert df['LINE UserID'].tolist() == ['U3']
+        assert len(cache.entries()) == 3
+
+        cache.max_size_bytes = 0
+        assert cache.evict() == 3
+        assert cache.entries() == []
+
+
+def test_parquet_round_trip():
+    """
+    Parquetから読み込んだデータフレームのdtypeがCSVから読み込んだ場合と同じになり、
+    usecols のカラムだけを解析・保存して、足りないカラムが必要になったら解析し直すか確認する関数
+    """
+    pytest.importorskip('pyarrow')
+    with tempfile.TemporaryDirectory() as temp_dir:
+        csv_path = os.path.join(temp_dir, "data.csv")
+        with open(csv_path, 'w', encoding='CP932', newline='') as f:
+            f.write("ID,金額,フラグ,名前,日付\n1,1.5,True,髙橋,2020-01-02\n2,,False,,\n3,2e20,True,a,2021/3/4\n")
+        cache = SnapshotCache(os.path.join(temp_dir, "snapshots"))
+
+        expected = pd.read_csv(csv_path, encoding='CP932')
+        assert [str(dtype) for dtype in expected.dtypes][:3] == ['int64', 'float64', 'bool']
+        for _ in range(2):
+            assert_frame_equal(cache.read_csv(csv_path, encoding='CP932'), expected)
+
+        def stored_columns():
+            columns = []
+            for meta_path in glob.glob(os.path.join(cache.cache_dir, '*.json')):
+                with open(meta_path, 'r', encoding='utf-8') as f:
+                    columns.append(list(json.load(f)['dtypes']))
+            return columns
+
+        # usecols のカラムだけを解析して保存し、足りないカラムは保存済みのカラムと合わせて解析し直す
+        cache.clear()
+        for usecols, stored in ((['名前', 'ID'], ['ID', '名前']), (['金額'], ['ID', '金額', '名前']),
+                                (['ID'], ['ID', '金額', '名前'])):
+            df = cache.read_csv(csv_path, encoding='CP932', dtype=str, usecols=usecols)
+            assert_frame_equal(df, pd.read_csv(csv_path, encoding='CP932', dtype=str, usecols=usecols))
+            assert stored_columns() == [stored]
+        with pytest.raises(ValueError):
+            cache.read_csv(csv_path, encoding='CP932', dtype=str, usecols=['無い列'])
+
+
+def test_merge_output_with_snapshot():
+    """
+    スナップショットキャッシュを使っても、使わない場合と同じ出力・同じ更新統計になるか確認する関数
+    """
+    pytest.importorskip('pyarrow')
+    with tempfile.TemporaryDirectory() as temp_dir:
+        system_a_csv = os.path.join(temp_dir, "kuzen.csv")
+        with open(system_a_csv, 'w', encoding='CP932', newline='') as f:
+            f.write("ID,ユーザーID,お名前,生年月日,メモ\n1,U1,たかはし,2020-01-02,x\n2,U3,,1999-3-4,y\n3,,a,,z\n")
+        system_b_csv = os.path.join(temp_dir, "member.csv")
+        _write_export(system_b_csv, [('U1', 'あ', ''), ('U2', '', 'x'), ('U3', '髙橋', '')])
+        with open(system_b_csv, 'a', encoding='CP932', newline='') as f:
+            f.write("U4,,\r\n")
+        columns_to_update = {'お名前': 'フリガナ', '生年月日': 'メモ'}
+
+        def run(output_name, **kwargs):
+            output_csv = os.path.join(temp_dir, output_name)
+            log = io.StringIO()
+            with contextlib.redirect_stdout(log):
+                update_customer_data(system_a_csv, system_b_csv, output_csv, tags={},
+                                     columns_to_update=columns_to_update, **kwargs)
+            with open(output_csv, 'rb') as f:
+                return f.read(), [line for line in log.getvalue().splitlines() if '件' in line]
+
+        expected = run("expected.csv")
+        snapshots = os.path.join(temp_dir, "snapshots")
+        for attempt in range(2):
+            assert run(f"output{attempt}.csv", snapshot_cache=snapshots) == expected
+        assert len(SnapshotCache(snapshots).entries()) == 2
+
+
+if __name__ == "__main__":
+    test_read_from_snapshot()
+    test_parquet_round_trip()
+    test_merge_output_with_snapshot()
+    print("テストが完了しました。")
@@ -7,10 +7,14 @@ Test script for csv_splitter.py
 This script creates a sample CSV file and tests the split_csv_by_size function.
 """
 
+import csv
+import hashlib
+import json
 import os
 import sys
 import tempfile
-from csv_splitter import split_csv_by_size
+import csv_splitter
+from csv_splitter import split_csv_by_key, split_csv_by_size
 
 def create_test_csv(file_path, size_kb=500, encoding='CP932'):
     """
@@ -98,8 +102,11 @@ def test_split_csv():
                 os.remove(test_csv_path)
                 print(f"\nテスト用ファイル '{test_csv_path}' を削除しました。")
             
-            # 分割されたファイルも削除
+            # 分割されたファイルとマニフェストも削除
             base_name, extension = os.path.splitext(test_csv_path)
+            manifest_path = f"{base_name}_manifest.json"
+            if os.path.exists(manifest_path):
+                os.remove(manifest_path)
             i = 1
             while True:
                 split_file = f"{base_name}_part{i}{extension}"
@@ -112,6 +119,176 @@ def test_split_csv():
         except Exception as e:
             print(f"クリーンアップ中にエラーが発生しました: {e}")
 
+def test_byte_engine_matches_text_engine():
+    """
+    バイト単位の分割エンジンがテキストモードの分割エンジンと同じ出力になるか確認する関数
+    """
+    row = '{},テスト太郎{},test{}@example.com,090-1234-5678,東京都渋谷区テスト町1-2-3'
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        test_csv_path = os.path.join(temp_dir, "test.csv")
+        base_name, extension = os.path.splitext(test_csv_path)
+
+        for newline in ['\n', '\r\n']:
+            lines = [' ID,名前 ', '識別子,氏名'] + [row.format(i, i, i) for i in range(3000)]
+            # 1行だけでサイズ上限を超える行と、末尾に改行のない行を含める
+            lines.insert(1000, 'x' * 20000)
+            with open(test_csv_path, 'wb') as f:
+                f.write(newline.join(lines).encode('CP932'))
+
+            outputs = []
+            for engine in [csv_splitter._split_csv_text, csv_splitter.split_csv_bytes]:
+                split_files = [part['path'] for part in engine(test_csv_path, base_name, extension, 16 * 1024, 'CP932')]
+                contents = []
+                for file_path in split_files:
+                    with open(file_path, 'rb') as f:
+                        contents.append(f.read())
+                    os.remove(file_path)
+                outputs.append(contents)
+
+            assert len(outputs[0]) > 1
+            assert outputs[0] == outputs[1]
+
+
+def test_split_respects_quoted_newlines():
+    """
+    クォートで囲まれたフィールド内の改行ではファイルが分割されないか確認する関数
+    """
+    row = '{},テスト太郎{},"お子さまの性格・モチベーション:\n""明るい""\r\n表現が得意",東京都渋谷区'
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        test_csv_path = os.path.join(temp_dir, "test.csv")
+        base_name, extension = os.path.splitext(test_csv_path)
+        with open(test_csv_path, 'wb') as f:
+            f.write('\n'.join(['ID,名前,メモ,住所', '識別子,氏名,メモ,住所']
+                              + [row.format(i, i) for i in range(2000)]).encode('CP932'))
+
+        for engine in [csv_splitter._split_csv_text, csv_splitter.split_csv_bytes]:
+            split_files = [part['path'] for part in engine(test_csv_path, base_name, extension, 16 * 1024, 'CP932')]
+            assert len(split_files) > 1
+            rows = 0
+            for file_path in split_files:
+                with open(file_path, 'r', encoding='CP932', newline='') as f:
+                    records = list(csv.reader(f))
+                os.remove(file_path)
+                # すべてのレコードが4列のまま（途中で切れていない）
+                assert all(len(record) == 4 for record in records)
+                rows += len(records) - 2
+            assert rows == 2000
+
+
+def test_split_writes_manifest():
+    """
+    分割ファイルごとのデータ行数・バイト数・チェックサムがマニフェストに書き出されるか確認する関数
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        test_csv_path = os.path.join(temp_dir, "test.csv")
+        create_test_csv(test_csv_path, size_kb=300)
+
+        split_files = split_csv_by_size(test_csv_path, max_size_mb=0.05, workers=4)
+        assert len(split_files) > 1
+
+        with open(os.path.join(temp_dir, "test_manifest.json"), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        assert [part['path'] for part in manifest['parts']] == split_files
+
+        total_rows = 0
+        for part in manifest['parts']:
+            with open(part['path'], 'rb') as f:
+                data = f.read()
+            assert len(data) == part['bytes']
+            assert hashlib.sha256(data).hexdigest() == part['sha256']
+            assert data.count(b'\n') - 2 == part['rows']
+            total_rows += part['rows']
+
+        with open(test_csv_path, 'rb') as f:
+            assert total_rows == f.read().count(b'\n') - 2
+
+
+def test_split_csv_by_key():
+    """
+    列の値で分割した場合に、同じ値のレコードが同じパーティションに入り、サイズ制限も守られるか確認する関数
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        test_csv_path = os.path.join(temp_dir, "test.csv")
+        create_test_csv(test_csv_path, size_kb=300)
+        max_size_mb = 0.02
+
+        partitioned_files = split_csv_by_key(test_csv_path, '氏名', partitions=3, max_size_mb=max_size_mb)
+        # 2行目の列名「氏名」は1行目の「名前」列（値はすべて異なる）を指す
+        assert set(partitioned_files) <= {'key1', 'key2', 'key3'}
+
+        partition_of = {}
+        total_rows = 0
+        for label, file_paths in partitioned_files.items():
+            for file_path in file_paths:
+                assert os.path.getsize(file_path) <= max_size_mb * 1024 * 1024
+                with open(file_path, 'r', encoding='CP932', newline='') as f:
+                    rows = list(csv.reader(f))
+                assert rows[:2] == [["ID", "名前", "メールアドレス", "電話番号", "住所"],
+                                    ["識別子", "氏名", "連絡先", "連絡先", "住所情報"]]
+                for row in rows[2:]:
+                    assert partition_of.setdefault(row[1], label) == label
+                total_rows += len(rows) - 2
+
+        with open(test_csv_path, 'rb') as f:
+            assert total_rows == f.read().count(b'\n') - 2
+
+        # 値ごとに分割する場合は、パーティション名が列の値（校舎のタグ）になる
+        schools = ['池袋校', '渋谷校', '新宿校', '横浜校', '']
+        tag_csv_path = os.path.join(temp_dir, "tags.csv")
+        with open(tag_csv_path, 'w', encoding='CP932', newline='') as f:
+            f.write("基本,基本,タグ\nID,名前,校舎=校舎名のタグで1\n")
+            f.write("".join(f"{i},テスト太郎{i},{schools[i % 5]}\n" for i in range(6000)))
+            f.write('6000,"テスト\n太郎",池袋校\n')
+
+        # 同時に開くファイル数を値の種類より少なくしても、閉じたファイルに追記して同じ内容になる
+        partitioned_files = split_csv_by_key(tag_csv_path, '校舎=校舎名のタグで1', max_size_mb=max_size_mb,
+                                             manifest=False, max_open_files=2)
+        assert set(partitioned_files) == {'池袋校', '渋谷校', '新宿校', '横浜校', 'blank_1271cf25'}
+        for label, file_paths in partitioned_files.items():
+            school = '' if label.startswith('blank_') else label
+            rows = []
+            for file_path in file_paths:
+                assert os.path.getsize(file_path) <= max_size_mb * 1024 * 1024
+                with open(file_path, 'r', encoding='CP932', newline='') as f:
+                    rows.extend(list(csv.reader(f))[2:])
+            expected = [[str(i), f"テスト太郎{i}", school] for i in range(6000) if schools[i % 5] == school]
+            if school == '池袋校':
+                expected.append(['6000', "テスト\n太郎", '池袋校'])
+            assert rows == expected
+        assert not [name for name in os.listdir(temp_dir) if name.endswith('.tmp')]
+
+
+def test_split_csv_by_key_labels():
+    """
+    ファイル名に使えない文字を置き換えると同じになる値や、空の値と 'blank' が、別のパーティションに入るか確認する関数
+    """
+    values = ['a/b', 'a_b', 'a b', '', 'blank', 'a/b']
+    with tempfile.TemporaryDirectory() as temp_dir:
+        test_csv_path = os.path.join(temp_dir, "values.csv")
+        with open(test_csv_path, 'w', encoding='CP932', newline='') as f:
+            f.write("基本,基本\nID,値\n")
+            f.write("".join(f"{i},{value}\n" for i, value in enumerate(values)))
+
+        partitioned_files = split_csv_by_key(test_csv_path, '値', manifest=False)
+        assert len(partitioned_files) == 5
+        assert {'a_b', 'blank'} <= set(partitioned_files)
+        partition_of = {}
+        for label, file_paths in partitioned_files.items():
+            assert len(file_paths) == 1
+            with open(file_paths[0], 'r', encoding='CP932', newline='') as f:
+                for row in list(csv.reader(f))[2:]:
+                    assert partition_of.setdefault(row[1], label) == label
+        assert sorted(partition_of) == sorted(set(values))
+        assert len(set(partition_of.values())) == 5
+
+        # ハッシュを付けた名前と同じ値があれば、同じファイルに混ぜずにエラーにする
+        with open(test_csv_path, 'a', encoding='CP932', newline='') as f:
+            f.write(f"6,{partition_of['a/b']}\n")
+        assert split_csv_by_key(test_csv_path, '値', manifest=False) == {}
+
+
 if __name__ == "__main__":
     print("CSV Splitterのテストを開始します...\n")
     test_split_csv()
\ No newline at end of file